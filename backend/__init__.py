@@ -21,6 +21,9 @@ data_source_manager = None  # type: DataSourceManager
 # REDIS
 redis = None
 
+# Cache of command executions
+execution_cache = None  # type: ExecutionCache
+
 # Case sensitive
 case_sensitive = False
 
@@ -4,18 +4,22 @@ from backend.common.helper import create_dictionary
 
 def parse_line(item, fields):
     """
-    Convert fields from a line to AST
+    Convert fields from a line to AST. ASTs obtained when the command was parsed ("_asts") are reused
 
     :param item:
     :param fields:
     :return:
     """
     asts = {}
+    parsed = item.get("_asts", {})
     for f, v in item.items():
         if not f.startswith("_"):
-            field = fields[f]
-            # Parse (success is guaranteed because of the first pass dedicated to parsing)
-            asts[f] = parser_field_parsers.string_to_ast(field.parser, v)
+            if f in parsed:
+                asts[f] = parser_field_parsers.ast_from_json(parsed[f])
+            else:
+                field = fields[f]
+                # Parse (success is guaranteed because of the first pass dedicated to parsing)
+                asts[f] = parser_field_parsers.string_to_ast(field.parser, v)
     return asts
 
 
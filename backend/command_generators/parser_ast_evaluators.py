@@ -6,7 +6,11 @@ https://gist.github.com/cynici/5865326
 
 """
 import importlib
-from typing import Dict
+import threading
+from collections import OrderedDict
+from typing import Dict, Callable, Union, Optional, Set, Mapping
+
+import numpy as np
 from pyparsing import quotedString
 
 from backend.model_services import State
@@ -291,6 +295,381 @@ def ast_evaluator(exp: Dict, state: State, obj, issue_lst, evaluation_type="nume
     return val, unresolved_vars
 
 
+# #################################################################################################################### #
+
+# Compilation of ASTs. The AST is walked once, producing a closure per node. Constants, names of variables, operators
+# and global functions are resolved at compile time, so evaluating the closure many times (one per scenario and time
+# period, for instance) only does the computation. The result is the one of "ast_evaluator" with
+# evaluation_type="numeric", except for unary operators ("-5", "NOT a"), which "ast_evaluator" cannot evaluate
+
+_arithmetic_ops = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "u+": lambda a, b: a + b,
+    "u-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+    "//": lambda a, b: a // b,
+    "%": lambda a, b: a % b,
+}
+
+
+def _compile_operation(exp: Dict):
+    t = exp["type"]
+    unary = t in ("u+", "u-", "not")
+    terms = [_compile(e) for e in exp["terms"][1:]]
+    if not unary:
+        first = _compile(exp["terms"][0])
+    ops = [op.lower() for op in exp["ops"]]
+    op_functions = []
+    for op in ops:
+        if op in ("+", "-", "u+", "u-"):
+            additive = True
+        elif op in ("*", "/", "//", "%"):
+            additive = False
+        else:
+            additive = None
+        if op in ("not", "unot"):
+            op_functions.append((additive, lambda a, b: not bool(b)))
+        elif op == "and":
+            op_functions.append((additive, lambda a, b: a and b))
+        elif op == "or":
+            op_functions.append((additive, lambda a, b: a or b))
+        elif additive is None:
+            op_functions.append((additive, opMap[op]))
+        else:
+            op_functions.append((additive, _arithmetic_ops[op]))
+
+    def evaluate(state, obj, issue_lst):
+        unresolved_vars = set()
+        if unary:
+            current, tmp1 = 0, ()
+        else:
+            current, tmp1 = first(state, obj, issue_lst)
+            unresolved_vars.update(tmp1)
+        for term, (additive, fn) in zip(terms, op_functions):
+            following, tmp2 = term(state, obj, issue_lst)
+            unresolved_vars.update(tmp2)
+            if len(tmp1) == 0 and len(tmp2) == 0:
+                # Type casting for primitive types (as in "ast_evaluator")
+                if (isinstance(current, (int, float)) and isinstance(following, (int, float))) or \
+                        (isinstance(current, bool) and isinstance(following, bool)) or \
+                        (isinstance(current, str) and isinstance(following, str)):
+                    pass
+                else:
+                    following = type(current)(following)
+                if additive:
+                    current = fn(0 if current is None else current, 0 if following is None else following)
+                elif additive is False:
+                    current = fn(1 if current is None else current, 1 if following is None else following)
+                else:
+                    current = fn(current, following)
+            else:
+                current = None  # Could not evaluate because there are missing variables
+        return current, unresolved_vars
+
+    return evaluate
+
+
+def _compile_h_var(exp: Dict):
+    namespace = exp.get("ns", None)
+    parts = []
+    for o in exp["parts"]:
+        if isinstance(o, str):
+            parts.append(o)
+        else:
+            # Function call or dataset access. Global ones (no object yet) are looked up in the namespace
+            parts.append((_compile(dict(o, ns=namespace)), _compile(o)))
+    full_name = (namespace + "::" if namespace else "")
+
+    def evaluate(state, obj, issue_lst):
+        unresolved_vars = set()
+        obj = None
+        for o in parts:
+            if isinstance(o, str):
+                if obj is None:
+                    obj = state.get(o, namespace)
+                    if not obj:
+                        issue_lst.append((3, "'" + o + "' is not globally declared in namespace '" + (namespace if namespace else "default") + "'"))
+                        unresolved_vars.add(full_name + o)
+                elif isinstance(obj, ExternalDataset):
+                    if o in obj.get_columns() or o in obj.get_dimensions():
+                        obj = obj.get_data(o, None)
+                    else:
+                        issue_lst.append((3, "'" + o + "' is not a measure or dimension of the dataset."))
+                else:
+                    try:
+                        obj = getattr(obj, o)
+                    except:
+                        issue_lst.append((3, "'" + o + "' is not a ."))
+            else:
+                obj = o[0 if obj is None else 1](state, obj, issue_lst)
+        return obj, unresolved_vars
+
+    return evaluate
+
+
+def _compile_function(exp: Dict):
+    name = exp["name"]
+    params = [_compile(p) for p in exp["params"]]
+    func = None
+    global_kwargs = None
+    if name in global_functions:
+        _f = global_functions[name]
+        mod_name, func_name = _f["full_name"].rsplit('.', 1)
+        func = getattr(importlib.import_module(mod_name), func_name)
+        global_kwargs = _f["kwargs"]
+
+    def evaluate(state, obj, issue_lst):
+        args = []
+        kwargs = {}
+        unresolved_vars = set()
+        for p in params:
+            p = p(state, obj, issue_lst)
+            if len(p) == 3:
+                kwargs[p[0]] = p[1]
+            else:
+                args.append(p[0])
+            unresolved_vars.update(p[-1])
+        if obj is None:
+            if len(unresolved_vars) == 0 and func:
+                if global_kwargs:
+                    kwargs.update(global_kwargs)
+                obj = func(*args, **kwargs)
+        else:
+            # Call local function (a "method")
+            try:
+                obj = getattr(obj, name)(*args, **kwargs)
+            except:
+                obj = None
+        return obj, unresolved_vars
+
+    return evaluate
+
+
+def _compile_conditions(exp: Dict):
+    conditions = [(_compile(c["if"]), _compile(c["then"])) for c in exp["parts"]]
+
+    def evaluate(state, obj, issue_lst):
+        unresolved_vars = set()
+        for if_part, then_part in conditions:
+            if_result, tmp = if_part(state, obj, issue_lst)
+            unresolved_vars.update(tmp)
+            if len(tmp) == 0 and if_result:
+                then_result, tmp = then_part(state, obj, issue_lst)
+                unresolved_vars.update(tmp)
+                if len(tmp) > 0:
+                    then_result = None
+                if then_result:
+                    return then_result, unresolved_vars
+        return None, unresolved_vars
+
+    return evaluate
+
+
+def _compile(exp: Dict):
+    """ Closure (state, obj, issue_lst) -> (value, unresolved variables) evaluating the AST "exp" """
+    t = exp.get("type") if isinstance(exp, dict) else None
+    if t in ("int", "float", "str", "boolean"):
+        value = exp["value"]
+        return lambda state, obj, issue_lst: (value, set())
+    elif t == "reference":
+        value = "[" + exp["ref_id"] + "]"
+        return lambda state, obj, issue_lst: (value, set())
+    elif t == "h_var":
+        return _compile_h_var(exp)
+    elif t in ("u+", "u-", "multipliers", "adders", "comparison", "not", "and", "or"):
+        return _compile_operation(exp)
+    elif t == "function":
+        return _compile_function(exp)
+    elif t == "conditions":
+        return _compile_conditions(exp)
+    elif t == "named_parameter":
+        param, value = exp["param"], _compile(exp["value"])
+
+        def evaluate(state, obj, issue_lst):
+            v, unresolved_vars = value(state, obj, issue_lst)
+            return param, v, unresolved_vars
+        return evaluate
+    else:
+        # Not compiled (datasets, key-value lists, ...)
+        return lambda state, obj, issue_lst: ast_evaluator(exp, state, obj, issue_lst)
+
+
+def compile_ast(exp: Dict) -> Callable:
+    """
+    Compile the AST of an expression ("expression_with_parameters" rule) into a function, to evaluate it many times
+
+    :param exp: Dictionary representing the AST (output of "string_to_ast" function)
+    :return: A function (state, issue_lst=None) -> (value, set of unresolved variables). Like "ast_evaluator", with
+             evaluation_type="numeric". The AST is in its attribute "ast"
+    """
+    evaluate = _compile(exp)
+
+    def compiled(state: State, issue_lst=None):
+        return evaluate(state, None, issue_lst if issue_lst is not None else [])
+
+    compiled.ast = exp
+    return compiled
+
+
+_compiled_expressions = OrderedDict()  # Expression (string) or id(AST) -> (expression, compiled function)
+_compiled_expressions_lock = threading.Lock()
+compiled_expressions_max_size = 10000
+
+
+def compiled_expression(expression: Union[str, Dict]) -> Callable:
+    """
+    Compiled function of an expression, kept for subsequent calls. ASTs are identified by identity, so they must not
+    be modified after the first call
+
+    :param expression: String ("expression_with_parameters" rule) or AST
+    :return: The function (see "compile_ast")
+    """
+    key = expression if isinstance(expression, str) else id(expression)
+    with _compiled_expressions_lock:
+        entry = _compiled_expressions.get(key)
+        if entry and (entry[0] == expression if isinstance(expression, str) else entry[0] is expression):
+            _compiled_expressions.move_to_end(key)
+            return entry[1]
+    if isinstance(expression, str):
+        compiled = compile_ast(string_to_ast(expression_with_parameters, expression))
+    else:
+        compiled = compile_ast(expression)
+    with _compiled_expressions_lock:
+        # The expression is kept in the entry, so the id of an AST is not reused while the entry exists
+        _compiled_expressions[key] = (expression, compiled)
+        while len(_compiled_expressions) > compiled_expressions_max_size:
+            _compiled_expressions.popitem(last=False)
+    return compiled
+
+
+def ast_variables(exp) -> Set[str]:
+    """
+    Names of the variables mentioned in an AST (first part of hierarchical names, prefixed by the namespace if any)
+
+    :param exp: Dictionary representing the AST
+    :return: Set of names
+    """
+    res = set()
+    if isinstance(exp, dict):
+        if exp.get("type") == "h_var":
+            parts = exp["parts"]
+            if parts and isinstance(parts[0], str):
+                ns = exp.get("ns", None)
+                res.add(ns + "::" + parts[0] if ns else parts[0])
+            for o in parts:
+                res.update(ast_variables(o))
+        else:
+            for v in exp.values():
+                res.update(ast_variables(v))
+    elif isinstance(exp, (list, tuple)):
+        for v in exp:
+            res.update(ast_variables(v))
+    return res
+
+
+# Vectorized compilation. The function evaluates the expression for many sets of values at once: variables are NumPy
+# vectors (one element per scenario, for instance). Only numeric and boolean expressions on simple names are supported
+
+_vector_ops = {
+    "+": np.add, "-": np.subtract, "u+": np.add, "u-": np.subtract,
+    "*": np.multiply, "/": np.true_divide, "//": np.floor_divide, "%": np.remainder,
+    "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+    "==": np.equal, "=": np.equal, "!=": np.not_equal, "<>": np.not_equal,
+    "and": lambda a, b: np.where(np.asarray(a, dtype=bool), b, a),
+    "or": lambda a, b: np.where(np.asarray(a, dtype=bool), a, b),
+    "not": lambda a, b: np.logical_not(np.asarray(b, dtype=bool)),
+    "unot": lambda a, b: np.logical_not(np.asarray(b, dtype=bool)),
+}
+
+
+def _as_number(a):
+    """ Booleans are numbers in arithmetic operations (True + True == 2) """
+    a = np.asarray(a)
+    return a.astype(np.int64) if a.dtype == bool else a
+
+
+def _compile_vectorized(exp) -> Optional[Callable]:
+    t = exp.get("type") if isinstance(exp, dict) else None
+    if t in ("int", "float", "boolean"):
+        value = exp["value"]
+        return lambda values: value
+    elif t == "h_var":
+        if len(exp["parts"]) != 1 or not isinstance(exp["parts"][0], str) or exp.get("ns", None):
+            return None
+        name = exp["parts"][0]
+        return lambda values: values[name]
+    elif t in ("u+", "u-", "multipliers", "adders", "comparison", "not", "and", "or"):
+        unary = t in ("u+", "u-", "not")
+        terms = [_compile_vectorized(e) for e in (exp["terms"][1:] if unary else exp["terms"])]
+        ops = [op.lower() for op in exp["ops"]]
+        if any(term is None for term in terms) or any(op not in _vector_ops for op in ops):
+            return None
+        if unary:
+            terms.insert(0, lambda values: 0)
+        arithmetic = [op in ("+", "-", "u+", "u-", "*", "/", "//", "%") for op in ops]
+        ops = [_vector_ops[op] for op in ops]
+
+        def evaluate(values):
+            current = terms[0](values)
+            for term, op, is_arithmetic in zip(terms[1:], ops, arithmetic):
+                following = term(values)
+                if is_arithmetic:
+                    current, following = _as_number(current), _as_number(following)
+                current = op(current, following)
+            return current
+        return evaluate
+    elif t == "function":
+        f = global_functions.get(exp["name"])
+        func = getattr(np, f["full_name"].rsplit('.', 1)[1], None) if f and not f["kwargs"] else None
+        params = [_compile_vectorized(p) for p in exp["params"]]
+        if not func or any(p is None for p in params):
+            return None
+        return lambda values: func(*[p(values) for p in params])
+    elif t == "conditions":
+        conditions = [(_compile_vectorized(c["if"]), _compile_vectorized(c["then"])) for c in exp["parts"]]
+        if any(c is None or v is None for c, v in conditions):
+            return None
+
+        def evaluate(values):
+            masks = []
+            choices = []
+            for if_part, then_part in conditions:
+                then_value = then_part(values)
+                # The first condition which is True AND has a value (as "ast_evaluator")
+                masks.append(np.logical_and(np.asarray(if_part(values), dtype=bool),
+                                            np.asarray(then_value, dtype=bool)))
+                choices.append(np.asarray(then_value, dtype=float))
+            # No condition met: NaN (no value)
+            return np.select(np.broadcast_arrays(*masks), np.broadcast_arrays(*choices), default=np.nan)
+        return evaluate
+    return None
+
+
+def compile_ast_vectorized(exp: Dict) -> Optional[Callable]:
+    """
+    Compile the AST of an expression into a function evaluating it over vectors of values
+
+    :param exp: Dictionary representing the AST (output of "string_to_ast" function)
+    :return: None if the expression is not supported (strings, references, datasets, hierarchical names, ...). Else,
+             a function (values, size) -> NumPy vector of "size" elements, where "values" maps variable names to
+             vectors of "size" elements. It raises FloatingPointError on divisions by zero or invalid operations
+    """
+    evaluate = _compile_vectorized(exp)
+    if evaluate is None:
+        return None
+
+    def compiled(values: Mapping[str, np.ndarray], size: int):
+        with np.errstate(divide="raise", invalid="raise", over="raise"):
+            res = np.asarray(evaluate(values))
+        if res.ndim == 0:
+            res = np.full(size, res.item())
+        return res
+
+    return compiled
+
+
 def ast_to_string(exp):
     """
     Elaborate string from expression AST
@@ -5,6 +5,10 @@ Ideas for expression rules copied/adapted from:
 https://gist.github.com/cynici/5865326
 
 """
+import copy
+import re
+import threading
+from collections import OrderedDict
 from functools import partial
 
 import pyparsing
@@ -523,10 +527,201 @@ url_parser = (
 # #################################################################################################################### #
 
 
+def copy_ast(ast):
+    """ Copy of an AST (nested dicts, lists, tuples and sets of scalars), faster than "copy.deepcopy" """
+    if isinstance(ast, (str, int, float, type(None))):
+        return ast
+    elif isinstance(ast, dict):
+        return {k: copy_ast(v) for k, v in ast.items()}
+    elif isinstance(ast, list):
+        return [copy_ast(v) for v in ast]
+    elif isinstance(ast, tuple):
+        return tuple(copy_ast(v) for v in ast)
+    elif isinstance(ast, set):
+        return set(ast)
+    return copy.deepcopy(ast)
+
+
+def ast_to_json(ast):
+    """
+    JSON compatible form of an AST, so it can be stored in the content of a command. Tuples and sets are tagged
+    ({"@t": [...]}, {"@s": [...]}) to be restored by "ast_from_json"
+
+    :param ast: The AST
+    :return: The JSON compatible form. TypeError if the AST contains something else (not serializable)
+    """
+    if isinstance(ast, (str, int, float, type(None))):
+        return ast
+    elif isinstance(ast, dict):
+        if not all(isinstance(k, str) for k in ast):
+            raise TypeError(f"AST with non string keys: {ast}")
+        return {k: ast_to_json(v) for k, v in ast.items()}
+    elif isinstance(ast, list):
+        return [ast_to_json(v) for v in ast]
+    elif isinstance(ast, tuple):
+        return {"@t": [ast_to_json(v) for v in ast]}
+    elif isinstance(ast, (set, frozenset)):
+        return {"@s": [ast_to_json(v) for v in ast]}
+    raise TypeError(f"AST element of type {type(ast)} cannot be converted to JSON")
+
+
+def ast_from_json(j):
+    """ Inverse of "ast_to_json" """
+    if isinstance(j, dict):
+        if len(j) == 1:
+            if "@t" in j:
+                return tuple(ast_from_json(v) for v in j["@t"])
+            elif "@s" in j:
+                return set(ast_from_json(v) for v in j["@s"])
+        return {k: ast_from_json(v) for k, v in j.items()}
+    elif isinstance(j, list):
+        return [ast_from_json(v) for v in j]
+    return j
+
+
+class ASTCache:
+    """
+    Process wide cache of the results of "string_to_ast", least recently used are evicted
+
+    The key is the rule and the (cleaned) input string. Syntax errors (ParseException) are cached too. The ASTs are
+    copied when they are read from the cache, so callers may modify them
+    """
+    def __init__(self, max_size: int=20000):
+        """
+        :param max_size: Maximum number of entries. 0 disables the cache
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (rule, input) -> AST or ParseException
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, rule: ParserElement, input_: str):
+        """
+        :return: The AST (a copy), None if it is not in the cache. If the input is not valid, the ParseException is raised
+        """
+        with self._lock:
+            entry = self._entries.get((rule, input_))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((rule, input_))
+            self.hits += 1
+        if isinstance(entry, pyparsing.ParseException):
+            raise entry.with_traceback(None)
+        return copy_ast(entry)
+
+    def put(self, rule: ParserElement, input_: str, ast):
+        """
+        :param ast: The AST (it is copied) or the ParseException
+        """
+        if not self.enabled:
+            return
+        if not isinstance(ast, pyparsing.ParseException):
+            ast = copy_ast(ast)
+        with self._lock:
+            self._entries[(rule, input_)] = ast
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+ast_cache = ASTCache()
+
+
+# Fast paths. Most values are numbers, identifiers or (hierarchical) names. For some rules, these shapes are
+# recognized with a regular expression, producing exactly the AST the rule would produce. Anything else -the
+# function returns None- is parsed by the rule (see "string_to_ast")
+_ident = r"[A-Za-z][A-Za-z0-9_]*"
+_h_name_re = re.compile(rf"{_ident}(?:\.{_ident})*")
+_ident_re = re.compile(_ident)
+_int_re = re.compile(r"[0-9]+")
+_float_re = re.compile(r"[0-9]+(?:\.[0-9]+)?[Ee][+-]?[0-9]+|[0-9]+\.[0-9]+")
+_factor_name_re = re.compile(rf"({_ident}(?:\.{_ident})*)(?::({_ident}(?:\.{_ident})*))?")
+_processor_name_part_re = re.compile(r"([A-Za-z0-9]+)([A-Za-z0-9_]*)")
+_processor_name_re = re.compile(r"[A-Za-z0-9][A-Za-z0-9_]*(?:\.[A-Za-z0-9][A-Za-z0-9_]*)*")
+_code_string_re = re.compile(r"[A-Za-z0-9_-]+")
+_boolean_keywords = ("True", "False")
+
+
+def _fast_number(s: str):
+    if _int_re.fullmatch(s):
+        return {'type': 'int', 'value': int(s)}
+    elif _float_re.fullmatch(s):
+        return {'type': 'float', 'value': float(s)}
+
+
+def _fast_expression_with_parameters(s: str):
+    if _h_name_re.fullmatch(s):
+        if s in _boolean_keywords:
+            return None
+        return {'type': 'h_var', 'parts': s.split(".")}
+    return _fast_number(s)
+
+
+def _fast_expression(s: str):
+    if _h_name_re.fullmatch(s):
+        return {'type': 'h_var', 'ns': None, 'parts': s.split(".")}
+    return _fast_number(s)
+
+
+def _fast_processor_name(s: str, node_type: str):
+    if _processor_name_re.fullmatch(s):
+        parts = []
+        for i, part in enumerate(s.split(".")):
+            if i > 0:
+                parts.append(("separator", "."))
+            literal, rest = _processor_name_part_re.fullmatch(part).groups()
+            parts.append(("literal", literal))
+            if rest:
+                parts.append(("literal", rest))
+        return dict(type=node_type, parts=parts, variables=set(), input=s, expandable=False, complex=False)
+
+
+def _fast_factor_name(s: str):
+    m = _factor_name_re.fullmatch(s)
+    if m:
+        return {'type': 'pf_name',
+                'processor': {'type': 'h_var', 'parts': m.group(1).split(".")},
+                'factor': {'type': 'h_var', 'parts': m.group(2).split(".")} if m.group(2) else None}
+
+
+def _fast_unquoted_string(s: str):
+    # Tabs are expanded by the grammar ("parseWithTabs" is not used)
+    if s and not s[0].isspace() and "\n" not in s and "\r" not in s and "\t" not in s:
+        return s
+
+
+fast_paths = {
+    simple_ident: lambda s: s if _ident_re.fullmatch(s) else None,
+    simple_h_name: lambda s: {'type': 'h_var', 'parts': s.split(".")} if _h_name_re.fullmatch(s) else None,
+    code_string: lambda s: s if _code_string_re.fullmatch(s) else None,
+    reference: lambda s: {'type': 'reference', 'ref_id': s} if _ident_re.fullmatch(s) else None,
+    unquoted_string: _fast_unquoted_string,
+    factor_name: _fast_factor_name,
+    processor_name: partial(_fast_processor_name, node_type="processor_name"),
+    processor_names: partial(_fast_processor_name, node_type="processor_names"),
+    expression_with_parameters: _fast_expression_with_parameters,
+    expression: _fast_expression,
+}
+
+
 def string_to_ast(rule: ParserElement, input_: str) -> Dict:
     """
     Convert the input string "input_" into an AST, according to "rule"
 
+    Common shapes of values are recognized by "fast_paths". Results of the rule are kept in "ast_cache"
+
     :param rule:
     :param input_:
     :return: a dictionary conforming the AST (the format changes from rule to rule)
@@ -544,10 +739,27 @@ def string_to_ast(rule: ParserElement, input_: str) -> Dict:
             replace('€', 'eur'). \
             replace('$', 'usd')
 
-    res = rule.parseString(clean_str(input_), parseAll=True)
+    input_ = clean_str(input_)
+    fast_path = fast_paths.get(rule)
+    if fast_path:
+        res = fast_path(input_)
+        if res is not None:
+            return res
+
+    if ast_cache.enabled:
+        res = ast_cache.get(rule, input_)
+        if res is not None:
+            return res
+
+    try:
+        res = rule.parseString(input_, parseAll=True)
+    except pyparsing.ParseException as e:
+        ast_cache.put(rule, input_, e)
+        raise
     res = res.asList()[0]
     while isinstance(res, list):
         res = res[0]
+    ast_cache.put(rule, input_, res)
     return res
 
 
@@ -10,7 +10,7 @@ import backend
 from backend import Issue
 from backend.command_executors import create_command
 from backend.command_generators.parser_spreadsheet_utils import binary_mask_from_worksheet, \
-    obtain_rectangular_submatrices
+    obtain_rectangular_submatrices, worksheet_fingerprint, worksheet_to_array
 from backend.common.helper import create_dictionary, first
 from backend.command_definitions import valid_v2_command_names, commands
 from backend.command_generators.spreadsheet_command_parsers_v2 import parse_command
@@ -55,19 +55,26 @@ def handle_import_commands(r):
 # ############################### #
 
 
-def commands_generator_from_ooxml_file(input, state, sublist, stack) -> backend.ExecutableCommandIssuesPairType:
+def commands_generator_from_ooxml_file(input, state, sublist, stack, worksheet_hook=None) -> backend.ExecutableCommandIssuesPairType:
     """
     It reads an Office Open XML input
     Yields a sequence of command_executors
 
+    "worksheet_hook(sheet_number, sheet_name, fingerprint)" is called before reading each worksheet, when the commands
+    of the previous worksheets have been consumed. "fingerprint" is a digest of the worksheet contents, or None if
+    its commands depend on something else (imported files). If the hook returns True the worksheet is not parsed
+    (its effect is already known by the caller), except "ListOfCommands", which changes how the following worksheets
+    are read, although its result is not yielded either
+
     :param input: A bytes input
     :param state: State used to check variables
     :param sublist: List of worksheets to consider
     :param stack: Stack of nested files. Just pass it...
+    :param worksheet_hook: Function called before reading each worksheet, to skip it
     :return:
     """
-    # Start the Excel reader
-    workbook = openpyxl.load_workbook(io.BytesIO(input), data_only=True)
+    # Start the Excel reader. Read only mode: each worksheet is streamed once into an array of values
+    workbook = openpyxl.load_workbook(io.BytesIO(input), data_only=True, read_only=True)
 
     # Command names (for the "list of commands" command)
     command_names = create_dictionary(data={cmd_name: None for cmd_name in valid_v2_command_names})
@@ -87,7 +94,7 @@ def commands_generator_from_ooxml_file(input, state, sublist, stack) -> backend.
 
         issues = []
         total_issues: List[Issue] = []
-        sheet = workbook[sheet_name]
+        sheet = worksheet_to_array(workbook[sheet_name])
 
         c_label: str = None
         c_content = None
@@ -98,6 +105,18 @@ def commands_generator_from_ooxml_file(input, state, sublist, stack) -> backend.
         if name in worksheet_to_command:
             name = worksheet_to_command[name]
 
+        # Find which COMMAND to parse
+        cmd: Optional[backend.Command] = first(commands, condition=lambda c: c.regex.search(name))
+
+        c_type: str = cmd.name if cmd else None
+
+        skipped = False
+        if worksheet_hook:
+            fingerprint = worksheet_fingerprint(sheet) if c_type != "import_commands" else None
+            skipped = worksheet_hook(sheet_number, sheet_name, fingerprint)
+            if skipped and c_type != "list_of_commands":
+                continue
+
         # Extract worksheet matrices
         m = binary_mask_from_worksheet(sheet, False)
         t = obtain_rectangular_submatrices(m, only_remove_empty_bottom=True)
@@ -109,10 +128,7 @@ def commands_generator_from_ooxml_file(input, state, sublist, stack) -> backend.
 
         # v = worksheet_to_numpy_array(sheet)
 
-        # Find which COMMAND to parse, then parse it
-        cmd: Optional[backend.Command] = first(commands, condition=lambda c: c.regex.search(name))
-
-        c_type: str = cmd.name if cmd else None
+        # Parse the COMMAND
         if not c_type:
             total_issues.append(Issue(sheet_number, sheet_name, None, 2,
                                 f"The worksheet name '{sheet_name}' has not a supported command associated. Skipped."))
@@ -227,7 +243,10 @@ def commands_generator_from_ooxml_file(input, state, sublist, stack) -> backend.
             print(issues)  # Convenient for debugging purposes
             cmd = None  # cmd, _ = create_command(c_type, c_label, {}, sh_name)
 
-        yield cmd, total_issues
+        if not skipped:
+            yield cmd, total_issues
+
+    workbook.close()
     # yield from []  # Empty generator
 
 
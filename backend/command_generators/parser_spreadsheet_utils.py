@@ -1,10 +1,149 @@
+import hashlib
+import re
+from collections import namedtuple
+from typing import List
+
 import numpy as np
 import openpyxl
+from openpyxl.cell.read_only import ReadOnlyCell
+from openpyxl.cell.text import Text
 from openpyxl.comments import Comment
 from openpyxl.styles import PatternFill
+from openpyxl.utils import column_index_from_string
+from openpyxl.worksheet.read_only import ReadOnlyWorksheet
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
 
 global_fill = PatternFill("none")
 
+# Elements of the XML of a worksheet
+_ROW_TAG = "{%s}row" % SHEET_MAIN_NS
+_CELL_TAG = "{%s}c" % SHEET_MAIN_NS
+_VALUE_TAG = "{%s}v" % SHEET_MAIN_NS
+_INLINE_STRING_TAG = "{%s}is" % SHEET_MAIN_NS
+_MERGE_CELL_TAG = "{%s}mergeCell" % SHEET_MAIN_NS
+_FLOAT_REGEX = re.compile(r"\.|[Ee]")  # Number stored as float (like openpyxl)
+
+ArrayCell = namedtuple("ArrayCell", "value")
+_EMPTY_CELL = ArrayCell(None)
+
+
+class WorksheetArray:
+    """
+    Values of a worksheet, read once into a dense 2D NumPy array (dtype object, None for empty cells)
+
+    It offers the part of the openpyxl Worksheet interface used by the command parsers ("title", "max_row",
+    "max_column", "cell(row, column).value", "iter_rows()", "merged_cell_ranges"), so they can read it unchanged. Hot
+    loops can read "values" directly (indices starting at 0)
+    """
+    def __init__(self, title: str, values: np.ndarray, merged_cell_ranges: List[str]=None):
+        self.title = title
+        self.values = values
+        self.merged_cell_ranges = merged_cell_ranges if merged_cell_ranges else []
+
+    @property
+    def max_row(self):
+        return self.values.shape[0]
+
+    @property
+    def max_column(self):
+        return self.values.shape[1]
+
+    def cell(self, row: int, column: int) -> ArrayCell:
+        """ Cell at "row", "column" (starting at 1, like openpyxl). Cells outside the array are empty """
+        if 0 < row <= self.values.shape[0] and 0 < column <= self.values.shape[1]:
+            return ArrayCell(self.values[row - 1, column - 1])
+        return _EMPTY_CELL
+
+    def iter_rows(self):
+        for row in self.values:
+            yield tuple(ArrayCell(v) for v in row)
+
+
+def worksheet_to_array(sh_in) -> WorksheetArray:
+    """
+    Read the values of a worksheet into a WorksheetArray
+
+    Worksheets of workbooks opened in read only mode are streamed: their XML is parsed once, visiting only the cells
+    present in it (the declared dimension, which can be the whole sheet, is not used). The array covers the cells
+    having a value and the merged ranges, so time and memory are proportional to the used cells
+
+    :param sh_in: Worksheet, preferably a ReadOnlyWorksheet
+    :return: WorksheetArray
+    """
+    if not isinstance(sh_in, ReadOnlyWorksheet):
+        rows = [[c.value for c in row] for row in sh_in.iter_rows()]
+        merged = [str(ra) for ra in sh_in.merged_cell_ranges]
+        n_rows, n_cols = len(rows), max(len(row) for row in rows) if rows else 0
+        for ra in merged:
+            t = openpyxl.utils.range_boundaries(ra)
+            n_rows, n_cols = max(n_rows, t[3]), max(n_cols, t[2])
+        values = np.empty((n_rows, n_cols), dtype=object)
+        for r, row in enumerate(rows):
+            values[r, :len(row)] = row
+        return WorksheetArray(sh_in.title, values, merged)
+
+    cells = []  # (row, column, value), indices starting at 0
+    merged = []
+    n_rows = n_cols = 0
+    row_counter = 0
+    shared_strings = sh_in.shared_strings
+    columns = {}  # Column letters -> column index (starting at 1)
+    date_styles = {}  # Style ID -> True if it is a date format
+    for _, element in iterparse(sh_in.xml_source):
+        if element.tag == _ROW_TAG:
+            row_counter = int(element.get("r", row_counter + 1))
+            column = 0
+            for c in element.iter(_CELL_TAG):
+                coordinate = c.get("r")
+                if coordinate:
+                    letters = coordinate.rstrip("0123456789")
+                    column = columns.get(letters)
+                    if column is None:
+                        column = columns[letters] = column_index_from_string(letters)
+                else:
+                    column += 1
+                data_type = c.get("t", "n")
+                if data_type == "inlineStr":
+                    child = c.find(_INLINE_STRING_TAG)
+                    value = Text.from_tree(child).content if child is not None else None
+                else:
+                    value = c.findtext(_VALUE_TAG) or None
+                if value is None:
+                    continue
+                # Conversion as in openpyxl (numbers, shared strings, booleans, dates)
+                if data_type == "s":
+                    value = shared_strings[int(value)]
+                elif data_type == "n":
+                    style_id = int(c.get("s", 0))
+                    is_date = date_styles.get(style_id)
+                    if is_date is None:
+                        is_date = date_styles[style_id] = ReadOnlyCell(sh_in, row_counter, column, None,
+                                                                       "n", style_id).is_date
+                    if is_date:
+                        value = ReadOnlyCell(sh_in, row_counter, column, value, "n", style_id).value
+                    else:
+                        value = float(value) if _FLOAT_REGEX.search(value) else int(value)
+                elif data_type == "b":
+                    value = value == "1"
+                cells.append((row_counter - 1, column - 1, value))
+                n_cols = max(n_cols, column)
+            if cells and cells[-1][0] == row_counter - 1:
+                n_rows = row_counter
+            element.clear()
+        elif element.tag == _MERGE_CELL_TAG:
+            ref = element.get("ref")
+            if ref:
+                merged.append(ref)
+                t = openpyxl.utils.range_boundaries(ref)  # min col, min row, max col, max row (max's included)
+                n_rows = max(n_rows, t[3])
+                n_cols = max(n_cols, t[2])
+
+    values = np.empty((n_rows, n_cols), dtype=object)
+    for r, c, v in cells:
+        values[r, c] = v
+    return WorksheetArray(sh_in.title, values, merged)
+
 # #################################### #
 #  Worksheet related helper functions  #
 # #################################### #
@@ -38,6 +177,21 @@ def worksheet_to_numpy_array(sh_in):
     return m
 
 
+def worksheet_fingerprint(sh_in: WorksheetArray) -> str:
+    """
+    Digest of the contents of a worksheet (name, cell values and merged cells), to detect which worksheets changed
+    between two submissions of a workbook
+
+    :param sh_in: WorksheetArray
+    :return: Hexadecimal SHA-256 digest
+    """
+    h = hashlib.sha256(sh_in.title.encode("utf-8"))
+    for row in sh_in.values.tolist():
+        h.update(repr(row).encode("utf-8"))
+    h.update(repr(sorted(sh_in.merged_cell_ranges)).encode("utf-8"))
+    return h.hexdigest()
+
+
 def binary_mask_from_worksheet(sh_in, only_numbers=True):
     """
     Sweep the worksheet, considering merged cells, elaborate a mask for those cells which
@@ -47,18 +201,13 @@ def binary_mask_from_worksheet(sh_in, only_numbers=True):
     :param only_numbers:
     :return:
     """
-    max_col = sh_in.max_column
-    max_row = sh_in.max_row
-    m = np.zeros((max_row, max_col), dtype=bool)
-    for r in range(max_row):
-        for c in range(max_col):
-            v = sh_in.cell(row=r + 1, column=c + 1).value
-            if v:
-                if only_numbers:
-                    if isinstance(v, int) or isinstance(v, float):
-                        m[r, c] = 1
-                else:
-                    m[r, c] = 1
+    if not isinstance(sh_in, WorksheetArray):
+        sh_in = worksheet_to_array(sh_in)
+
+    if only_numbers:
+        m = _number_mask(sh_in.values).astype(bool)
+    else:
+        m = _content_mask(sh_in.values).astype(bool)
 
     # Merged cells
     for ra in sh_in.merged_cell_ranges:
@@ -70,6 +219,11 @@ def binary_mask_from_worksheet(sh_in, only_numbers=True):
     return m
 
 
+# Element-wise functions for the masks (any non empty value; numbers only)
+_content_mask = np.frompyfunc(bool, 1, 1)
+_number_mask = np.frompyfunc(lambda v: bool(v) and isinstance(v, (int, float)), 1, 1)
+
+
 def obtain_rectangular_submatrices(mask, region=None, only_remove_empty_bottom=False):
     """
     Obtain rectangular submatrices of mask
@@ -21,7 +21,8 @@ from backend.command_generators.parser_json import commands_generator_from_nativ
 """
 
 
-def commands_container_parser_factory(generator_type, file_type, file, state, sublist=None, stack=None):
+def commands_container_parser_factory(generator_type, file_type, file, state, sublist=None, stack=None,
+                                      worksheet_hook=None):
     """
     Returns a generator appropriate to parse "file" and generate command_executors
 
@@ -29,6 +30,7 @@ def commands_container_parser_factory(generator_type, file_type, file, state, su
     :param file_type:
     :param file:
     :param state: State used to validate existence of some variables at parse time
+    :param worksheet_hook: Only for spreadsheets, see "commands_generator_from_ooxml_file"
     :return:
     """
     def hash_file(f):
@@ -74,14 +76,14 @@ def commands_container_parser_factory(generator_type, file_type, file, state, su
         elif isinstance(s, str):
             pass  # TODO It may be a file name
 
-        yield from commands_generator_from_ooxml_file(s, state, sublist, stack)
+        yield from commands_generator_from_ooxml_file(s, state, sublist, stack, worksheet_hook)
     elif generator_type.lower() in ["json", "native", "primitive"]:  # "primitive" is Deprecated
         # A list of commands. Each command is a dictionary: the command type, a label and the content
         # The type is for the factory to determine the class to instantiate, while label and content
         # are passed to the command constructor to elaborate the command
         if isinstance(s, bytes):
             s = s.decode("utf-8")
-        yield from commands_generator_from_native_json(s, state, sublist, stack)
+        yield from commands_generator_from_native_json(s, state)
 
     # Pop the file hash from the stack
     stack.pop()
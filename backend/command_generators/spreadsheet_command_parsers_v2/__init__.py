@@ -1,12 +1,13 @@
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Union
 
 from openpyxl.worksheet.worksheet import Worksheet
 
 from backend import CommandField, IssuesLabelContentTripleType, AreaTupleType
 from backend.command_generators import Issue, parser_field_parsers, IssueLocation
+from backend.command_generators.parser_spreadsheet_utils import WorksheetArray, worksheet_to_array
 
 
-def check_columns(sh, name: str, area: Tuple, cols: List[CommandField], command_name: str, ignore_not_found=False):
+def check_columns(sh: WorksheetArray, name: str, area: Tuple, cols: List[CommandField], command_name: str, ignore_not_found=False):
     """
     When parsing of a command starts, check columns
     Try to match each column with declared column fields. If a column is not declared, raise an error (or ignore it)
@@ -27,10 +28,11 @@ def check_columns(sh, name: str, area: Tuple, cols: List[CommandField], command_
     mandatory_not_found = set([c.name for c in cols if c.mandatory])
 
     # Check columns
+    header = sh.values[area[0] - 1]
     col_map = {}  # From CommandField to a list of column index
     for c in range(area[2], area[3]):  # For each column of row 0 (Header Row)
         ##val = sh.get((area[0], c), None)
-        val = sh.cell(row=area[0], column=c).value
+        val = header[c - 1]
         if not val:
             continue
         col_name = val.strip()
@@ -81,7 +83,7 @@ def read_worksheet(sh: Worksheet) -> Dict:
     return data
 
 
-def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_name: str) -> IssuesLabelContentTripleType:
+def parse_command(sh: Union[Worksheet, WorksheetArray], area: AreaTupleType, name: Optional[str], cmd_name: str) -> IssuesLabelContentTripleType:
     """
     Parse command in general
     Generate a JSON
@@ -98,6 +100,9 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
 
     from backend.command_field_definitions import command_fields
 
+    if not isinstance(sh, WorksheetArray):
+        sh = worksheet_to_array(sh)
+
     cols = command_fields[cmd_name]  # List of CommandField that will guide the parsing
     ##sh_dict = read_worksheet(sh)
     ##col_map, local_issues = check_columns(sh_dict, name, area, cols, cmd_name)
@@ -115,9 +120,11 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
     content = []  # The output JSON
     # Parse each Row
     for r in range(area[0] + 1, area[1]):
+        row = sh.values[r - 1]
         line = {}
         expandable = False  # The line contains at least one field implying expansion into multiple lines
         complex = False  # The line contains at least one field with a complex rule (which cannot be evaluated with a simple cast)
+        asts = {}  # AST of each field with a single value, kept for the execution
 
         # Constant mandatory values
         mandatory_not_found = set([c.name for c in cols if c.mandatory and isinstance(c.mandatory, bool)])
@@ -129,7 +136,7 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
             for col_name, col_idx in col_map[col]:
                 # Read and prepare "value"
                 ##value = sh_dict.get((r, col_idx), None)
-                value = sh.cell(row=r, column=col_idx).value
+                value = row[col_idx - 1]
                 if value:
                     if not isinstance(value, str):
                         value = str(value)
@@ -147,7 +154,7 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
                     else:
                         line[cname] = value
                 else:  # Instead of a list of values, check if a syntactic rule is met by the value
-                    if col.parser:  # Parse, just check syntax (do not store the AST)
+                    if col.parser:  # Parse, check syntax
                         try:
                             ast = parser_field_parsers.string_to_ast(col.parser, value)
                             # Rules are in charge of informing if the result is expandable and if it complex
@@ -165,8 +172,10 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
                             else:
                                 if cname in line:
                                     line[cname] += ", " + value
+                                    asts.pop(cname, None)  # The AST is not the one of the concatenation
                                 else:
                                     line[cname] = value  # Store the value
+                                    asts[cname] = ast
                         except:
                             ##col_header = sh_dict.get((1, col_idx), None)
                             col_header = sh.cell(row=1, column=col_idx).value
@@ -186,6 +195,12 @@ def parse_command(sh: Worksheet, area: AreaTupleType, name: Optional[str], cmd_n
         line["_row"] = r
         line["_expandable"] = expandable
         line["_complex"] = complex
+        if complex and asts:
+            # Executors need the ASTs of complex lines. Keep them, so fields are not parsed again
+            try:
+                line["_asts"] = {f: parser_field_parsers.ast_to_json(ast) for f, ast in asts.items()}
+            except TypeError:
+                pass
 
         # Append if all mandatory fields have been filled
         may_append = True
@@ -0,0 +1,184 @@
+"""
+Columnar binary storage of pandas DataFrames
+
+A set of DataFrames is written as a small metadata block (pickle) followed by a data region containing the raw
+buffers of the columns. Reading does not parse values: numeric and datetime columns are NumPy views on the data
+region, so no copy is made until pandas consolidates the frame.
+
+Per column (and per index level) encodings:
+  * "buffer": NumPy arrays of fixed size types (bool, int, uint, float, complex, datetime64, timedelta64)
+  * "category": Categorical. The codes are a "buffer", the categories (usually few) go in the metadata
+  * "strings": object arrays of strings (dimension codes...). Dictionary encoded: distinct strings in the metadata,
+               codes as a "buffer"
+  * "pickle": anything else, pickled in the metadata
+
+dtypes, categoricals (ordered or not), MultiIndex (in the index and in the columns) and index names are preserved.
+"""
+import io
+import pickle
+import struct
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+_length = struct.Struct("<Q")
+ALIGNMENT = 8  # Buffers start at offsets multiple of this (relative to the data region)
+
+
+def _codes_dtype(n: int):
+    """ Smallest signed integer type for codes in [-1, n) """
+    for t in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(t).max:
+            return t
+    return np.int64
+
+
+class ColumnarWriter:
+    def __init__(self):
+        self._data = io.BytesIO()
+        self._frames = []
+
+    def _add_buffer(self, a: np.ndarray):
+        a = np.ascontiguousarray(a)
+        padding = -self._data.tell() % ALIGNMENT
+        if padding:
+            self._data.write(b"\0" * padding)
+        offset = self._data.tell()
+        if a.size:
+            self._data.write(a.view(np.uint8))
+        return "buffer", a.dtype.str, offset, len(a)
+
+    def _encode(self, s):
+        """
+        :param s: A Series (a column) or an Index (a level of an index)
+        :return: The encoding, to be stored in the metadata
+        """
+        dtype = s.dtype
+        if is_categorical_dtype(dtype):
+            values = pd.Categorical(s.values)
+            return "category", self._add_buffer(values.codes), values.categories, values.ordered
+        elif isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+            return self._add_buffer(np.asarray(s.values))
+        elif isinstance(dtype, np.dtype) and dtype.kind == "O":
+            values = np.asarray(s.values)
+            nulls = pd.isnull(values)
+            if len(set(type(v) for v in values[nulls])) <= 1 and all(isinstance(v, str) for v in values[~nulls]):
+                codes, uniques = pd.factorize(values)
+                null = values[nulls][0] if nulls.any() else None
+                return "strings", self._add_buffer(codes.astype(_codes_dtype(len(uniques)))), uniques, null
+            return "pickle", values
+        # Extension types (timezone aware datetimes, periods, ...). An Index keeps them
+        return "pickle", pd.Index(s)
+
+    def add_frame(self, df: pd.DataFrame) -> int:
+        """
+        Add a DataFrame
+
+        :param df: The DataFrame
+        :return: Position of the DataFrame, to be passed to "ColumnarReader.frame"
+        """
+        idx = df.index
+        if isinstance(idx, pd.RangeIndex) and idx.equals(pd.RangeIndex(len(idx))) and idx.name is None:
+            index = None  # Default index
+        else:
+            index = [self._encode(idx.get_level_values(i)) for i in range(idx.nlevels)]
+        meta = dict(rows=len(df),
+                    columns=df.columns,
+                    values=[self._encode(df.iloc[:, i]) for i in range(len(df.columns))],
+                    index=index,
+                    index_names=list(idx.names))
+        self._frames.append(meta)
+        return len(self._frames) - 1
+
+    def copy_frame(self, reader: "ColumnarReader", i: int) -> int:
+        """
+        Add a DataFrame stored in a ColumnarReader, without rebuilding it
+
+        :param reader: The ColumnarReader
+        :param i: Position of the DataFrame in "reader"
+        :return: Position of the DataFrame in this writer
+        """
+        def copy(enc):
+            if enc[0] == "buffer":
+                return self._add_buffer(reader._decode(enc))
+            elif enc[0] in ("category", "strings"):
+                return (enc[0], copy(enc[1])) + tuple(enc[2:])
+            return enc
+
+        meta = dict(reader._frames[i])
+        meta["values"] = [copy(enc) for enc in meta["values"]]
+        if meta["index"] is not None:
+            meta["index"] = [copy(enc) for enc in meta["index"]]
+        self._frames.append(meta)
+        return len(self._frames) - 1
+
+    def write(self, buffer):
+        """
+        Write metadata and data of all the DataFrames
+
+        :param buffer: Binary stream
+        """
+        meta = pickle.dumps(self._frames, protocol=4)
+        buffer.write(_length.pack(len(meta)))
+        buffer.write(meta)
+        buffer.write(self._data.getbuffer())
+
+
+class ColumnarReader:
+    def __init__(self, buffer: memoryview):
+        """
+        :param buffer: Memory containing what "ColumnarWriter.write" wrote. It must not be modified later. If it is
+                       writable (a bytearray, a writable memory map), columns will be writable NumPy arrays
+        """
+        n = _length.unpack_from(buffer)[0]
+        self._frames = pickle.loads(buffer[_length.size:_length.size + n])
+        self._data = buffer[_length.size + n:]
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _decode(self, enc):
+        if enc[0] == "buffer":
+            if not enc[3]:
+                return np.empty(0, dtype=np.dtype(enc[1]))
+            return np.frombuffer(self._data, dtype=np.dtype(enc[1]), count=enc[3], offset=enc[2])
+        elif enc[0] == "category":
+            return pd.Categorical.from_codes(self._decode(enc[1]), enc[2], enc[3])
+        elif enc[0] == "strings":
+            codes = self._decode(enc[1])
+            if len(enc[2]):
+                values = np.asarray(enc[2], dtype=object).take(codes)
+            else:
+                values = np.empty(len(codes), dtype=object)
+            nulls = codes < 0
+            if nulls.any():
+                values[nulls] = enc[3]
+            return values
+        else:
+            return enc[1]
+
+    def shape(self, i: int):
+        """ Shape of a DataFrame, without decoding it """
+        return self._frames[i]["rows"], len(self._frames[i]["columns"])
+
+    def frame(self, i: int) -> pd.DataFrame:
+        """
+        Rebuild a DataFrame
+
+        :param i: Position of the DataFrame (returned by "ColumnarWriter.add_frame")
+        :return: The DataFrame
+        """
+        meta = self._frames[i]
+        if meta["index"] is None:
+            index = pd.RangeIndex(meta["rows"])
+        elif len(meta["index"]) == 1:
+            index = pd.Index(self._decode(meta["index"][0]), name=meta["index_names"][0])
+        else:
+            index = pd.MultiIndex.from_arrays([self._decode(enc) for enc in meta["index"]],
+                                              names=meta["index_names"])
+        columns = meta["columns"]
+        df = pd.DataFrame({j: self._decode(enc) for j, enc in enumerate(meta["values"])},
+                          index=index, columns=list(range(len(columns))))
+        df.columns = columns
+        return df
@@ -482,6 +482,8 @@ class PartialRetrievalDictionary:
         self._rev_objs = {}  # From object to ID
         # Counter
         self._id_counter = 0
+        # Counter of modifications (inserts, updates and deletes)
+        self._version = 0
 
     def get(self, key, key_and_value=False, full_key=False, just_oid=False):
         """
@@ -589,6 +591,7 @@ class PartialRetrievalDictionary:
                 s.add(oid)
             for s in present:
                 s.add(oid)
+            self._version += 1
         else:
             if ptype == 'i':
                 raise Exception("Key '+"+str(key2)+"' already exists")
@@ -599,6 +602,12 @@ class PartialRetrievalDictionary:
                 raise Exception("Only one result expected")
             # Update value (key is the same, ID is the same)
             self._objs[res[0]] = value
+            self._version += 1
+
+    @property
+    def version(self):
+        """ Counter of modifications. It changes each time an object is inserted, updated or deleted """
+        return self._version
 
     def delete(self, key):
         def delete_single(key):
@@ -629,6 +638,7 @@ class PartialRetrievalDictionary:
                 # Delete oids
                 for oid in oids:
                     del self._objs[oid]
+                self._version += 1
 
                 return len(oids)
             else:
@@ -644,16 +654,28 @@ class PartialRetrievalDictionary:
 
     def to_pickable(self):
         # Convert to a jsonpickable structure
-        return dict(keys=self._keys, objs=self._objs, cont=self._id_counter)
+        return dict(keys=self._keys, objs=self._objs, cont=self._id_counter, version=self._version)
 
     def from_pickable(self, inp):
         self._keys = inp["keys"]
         self._objs = {int(k): v for k, v in inp["objs"].items()}
         self._rev_objs = {v[1]: k for k, v in self._objs.items()}
         self._id_counter = inp["cont"]
+        self._version = inp.get("version", self._id_counter)
 
         return self  # Allows the following: prd = PartialRetrievalDictionary().from_pickable(inp)
 
+    def __getstate__(self):
+        # The reverse index (object to ID) is not stored, it is rebuilt from "_objs"
+        return dict(keys=self._keys, objs=self._objs, cont=self._id_counter, version=self._version)
+
+    def __setstate__(self, state):
+        self._keys = state["keys"]
+        self._objs = state["objs"]
+        self._rev_objs = {v[1]: k for k, v in self._objs.items()}
+        self._id_counter = state["cont"]
+        self._version = state.get("version", self._id_counter)
+
 
 # #####################################################################################################################
 # >>>> EXTERNAL DATASETS <<<<
@@ -1055,6 +1077,24 @@ def is_str(v):
 def to_str(v):
     return str(v)
 
+
+@functools.lru_cache(maxsize=4096)
+def unit_to_base(unit: str) -> Tuple[float, Any]:
+    """
+    Resolve a unit string once: factor to convert magnitudes in the unit to base units, and the base units
+
+    Parsing units with "ureg" is expensive, numeric cores can work on plain floats (in base units) and attach
+    the units only when the results are output
+
+    :param unit: Unit, as string (e.g. "tonne", "kg/m^2")
+    :return: Tuple (factor, base units). E.g. "tonne" -> (1000.0, kilogram)
+    """
+    q = backend.ureg(unit if unit else "dimensionless")
+    if not isinstance(q, backend.ureg.Quantity):  # A plain number, e.g. "1"
+        q = backend.ureg.Quantity(q, "dimensionless")
+    q = q.to_base_units()
+    return float(q.magnitude), q.units
+
 # #####################################################################################################################
 # >>>> LOAD DATASET FROM URL INTO PD.DATAFRAME <<<<
 # #####################################################################################################################
@@ -0,0 +1,273 @@
+"""
+Content-addressed cache of command executions, stored in a local directory
+
+Executing a command is assumed to depend only on the State it runs on and on the command itself. So the State
+after a command is identified by a key computed from the key of the input State and the serialized command
+("json_serialize()"). The cache maps that key to a snapshot of the resulting State (plus issues and output of the
+execution).
+
+The key of the initial State is the hash of its snapshot. The following keys are chained, so the State does not need
+to be serialized to know its key: re-executing an unchanged sequence of commands only needs to restore the last
+snapshot.
+
+Workbooks are cached per worksheet instead of per command (see "WorksheetCheckpoints"): the key after a worksheet is
+chained from the fingerprint of its contents, so unchanged leading worksheets are not even parsed.
+
+Entries are files named after their key. The size and order of use of the entries is kept in memory (the directory is
+only scanned when the cache is created), and the least recently used are removed when the total size exceeds the budget.
+
+Entries are unpickled, so the directory must not be writable by other users (it is checked when the cache is created).
+
+NOTE: commands obtaining data from external sources are assumed to obtain the same data each time.
+"""
+import hashlib
+import json
+import os
+import pickle
+import stat
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from backend.model_services import State
+from backend.restful_service.serialization import serialize_state, deserialize_state
+
+# Variables of the State describing the session (user, case study), not the model. Left out of the snapshots
+SESSION_STATE_VARIABLES = ("_identity", "_case_study", "_case_study_version")
+
+
+def state_key(snapshot: bytes) -> str:
+    """ Key of a State, from its snapshot """
+    return hashlib.sha256(snapshot).hexdigest()
+
+
+def snapshot_state(state: State) -> Optional[bytes]:
+    """ Snapshot of a State for the execution cache, or None if it cannot be serialized """
+    session_variables = {n: state.get(n) for n in SESSION_STATE_VARIABLES if state.get(n) is not None}
+    try:
+        for n in session_variables:
+            state.set(n, None)
+        return serialize_state(state)
+    except Exception as e:
+        print(f"State could not be serialized for the execution cache: {e}")
+        return None
+    finally:
+        state.update(session_variables)
+
+
+def restore_state(state: State, snapshot: bytes):
+    """ Replace the contents of "state" by those of a snapshot. The object is kept, it may be referenced elsewhere """
+    session_variables = {n: state.get(n) for n in SESSION_STATE_VARIABLES if state.get(n) is not None}
+    state.__dict__.update(deserialize_state(snapshot).__dict__)
+    state.update(session_variables)
+
+
+def chain_key(input_key: str, content: str) -> str:
+    """ Key of the State resulting of applying something ("content") to the State with key "input_key" """
+    h = hashlib.sha256(input_key.encode("ascii"))
+    h.update(content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def command_key(input_key: str, cmd) -> Optional[str]:
+    """
+    Key of the State resulting of executing a command
+
+    :param input_key: Key of the input State
+    :param cmd: IExecutableCommand
+    :return: The key, or None if the command cannot be serialized (its execution cannot be cached)
+    """
+    try:
+        content = json.dumps([cmd._serialization_type,
+                              cmd._serialization_label,
+                              getattr(cmd, "_source_block_name", None),
+                              cmd.json_serialize()],
+                             sort_keys=True)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return chain_key(input_key, content)
+
+
+class ExecutionCache:
+    def __init__(self, directory: str, max_size: int):
+        """
+        :param directory: Directory where entries are stored (created if it does not exist). Entries are unpickled,
+                          so it must be private: owned by the user of the process and not writable by others
+        :param max_size: Budget, in bytes, for the whole set of entries
+        """
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.stat(directory)
+        if hasattr(os, "getuid") and st.st_uid != os.getuid():
+            raise Exception(f"The execution cache directory '{directory}' is not owned by the user of the process")
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise Exception(f"The execution cache directory '{directory}' is writable by other users")
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Size of the entries, from least to most recently used. The directory is only scanned here
+        self._entries = OrderedDict()  # type: OrderedDict[str, int]
+        self._size = 0
+        found = []
+        for e in os.scandir(directory):
+            if e.name.endswith(".nisx"):
+                st = e.stat()
+                found.append((st.st_mtime, e.name[:-len(".nisx")], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key: str):
+        return os.path.join(self._directory, key + ".nisx")
+
+    def get(self, key: str):
+        """
+        :param key: Key of a State
+        :return: Tuple (snapshot, issues, output) or None if the key is not in the cache
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(path)  # Recently used (kept for the order after a restart)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self._remove(key)
+            self.misses += 1
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:  # Written by another process sharing the directory
+                self._add(key, os.path.getsize(path))
+                self._evict()
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, snapshot: bytes, issues, output):
+        """
+        Store a State (after a command execution)
+
+        :param key: Key of the State
+        :param snapshot: Snapshot of the State (see "serialize_state")
+        :param issues: Issues of the execution
+        :param output: Output of the execution
+        """
+        try:
+            tmp = pickle.dumps((snapshot, issues, output), protocol=4)
+        except Exception as e:  # Issues or output not pickable, do not cache
+            print(f"Execution not cached: {e}")
+            return
+        if len(tmp) > self._max_size:
+            return
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(tmp)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._remove(key, delete=False)
+            self._add(key, len(tmp))
+            self._evict()
+
+    def _add(self, key: str, size: int):
+        self._entries[key] = size
+        self._size += size
+
+    def _remove(self, key: str, delete=True):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+            if delete:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        """ Remove least recently used entries until the budget is met. The lock must be held """
+        while self._size > self._max_size and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            for e in os.scandir(self._directory):
+                if e.name.endswith(".nisx"):
+                    os.remove(e.path)
+            self._entries.clear()
+            self._size = 0
+
+
+class WorksheetCheckpoints:
+    """
+    Checkpoints of the State after each worksheet of a workbook. It is the "worksheet_hook" of the workbook parser
+    ("commands_generator_from_ooxml_file"), which calls it before reading each worksheet
+
+    While the leading worksheets are found in the cache, they are skipped. The State after the last of them (with the
+    issues and outputs up to it) is restored when the first changed worksheet is reached, before parsing it. From that
+    worksheet on, the State is checkpointed each time a worksheet has been executed
+
+    The caller keeps "commands" updated with the number of commands it has processed (it is restored with the State)
+    """
+    def __init__(self, cache: ExecutionCache, input_key: str, state: State, issues: list, outputs: list):
+        """
+        :param cache: The ExecutionCache
+        :param input_key: Key of the State before the workbook
+        :param state: The State, restored in place
+        :param issues: List of issues of the execution, replaced in place when a checkpoint is restored
+        :param outputs: List of outputs of the execution, replaced in place when a checkpoint is restored
+        """
+        self._cache = cache
+        self._key = input_key
+        self._state = state
+        self._issues = issues
+        self._outputs = outputs
+        self._pending = None  # Entry of the last skipped worksheet, not restored yet
+        self._skipping = True  # No changed worksheet found yet
+        self._executing = False  # A worksheet is being executed. Its checkpoint is due
+        self.skipped = 0
+        self.commands = 0
+
+    def __call__(self, sheet_number: int, sheet_name: str, fingerprint: Optional[str]) -> bool:
+        """
+        :return: True if the worksheet has to be skipped
+        """
+        self.checkpoint()  # The previous worksheet has been executed
+        self._key = chain_key(self._key, fingerprint) if self._key and fingerprint else None
+        if self._skipping and self._key:
+            entry = self._cache.get(self._key)
+            if entry:
+                self._pending = entry
+                self.skipped += 1
+                return True
+        self._skipping = False
+        self.restore()
+        self._executing = self._key is not None
+        return False
+
+    def restore(self):
+        """ Restore the State after the skipped worksheets, if it was not done yet """
+        if self._pending:
+            snapshot, issues, (outputs, self.commands) = self._pending
+            restore_state(self._state, snapshot)
+            self._issues[:] = issues
+            self._outputs[:] = outputs
+            self._pending = None
+
+    def checkpoint(self) -> Optional[bytes]:
+        """
+        Store the State after the worksheet being executed
+
+        :return: The snapshot, or None if there was nothing to checkpoint
+        """
+        snapshot = None
+        if self._executing:
+            snapshot = snapshot_state(self._state)
+            if snapshot:
+                self._cache.put(self._key, snapshot, self._issues, (self._outputs, self.commands))
+            else:
+                self._key = None
+            self._executing = False
+        return snapshot
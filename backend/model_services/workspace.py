@@ -5,6 +5,7 @@
 """
 import copy
 import datetime
+import hashlib
 import json
 import logging
 import uuid
@@ -19,6 +20,8 @@ from backend.command_generators.parsers_factory import commands_container_parser
 from backend.common.helper import create_dictionary
 from backend.model_services import IExecutableCommand, get_case_study_registry_objects
 from backend.model_services import State
+from backend.model_services.execution_cache import ExecutionCache, WorksheetCheckpoints, state_key, command_key, \
+    snapshot_state, restore_state
 from backend.models.musiasem_concepts import ProblemStatement, FactorsRelationDirectedFlowObservation, Processor, \
     Factor, Parameter, FactorInProcessorType
 from backend.models.musiasem_methodology_support import (User,
@@ -175,17 +178,42 @@ def execute_command_container_file(state, generator_type, file_type: str, file):
     :param file: The file contents
     :return: Issues and outputs (no outputs still required, probably won't be needed)
     """
-    # Create commands generator from factory (from generator_type and file_type)
-    commands_generator = commands_container_parser_factory(generator_type, file_type, file, state)
+    # Execution cache. A whole file already executed on the same State is restored without even parsing it
+    cache = backend.execution_cache  # type: ExecutionCache
+    snapshot = snapshot_state(state) if cache and isinstance(file, (str, bytes, bytearray)) else None
+    if snapshot:
+        key = state_key(snapshot)
+        h = hashlib.sha256(f"{key}|{generator_type}|{file_type}|".encode("utf-8"))
+        h.update(file.encode("utf-8") if isinstance(file, str) else file)
+        file_key = h.hexdigest()
+        entry = cache.get(file_key)
+        if entry:
+            restore_state(state, entry[0])
+            return entry[1], entry[2]
+    else:
+        key = file_key = None
 
-    # Loop over the IExecutableCommand instances
     issues_aggreg = []
     outputs = []
+
+    # Workbooks: checkpoints after each worksheet, to skip unchanged leading worksheets (instead of caching commands)
+    if key and generator_type.lower() in ["spreadsheet", "excel", "workbook"]:
+        checkpoints = WorksheetCheckpoints(cache, key, state, issues_aggreg, outputs)
+        key = None
+    else:
+        checkpoints = None
+
+    # Create commands generator from factory (from generator_type and file_type)
+    commands_generator = commands_container_parser_factory(generator_type, file_type, file, state,
+                                                           worksheet_hook=checkpoints)
+
+    # Loop over the IExecutableCommand instances
     cmd_number = 0
+    errors_exist = False
     for cmd, issues in commands_generator:
-        cmd_number += 1  # Command counter
-
-        errors_exist = False
+        cmd_number = (checkpoints.commands if checkpoints else cmd_number) + 1  # Command counter
+        if checkpoints:
+            checkpoints.commands = cmd_number
 
         if issues and len(issues) > 0:
             new_issues, errors_exist = transform_issues(issues, cmd, cmd_number)
@@ -195,7 +223,21 @@ def execute_command_container_file(state, generator_type, file_type: str, file):
             break
 
         # ## COMMAND EXECUTION ## #
-        issues, output = execute_command(state, cmd)
+        if key and cmd:  # The State after the command may be in the cache (if the key can be obtained)
+            key = command_key(key, cmd)
+        entry = cache.get(key) if key and cmd else None
+        if entry:
+            snapshot = entry[0]
+            restore_state(state, snapshot)
+            issues, output = entry[1], entry[2]
+        else:
+            issues, output = execute_command(state, cmd)
+            if key and cmd:
+                snapshot = snapshot_state(state)
+                if snapshot:
+                    cache.put(key, snapshot, issues, output)
+                else:
+                    key = None
 
         if issues and len(issues) > 0:
             new_issues, errors_exist = transform_issues(issues, cmd, cmd_number)
@@ -207,6 +249,18 @@ def execute_command_container_file(state, generator_type, file_type: str, file):
         if errors_exist:
             break
 
+    if checkpoints:
+        checkpoints.restore()  # All the worksheets were skipped
+        snapshot = checkpoints.checkpoint() if not errors_exist else None
+    elif not key:
+        snapshot = None  # The State changed after the last snapshot
+
+    if file_key:
+        if not snapshot:
+            snapshot = snapshot_state(state)
+        if snapshot:
+            cache.put(file_key, snapshot, issues_aggreg, outputs)
+
     return issues_aggreg, outputs
 
 
@@ -681,6 +735,19 @@ class InteractiveSession:
 
 
 class ReproducibleSession:
+    """
+    State persistence follows a checkpoint plus journal scheme. The journal is the list of CommandsContainer of the
+    active sessions of the version, which is always persisted. A checkpoint is a full State snapshot stored in
+    "CaseStudyVersionSession.state", reflecting the execution of the commands of that session and all the previous
+    ones. "CaseStudyVersion.state" is only set when it reflects the execution of ALL the commands of the version.
+
+    When saving, a checkpoint is written only if "checkpoint_interval" commands or more would have to be replayed
+    from the previous checkpoint. Otherwise only the commands are appended. Opening a version restores the nearest
+    checkpoint and replays the commands after it.
+    """
+    # Number of journaled commands after which a new checkpoint is written. 1 (or less) writes one on every save
+    checkpoint_interval = 5
+
     def __init__(self, isess):
         # Containing InteractiveSession. Used to set State when a ReproducibleSession is opened and it overwrites State
         self._isess = isess  # type: InteractiveSession
@@ -688,6 +755,8 @@ class ReproducibleSession:
         self._sess_factory = None
         self._allow_saving = None
         self._session = None  # type: CaseStudyVersionSession
+        # Number of commands, in sessions previous to "_session", executed after the last checkpoint
+        self._journal_length = 0
 
     @property
     def ws_commands(self):
@@ -800,8 +869,9 @@ class ReproducibleSession:
                     # Deserialize
                     self._isess._state = deserialize_state(vs.state, vs.state_version)
                 else:
-                    self._isess._state = State()  # Zero State, execute all commands in sequence
-                    for ws in lst:
+                    # Restore the nearest checkpoint, then execute the remaining commands in sequence
+                    self._isess._state, tail = restore_nearest_checkpoint(lst)
+                    for ws in tail:
                         for c in ws.commands:
                             execute_command_container(self._isess._state, c)
                 if cr_new == CreateNew.VERSION:  # TODO Check if this works in all possible circumstances (combine the parameters of the function)
@@ -831,7 +901,9 @@ class ReproducibleSession:
         restart = not recover_previous_state if uuid_ else True
         if not restart:
             self._session = ws
+            self._journal_length = journal_length(lst[:-1])
         else:
+            self._journal_length = 0
             self._session = CaseStudyVersionSession()
             self._session.version = vs
             self._session.who = usr
@@ -847,8 +919,8 @@ class ReproducibleSession:
         """ Designed to work using the REST interface. TEST in direct use. """
         # Version
         # v = self._session.version
-        # Serialize state
-        st = serialize_state(self._isess._state)
+        # Serialize state, if a checkpoint is due
+        st = self._checkpoint()
         # v.state = st
         # Open DB session
         session = self._sess_factory()
@@ -856,6 +928,10 @@ class ReproducibleSession:
         v = session.query(CaseStudyVersion).get(self._session.version_id)
         v.state = st
         session.add(v)
+        if self._session.id:
+            ws = session.query(CaseStudyVersionSession).get(self._session.id)
+            ws.state = st
+            session.add(ws)
         for c in lst_cmds:
             c2 = session.query(CommandsContainer).get(c.id)
             c2.execution_start = c.execution_start
@@ -867,8 +943,8 @@ class ReproducibleSession:
     def save(self, from_web_service=False, cs_uuid=None, cs_name=None):
         if not self._allow_saving:
             raise Exception("The ReproducibleSession was opened disallowing saving. Please close it and reopen it with the proper value")
-        # Serialize state
-        st = serialize_state(self._isess._state)
+        # Serialize state, if a checkpoint is due
+        st = self._checkpoint()
         self._session.version.state = st
         self._session.state = st
         ws = self._session
@@ -930,6 +1006,18 @@ class ReproducibleSession:
         force_load(self._session)
         self._sess_factory.remove()
 
+    def _checkpoint(self):
+        """
+        Serialize the State if a checkpoint is due, i.e. if opening the version would need to replay more than
+        "checkpoint_interval" commands from the previous checkpoint
+
+        :return: The serialized State, or None if only the journal (the commands) has to be saved
+        """
+        if self._journal_length + len(self._session.commands) >= self.checkpoint_interval:
+            return serialize_state(self._isess._state, as_text=True)
+        else:
+            return None
+
     def register_persistable_command(self, cmd: CommandsContainer):
         cmd.session = self._session
 
@@ -982,6 +1070,35 @@ class ReproducibleSession:
         return id3
 
 
+def journal_length(sessions):
+    """
+    Number of commands executed after the last checkpoint
+
+    :param sessions: List of active CaseStudyVersionSession, in order of execution
+    :return: Number of commands in the sessions after the last one having a checkpoint
+    """
+    n = 0
+    for ws in reversed(sessions):
+        if ws.state:
+            break
+        n += len(ws.commands)
+    return n
+
+
+def restore_nearest_checkpoint(sessions):
+    """
+    Obtain the State from the last checkpoint of a list of sessions
+
+    :param sessions: List of active CaseStudyVersionSession, in order of execution
+    :return: A tuple (State, sessions after the checkpoint, whose commands have to be executed)
+    """
+    for i in range(len(sessions) - 1, -1, -1):
+        ws = sessions[i]
+        if ws.state:
+            return deserialize_state(ws.state, ws.state_version), sessions[i+1:]
+    return State(), sessions
+
+
 def execute_file_return_issues(file_name, generator_type):
     """
     Execution of files in the context of tests
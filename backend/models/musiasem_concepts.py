@@ -2553,6 +2553,80 @@ class Parameter(Nameable, Identifiable, Encodable):
         return {"_t": "param", "_n": self.name, "__o": self.ident}
 
 
+class ParameterDependencies:
+    """
+    Graph of the dependencies on parameters: which parameters and which expressions (of observations, flow weights,
+    scale quantities) mention each parameter. Stored in the registry, next to the Parameters
+
+    Nodes are parameter names (lower case if not case sensitive) or the objects containing the expressions
+    """
+    def __init__(self):
+        self._dependents = {}  # Node -> set of nodes depending on it
+        self._dependencies = {}  # Node -> set of nodes it depends on
+        self.registry_version = None  # Version of the registry from which the dependencies were obtained
+
+    @staticmethod
+    def normalize(name: str):
+        return name if case_sensitive else name.lower()
+
+    def add(self, node, parameters: Iterable[str]):
+        """
+        Register the parameters on which a node depends
+
+        :param node: Parameter name or object with an expression
+        :param parameters: Names of parameters mentioned in the expression of the node
+        """
+        if isinstance(node, str):
+            node = self.normalize(node)
+        deps = self._dependencies.setdefault(node, set())
+        for p in parameters:
+            p = self.normalize(p)
+            deps.add(p)
+            self._dependents.setdefault(p, set()).add(node)
+
+    def dependencies(self, node) -> Set:
+        return self._dependencies.get(self.normalize(node) if isinstance(node, str) else node, set())
+
+    def downstream(self, parameters: Iterable[str]) -> List:
+        """
+        Nodes depending, directly or indirectly, on the parameters, in an order in which they can be evaluated (a
+        node comes after the nodes it depends on)
+
+        :param parameters: Names of the parameters
+        :return: List of nodes (parameter names and objects)
+        """
+        # Closure
+        closure = set()
+        pending = [self.normalize(p) for p in parameters]
+        while pending:
+            for n in self._dependents.get(pending.pop(), ()):
+                if n not in closure:
+                    closure.add(n)
+                    pending.append(n)
+        # Order (topological, inside the closure)
+        in_degree = {n: len(self._dependencies.get(n, set()) & closure) for n in closure}
+        ready = [n for n, d in in_degree.items() if d == 0]
+        res = []
+        while ready:
+            n = ready.pop()
+            res.append(n)
+            for n2 in self._dependents.get(n, ()):
+                if n2 in in_degree:
+                    in_degree[n2] -= 1
+                    if in_degree[n2] == 0:
+                        ready.append(n2)
+        if len(res) < len(closure):
+            raise Exception("Parameters cannot have circular dependencies")
+        return res
+
+    @staticmethod
+    def partial_key():
+        return dict(_t="param_deps")
+
+    def key(self):
+        return {"_t": "param_deps"}
+
+
 class ProblemStatement(Identifiable, Encodable):
     """
     Contains the parameters for the different scenarios, plus parameters needed to launch a solving process
@@ -1,12 +1,21 @@
+import base64
+import copyreg
+import io
+import pickle
+import struct
+import sys
+
 from sqlalchemy.orm import class_mapper
 import pandas as pd
 
 # Some ideas from function "model_to_dict" (Google it, StackOverflow Q&A)
+from backend.common.columnar import ColumnarWriter, ColumnarReader
 from backend.common.helper import PartialRetrievalDictionary, create_dictionary
+from backend import ureg
 from backend.models import MODEL_VERSION
-from backend.models.musiasem_methodology_support import serialize_from_object, deserialize_to_object
+from backend.models.musiasem_methodology_support import deserialize_to_object
+from backend.models.statistical_datasets import Dataset
 from backend.model_services import State, get_case_study_registry_objects
-import sys
 
 def serialize(o_list):
     """
@@ -121,65 +130,241 @@ def deserialize(d_list):
     return o_list
 
 
-def serialize_state(state: State):
+# #####################################################################################################################
+# >>>> BINARY STATE SNAPSHOTS <<<<
+# #####################################################################################################################
+#
+# Layout of a snapshot:
+#
+#   +--------+------------------+---------------+----------------+----------------------------+-------------------+
+#   | "NISS" | format version   | model version | payload length | payload                    | datasets          |
+#   | 4 B    | uint16, LE       | uint32, LE    | uint64, LE     | pickle (protocol 4) of the | columnar storage  |
+#   |        |                  |               |                | State                      | of the DataFrames |
+#   +--------+------------------+---------------+----------------+----------------------------+-------------------+
+#
+# The pickle payload is written directly from the live State, so no deep copy is needed. SQLAlchemy "Dataset" objects
+# found in "_datasets" are externalized (they are not pickable as such): the ORM object graph is written in the format
+# of "serialize", and the DataFrame goes to the columnar section (see "backend.common.columnar"), referenced by its
+# position. Format version 1 had no columnar section, DataFrames were pickled inside the payload.
+# When a snapshot is read, datasets are not rebuilt: "_datasets" receives DatasetHandle objects, which rebuild the
+# Dataset on first use. "list_datasets" obtains names and shapes without rebuilding anything.
+# Text columns (like "CaseStudyVersion.state") receive the snapshot as base64, preceded by SNAPSHOT_TEXT_PREFIX
+
+SNAPSHOT_MAGIC = b"NISS"
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_TEXT_PREFIX = "NISS64:"
+_snapshot_header = struct.Struct("<4sHI")
+_payload_length = struct.Struct("<Q")
+
+
+def _build_quantity(magnitude, units: str):
+    return ureg.Quantity(magnitude, units)
+
+
+def _reduce_quantity(q):
+    # Units are stored as text, so they are resolved again in the NIS units registry (which has custom definitions)
+    return _build_quantity, (q.magnitude, str(q.units))
+
+
+def _frame_summary(df):
+    """ (rows, columns, bytes) of a DataFrame, or None """
+    if isinstance(df, pd.DataFrame):
+        return df.shape[0], df.shape[1], int(df.memory_usage(True).sum())
+    return None
+
+
+class DatasetHandle:
     """
-    Serialization prepared for a given organization of the state
+    A Dataset read from a state snapshot, which is rebuilt (SQLAlchemy objects and DataFrame) on first use
 
-    :return:
+    Attributes are delegated to the Dataset, so it can be used in place of it. Use "materialize" to obtain the Dataset
+    itself (for instance, to attach it to other SQLAlchemy objects)
     """
+    def __init__(self, objects: list, frames: ColumnarReader, frame: int, summary: tuple):
+        self.__dict__.update(_h_objects=objects, _h_frames=frames, _h_frame=frame, _h_summary=summary, _h_dataset=None)
 
-    def serialize_dataframe(df):
-        return df.to_json(orient="split")  # list(df.index.names), df.to_dict()
+    @property
+    def materialized(self) -> bool:
+        return self._h_dataset is not None
 
-    print("  serialize_state IN")
+    @property
+    def summary(self):
+        """ (rows, columns, bytes) of the data, or None if there is no DataFrame. Does not rebuild the Dataset """
+        if self.materialized:
+            return _frame_summary(self._h_dataset.data)
+        return self._h_summary
 
-    import copy
-    # "_datasets"
-    ns_ds = {}
-    # Save and nullify before deep copy
-    for ns in state.list_namespaces():
-        _, _, _, datasets, _ = get_case_study_registry_objects(state, ns)
-        ns_ds[ns] = datasets
-        state.set("_datasets", create_dictionary(), ns)  # Nullify datasets
+    def materialize(self) -> Dataset:
+        if self._h_dataset is None:
+            ds = deserialize(self._h_objects)[0]
+            ds.data = self._h_frames.frame(self._h_frame) if self._h_frame is not None else None
+            self.__dict__.update(_h_dataset=ds, _h_objects=None, _h_frames=None)
+        return self._h_dataset
+
+    def __getattr__(self, name):
+        if name.startswith("_h_") or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.materialize(), name, value)
 
-    # !!! WARNING: It destroys "state", so a DEEP COPY is performed !!!
+
+def list_datasets(state: State, namespace=None):
+    """
+    Summary of the datasets of a State, without rebuilding DatasetHandle's
+
+    :param state: The State
+    :param namespace: Namespace of the State
+    :return: A list of tuples (name, rows, columns, bytes). The last three are None if the Dataset has no data
+    """
+    datasets = state.get("_datasets", namespace)
+    lst = []
+    for name in (datasets if datasets else []):
+        ds = datasets[name]
+        summary = ds.summary if isinstance(ds, DatasetHandle) else _frame_summary(ds.data)
+        lst.append((name, ) + (summary if summary else (None, None, None)))
+    return lst
+
+
+class _StatePickler(pickle.Pickler):
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[ureg.Quantity] = _reduce_quantity
+
+    def __init__(self, file, frames: ColumnarWriter):
+        super().__init__(file, protocol=4)
+        self._frames = frames
+        # id(Dataset) -> persistent ID, so shared Datasets are written once. The last element of the persistent ID is
+        # the number of the Dataset in the snapshot, so the reader can share them too
+        self._datasets = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, DatasetHandle) and obj.materialized:
+            obj = obj.materialize()
+        if isinstance(obj, Dataset):
+            pid = self._datasets.get(id(obj))
+            if not pid:
+                frame = self._frames.add_frame(obj.data) if isinstance(obj.data, pd.DataFrame) else None
+                pid = "dataset", serialize(obj.get_objects_list()), frame, _frame_summary(obj.data), len(self._datasets)
+                self._datasets[id(obj)] = pid
+            return pid
+        elif isinstance(obj, DatasetHandle):  # Not used since it was read, copy it as it is
+            pid = self._datasets.get(id(obj))
+            if not pid:
+                frame = self._frames.copy_frame(obj._h_frames, obj._h_frame) if obj._h_frame is not None else None
+                pid = "dataset", obj._h_objects, frame, obj._h_summary, len(self._datasets)
+                self._datasets[id(obj)] = pid
+            return pid
+        return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, frames: ColumnarReader=None):
+        super().__init__(file)
+        self._frames = frames
+        self._datasets = {}  # Number of the Dataset in the snapshot (frame in older snapshots) -> DatasetHandle
+
+    def persistent_load(self, pid):
+        if pid[0] == "dataset":
+            if self._frames is None:  # Format version 1, DataFrame inside the payload
+                ds = deserialize(pid[1])[0]
+                ds.data = pid[2]
+                return ds
+            if len(pid) > 4:
+                key = pid[4]
+            else:  # Snapshots without the number of the Dataset
+                key = pid[2] if pid[2] is not None else id(pid)
+            if key not in self._datasets:
+                self._datasets[key] = DatasetHandle(pid[1], self._frames, pid[2], pid[3])
+            return self._datasets[key]
+        raise pickle.UnpicklingError(f"Unsupported persistent object '{pid[0]}' in state snapshot")
+
+
+def is_state_snapshot(st) -> bool:
+    """ True if "st" is a binary state snapshot, or its text version """
+    if isinstance(st, (bytes, bytearray, memoryview)):
+        return bytes(st[:len(SNAPSHOT_MAGIC)]) == SNAPSHOT_MAGIC
+    elif isinstance(st, str):
+        return st.startswith(SNAPSHOT_TEXT_PREFIX)
+    return False
+
+
+def serialize_state(state: State, as_text: bool=False):
+    """
+    Serialization prepared for a given organization of the state
+
+    The result is a binary snapshot (see the layout above). The State is not modified.
+
+    :param state: State to serialize
+    :param as_text: If True, return a string instead of "bytes", to be stored in text columns
+    :return: bytes (or str if "as_text")
+    """
+    print("  serialize_state IN")
+
+    payload = io.BytesIO()
+    frames = ColumnarWriter()
     tmp = sys.getrecursionlimit()
     sys.setrecursionlimit(10000)
-    state2 = copy.deepcopy(state)
-    sys.setrecursionlimit(tmp)
-
-    # Iterate all namespaces
-    for ns in state2.list_namespaces():
-        glb_idx, p_sets, hh, _, mappings = get_case_study_registry_objects(state2, ns)
-        if glb_idx:
-            tmp = glb_idx.to_pickable()
-            state2.set("_glb_idx", tmp, ns)
-        datasets = ns_ds[ns]
-        # TODO Serialize other DataFrames.
-        # Process Datasets
-        for ds_name in datasets:
-            ds = datasets[ds_name]
-            if isinstance(ds.data, pd.DataFrame):
-                tmp = serialize_dataframe(ds.data)
-            else:
-                tmp = None
-                # ds.data = None
-            # DB serialize the datasets
-            lst2 = serialize(ds.get_objects_list())
-            lst2.append(tmp)  # Append the serialized DataFrame
-            datasets[ds_name] = lst2
-        state2.set("_datasets", datasets, ns)
-    tmp = serialize_from_object(state2)  # <<<<<<<< SLOWEST !!!! (when debugging)
+    try:
+        _StatePickler(payload, frames).dump(state)
+    finally:
+        sys.setrecursionlimit(tmp)
+    buffer = io.BytesIO()
+    buffer.write(_snapshot_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, MODEL_VERSION))
+    buffer.write(_payload_length.pack(payload.tell()))
+    buffer.write(payload.getbuffer())
+    frames.write(buffer)
+    tmp = buffer.getvalue()
+    if as_text:
+        tmp = SNAPSHOT_TEXT_PREFIX + base64.b64encode(tmp).decode("ascii")
     print("  serialize_state length: "+str(len(tmp))+" OUT")
 
     return tmp
 
 
-def deserialize_state(st: str, state_version: int = MODEL_VERSION):
+def deserialize_state(st, state_version: int = MODEL_VERSION):
     """
     Deserializes an object previously serialized using "serialize_state"
 
-    It can receive also a "State" modified for the serialization to restore it
+    Binary snapshots (also in text form) and the previous JSON (jsonpickle) serialization are supported
+
+    :param state_version: version number of the internal models
+    :param st:
+    :return:
+    """
+    print("  deserialize_state")
+    if is_state_snapshot(st):
+        if isinstance(st, str):
+            st = base64.b64decode(st[len(SNAPSHOT_TEXT_PREFIX):])
+        # Writable, so DataFrame columns (views on the buffer) can be modified
+        buffer = memoryview(bytearray(st))
+        _, format_version, model_version = _snapshot_header.unpack_from(buffer)
+        if format_version > SNAPSHOT_FORMAT_VERSION:
+            raise Exception(f"The state snapshot format version {format_version} is not supported. "
+                            f"Current version is {SNAPSHOT_FORMAT_VERSION}.")
+        if model_version != MODEL_VERSION:
+            raise Exception(f"The model version {model_version} is not supported. Current version is {MODEL_VERSION}.")
+        tmp = sys.getrecursionlimit()
+        sys.setrecursionlimit(10000)
+        try:
+            if format_version == 1:
+                state = _StateUnpickler(io.BytesIO(buffer[_snapshot_header.size:])).load()
+            else:
+                start = _snapshot_header.size + _payload_length.size
+                end = start + _payload_length.unpack_from(buffer, _snapshot_header.size)[0]
+                state = _StateUnpickler(io.BytesIO(buffer[start:end]), ColumnarReader(buffer[end:])).load()
+        finally:
+            sys.setrecursionlimit(tmp)
+        return state
+    elif isinstance(st, str):
+        return deserialize_json_state(st, state_version)
+    else:
+        raise Exception(f"Serialized state must be a state snapshot or a string: currently is of type {type(st)}")
+
+
+def deserialize_json_state(st: str, state_version: int = MODEL_VERSION):
+    """
+    Deserializes a state serialized in JSON (jsonpickle), the format used before binary snapshots
 
     :param state_version: version number of the internal models
     :param st:
@@ -190,7 +375,6 @@ def deserialize_state(st: str, state_version: int = MODEL_VERSION):
         # df.index.names = t[0]
         return df
 
-    print("  deserialize_state")
     if isinstance(st, str):
         # TODO: use state_version to convert a previous version to the latest one
         #  This means transforming the old json to the latest json
@@ -1,7 +1,10 @@
 import io
 import os
 import sys
+import copy
+import uuid
 import binascii
+import tempfile
 import urllib
 import openpyxl
 import redis
@@ -14,7 +17,7 @@ from sqlalchemy.pool import StaticPool
 # from flask import (jsonify, abort, redirect, url_for,
 #
 #                    )
-from flask import (Response, request, session as flask_session, send_from_directory
+from flask import (Response, request, session as flask_session, send_from_directory, g
                    )
 from flask.helpers import get_root_path
 from flask_session import Session as FlaskSessionServerSide
@@ -53,7 +56,13 @@ from backend.restful_service import nis_api_base, nis_client_base, nis_external_
     tm_permissions, \
     tm_case_study_version_statuses
 from backend.models import log_level
-from backend.restful_service.serialization import serialize, deserialize, serialize_state, deserialize_state
+from backend.restful_service.serialization import serialize, deserialize, serialize_state, deserialize_state, \
+    list_datasets
+from backend.restful_service.sessions_cache import InteractiveSessionsCache
+from backend.restful_service.session_codec import SessionBlobCodec
+from backend.model_services.execution_cache import ExecutionCache
+from backend.command_generators.parser_field_parsers import ast_cache
+import backend.solving.flow_graph_solver
 from backend.ie_exports.flows_graph import BasicQuery, construct_flow_graph, construct_flow_graph_2
 from backend.ie_exports.processors_graph import construct_processors_graph, construct_processors_graph_2
 from backend.models.musiasem_concepts import Hierarchy
@@ -178,6 +187,34 @@ app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_REDIS"] = backend.redis
 
 FlaskSessionServerSide(app)
+
+# Live InteractiveSession objects of this worker, to avoid decoding them from REDIS on every request
+isessions_cache = InteractiveSessionsCache(app.config.get("ISESSION_CACHE_SIZE", 16))
+
+# Compression of the interactive session payloads stored in REDIS
+session_codec = SessionBlobCodec(app.config.get("SESSION_COMPRESSION", "zlib"),
+                                 app.config.get("SESSION_COMPRESSION_LEVEL"))
+
+# Number of commands after which the State of a case study version is checkpointed (instead of only journaled)
+if "STATE_CHECKPOINT_INTERVAL" in app.config:
+    ReproducibleSession.checkpoint_interval = int(app.config["STATE_CHECKPOINT_INTERVAL"])
+
+# Cache of command executions (States resulting of executing commands), in a local directory. Disabled unless a size
+# is configured. Without EXECUTION_CACHE_DIR, a private directory is created for this process
+if int(app.config.get("EXECUTION_CACHE_SIZE", 0)) > 0:
+    backend.execution_cache = ExecutionCache(app.config.get("EXECUTION_CACHE_DIR") or
+                                             tempfile.mkdtemp(prefix="nis_execution_cache_"),
+                                             int(app.config["EXECUTION_CACHE_SIZE"]))
+
+# Number of entries of the cache of parsed expressions (ASTs). 0 disables it
+if "AST_CACHE_SIZE" in app.config:
+    ast_cache.max_size = int(app.config["AST_CACHE_SIZE"])
+    ast_cache.clear()
+
+# Number of processes solving independent components of flow graphs (1: in the process of the request)
+if "SOLVER_WORKERS" in app.config:
+    backend.solving.flow_graph_solver.solver_workers = int(app.config["SOLVER_WORKERS"])
+
 CORS(app,
      # resources={r"/nis_api/*": {"origins": "http://localhost:4200"}},
      resources={r"/nis_api/*": {"origins": "*"}},
@@ -226,6 +263,7 @@ def serialize_isession_and_close_db_session(sess: InteractiveSession):
     # Serialize state
     if isinstance(sess._state, str):
         print("Str")
+    state = sess._state
     sess._state = serialize_state(sess._state)  # TODO New
 
     # Serialize WorkSession apart, if it exists
@@ -239,7 +277,7 @@ def serialize_isession_and_close_db_session(sess: InteractiveSession):
             d_list = serialize(o_list)
             # JSON Pickle and save string
             s = jsonpickle.encode({"allow_saving": sess._reproducible_session._allow_saving, "pers": d_list})
-            flask_session["rsession"] = s
+            flask_session["rsession"] = session_codec.encode(s, "rsession")
             sess._reproducible_session = None
         else:
             # TODO New code. Test it
@@ -255,12 +293,19 @@ def serialize_isession_and_close_db_session(sess: InteractiveSession):
     sess._reproducible_session = None
     # Serialize sess.state and sess._identity
     s = jsonpickle.encode(sess)
-    flask_session["isession"] = s
+    flask_session["isession"] = session_codec.encode(s, "isession")
 
     # # Save pickled state, for "in-vitro" analysis
     # with open("/home/rnebot/pickled_state", "w") as f:
     #     f.write(s)
 
+    # The live InteractiveSession goes to the cache of this worker when the request ends, stamped with the version
+    # just written to REDIS
+    sess._state = state
+    stamp = uuid.uuid4().hex
+    flask_session["isession_stamp"] = stamp
+    g.isession_checkout = (flask_session.sid, stamp, sess, True)
+
     sess.set_sf(tmp)
     sess.close_db_session()
 
@@ -270,22 +315,20 @@ def serialize_isession_and_close_db_session(sess: InteractiveSession):
 def deserialize_isession_and_prepare_db_session(return_error_response_if_none=True) -> InteractiveSession:
     print("deserialize_issesion IN")
     if "isession" in flask_session:
-        s = flask_session["isession"]
+        stamp = flask_session.get("isession_stamp")
+        sess = isessions_cache.checkout(flask_session.sid, stamp)
         try:
-            sess = jsonpickle.decode(s)
-            if sess._state:
-                sess._state = deserialize_state(sess._state)
+            if not sess:
+                sess = jsonpickle.decode(session_codec.decode(flask_session["isession"], "isession"))
+                if sess._state:
+                    sess._state = deserialize_state(sess._state)
             sess.set_sf(DBSession)
-            if "rsession" in flask_session:
-                rs = ReproducibleSession(sess)
-                rs.set_sf(sess.get_sf())
-                d = jsonpickle.decode(flask_session["rsession"])
-                rs._allow_saving = d["allow_saving"]
-                o_list = deserialize(d["pers"])
-                rs._session = o_list[2]  # type: CaseStudyVersionSession
-                sess._reproducible_session = rs
+            deserialize_reproducible_session(sess)
         except Exception as e:
             sess = None
+        if sess:
+            # Returned to the cache when the request ends, if it is written back to REDIS
+            g.isession_checkout = (flask_session.sid, stamp, sess, False)
     else:
         sess = None
 
@@ -297,6 +340,54 @@ def deserialize_isession_and_prepare_db_session(return_error_response_if_none=Tr
         return sess
 
 
+def deserialize_reproducible_session(sess: InteractiveSession):
+    if "rsession" in flask_session:
+        rs = ReproducibleSession(sess)
+        rs.set_sf(sess.get_sf())
+        d = jsonpickle.decode(session_codec.decode(flask_session["rsession"], "rsession"))
+        rs._allow_saving = d["allow_saving"]
+        o_list = deserialize(d["pers"])
+        rs._session = o_list[2]  # type: CaseStudyVersionSession
+        sess._reproducible_session = rs
+    else:
+        sess._reproducible_session = None
+
+
+def read_only_isession(return_error_response_if_none=True) -> InteractiveSession:
+    """
+    Recover the InteractiveSession for a request which only reads it (queries on the State)
+
+    The State is obtained from the cache of live sessions (or decoded once and left there), it is shared with other
+    concurrent readers, and it is never written back to REDIS. So it MUST NOT be modified. The returned object is a
+    shallow copy of the InteractiveSession, with its own ReproducibleSession
+
+    :param return_error_response_if_none: If there is no InteractiveSession, return an error Response instead of None
+    :return: The InteractiveSession (copy), None or an error Response
+    """
+    sess = None
+    if "isession" in flask_session:
+        sid = flask_session.sid
+        stamp = flask_session.get("isession_stamp")
+        shared = isessions_cache.share(sid, stamp)
+        try:
+            if not shared:
+                shared = jsonpickle.decode(session_codec.decode(flask_session["isession"], "isession"))
+                if shared._state:
+                    shared._state = deserialize_state(shared._state)
+                isessions_cache.checkin(sid, stamp, shared, shared=True)
+            g.isession_shared = (sid, shared)
+            sess = copy.copy(shared)
+            sess.set_sf(DBSession)
+            deserialize_reproducible_session(sess)
+        except Exception as e:
+            sess = None
+
+    if not sess and return_error_response_if_none:
+        return NO_ISESS_RESPONSE
+    else:
+        return sess
+
+
 def is_testing_enabled():
     if "TESTING" in app.config:
         if isinstance(app.config["TESTING"], bool):
@@ -335,6 +426,22 @@ def after_a_request(response):
 
     return response
 
+
+@app.teardown_request
+def checkin_interactive_session(exc):
+    # Return the InteractiveSession used by the request to the cache, only if it was written back to REDIS. Otherwise
+    # the request may have modified it, so it is dropped. The ReproducibleSession is not kept, it is bound to the DB
+    # session of the request
+    checkout = g.pop("isession_checkout", None)
+    if checkout:
+        sid, stamp, isess, written = checkout
+        isess._reproducible_session = None
+        isessions_cache.end_checkout(sid, stamp, isess, written and not exc)
+    # Readers release the shared InteractiveSession in any case
+    shared = g.pop("isession_shared", None)
+    if shared:
+        isessions_cache.release(*shared)
+
 # #####################################################################################################################
 # >>>> SERVE ANGULAR2 CLIENT FILES <<<<
 # #####################################################################################################################
@@ -416,7 +523,7 @@ def send_static_file(path):
 @app.route(nis_api_base + "/isession/rsession/state_summary", methods=["GET"])
 def summary_status():  # Summary status
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     d = {}
     if isess:
         d["isession_open"] = True
@@ -435,6 +542,18 @@ def summary_status():  # Summary status
     return build_json_response(d, 200)
 
 
+@app.route(nis_api_base + "/metrics/sessions", methods=["GET"])
+def sessions_metrics():
+    """ Metrics of interactive session payloads (sizes, times), of the cache of live sessions, of the cache of
+    command executions and of the cache of parsed expressions, in this worker """
+    d = dict(compression=dict(codec=session_codec.codec, payloads=session_codec.metrics()),
+             isessions_cache=dict(size=len(isessions_cache), hits=isessions_cache.hits, misses=isessions_cache.misses),
+             ast_cache=dict(size=len(ast_cache), hits=ast_cache.hits, misses=ast_cache.misses))
+    if backend.execution_cache:
+        d["execution_cache"] = dict(hits=backend.execution_cache.hits, misses=backend.execution_cache.misses)
+    return build_json_response(d, 200)
+
+
 # -- Interactive session --
 
 
@@ -584,6 +703,8 @@ def interactive_session_close():
     if isess:
         isess.quit()
 
+    g.pop("isession_checkout", None)
+    isessions_cache.discard(flask_session.sid)
     flask_session.clear()
     flask_session["__invalidate__"] = True
     return build_json_response({})
@@ -865,7 +986,7 @@ def reproducible_session_get_state():  # Return current status of ReproducibleSe
 @app.route(nis_api_base + "/isession/rsession/state_query", methods=["GET"])
 def reproducible_session_query_state():  # Query aspects of State
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -888,7 +1009,7 @@ def reproducible_session_query_state():  # Query aspects of State
 @app.route(nis_api_base + "/isession/rsession/state_query/issues", methods=["GET"])
 def reproducible_session_query_state_list_issues():  # Query list of issues IN the current state
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -910,7 +1031,7 @@ def reproducible_session_query_state_list_issues():  # Query list of issues IN t
 @app.route(nis_api_base + "/isession/rsession/state_query/everything_executed", methods=["GET"])
 def reproducible_session_query_state_everything_executed():  # Query if all commands have been executed
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -938,19 +1059,19 @@ def query_state_list_results(isess):
     # A reproducible session must be open, signal about it if not
     if isess.reproducible_session_opened():
         if isess.state:
-            glb_idx, p_sets, hh, datasets, mappings = get_case_study_registry_objects(isess.state)
+            # Names and sizes from metadata, datasets are not loaded
             r = {"datasets":
                      [dict(name=k,
                            type="dataset",
-                           description=F"Dataset with {datasets[k].data.shape[0]} rows, {datasets[k].data.size} cells, "
-                           F"{datasets[k].data.memory_usage(True).sum()} bytes",
-                           # nelements=datasets[k].data.size,
-                           # nrows=datasets[k].data.shape[0],
-                           # size=datasets[k].data.memory_usage(True).sum(),
+                           description=F"Dataset with {rows} rows, {rows * cols} cells, {size} bytes"
+                           if rows is not None else "Dataset with no data",
+                           # nelements=rows * cols,
+                           # nrows=rows,
+                           # size=size,
                            formats=[dict(format=f,
                                          url=nis_api_base + F"/isession/rsession/state_query/datasets/{k}.{f.lower()}")
                                     for f in dataset_formats],
-                           ) for k in datasets
+                           ) for k, rows, cols, size in list_datasets(isess.state)
                       ] +
                      [dict(name="FG",
                            type="graph",
@@ -1008,7 +1129,7 @@ def query_state_list_results(isess):
 @app.route(nis_api_base + "/isession/rsession/state_query/datasets", methods=["GET"])
 def reproducible_session_query_state_list_results():  # Query list of datasets IN the current state
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1026,7 +1147,7 @@ def reproducible_session_query_state_list_results():  # Query list of datasets I
 
 @app.route(nis_api_base + "/isession/rsession/state_query/geolayer.<format>", methods=["GET"])
 def get_geolayer(format):
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1055,7 +1176,7 @@ def get_geolayer(format):
 def get_ontology(format):
     # TODO OWLREADY2 installation on the Docker image issues a problem
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1090,7 +1211,7 @@ script capaz de reproducir lo ejecutado
     :return:
     """
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1118,7 +1239,7 @@ script capaz de reproducir lo ejecutado
 @app.route(nis_api_base + "/isession/rsession/state_query/r_script.<format>", methods=["GET"])
 def get_r_script(format):
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1142,7 +1263,7 @@ def get_r_script(format):
 
 @app.route(nis_api_base + "/isession/rsession/state_query/model.<format>", methods=["GET"])
 def get_model(format):
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1166,7 +1287,7 @@ def get_model(format):
 @app.route(nis_api_base + '/isession/rsession/state_query/flow_graph.<format>', methods=["GET"])
 def obtain_flow_graph(format):
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1195,7 +1316,7 @@ def obtain_flow_graph(format):
 @app.route(nis_api_base + '/isession/rsession/query/flow_graph.visjs', methods=["GET"])
 def obtain_flow_graph_visjs_format():
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1214,7 +1335,7 @@ def obtain_flow_graph_visjs_format():
 @app.route(nis_api_base + '/isession/rsession/query/processors_graph.visjs', methods=["GET"])
 def obtain_processors_graph_visjs_format():
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1233,7 +1354,7 @@ def obtain_processors_graph_visjs_format():
 @app.route(nis_api_base + "/isession/rsession/state_query/datasets/<name>.<format>", methods=["GET"])
 def reproducible_session_query_state_get_dataset(name, format):  # Query list of datasets IN the current state
     # Recover InteractiveSession
-    isess = deserialize_isession_and_prepare_db_session()
+    isess = read_only_isession()
     if isess and isinstance(isess, Response):
         return isess
 
@@ -1260,7 +1381,8 @@ def reproducible_session_query_state_get_dataset(name, format):  # Query list of
                                 t = nodes[nn]
                                 tmp.append([t[0].lower(), t[1]])  # CSens
                             if not backend.case_sensitive and ds2[col].dtype == 'O':
-                                ds2[col + "_l"] = ds2[col].str.lower()
+                                # Not in place, "ds.data" may be shared with the cached InteractiveSession
+                                ds2 = ds2.assign(**{col + "_l": ds2[col].str.lower()})
                                 col = col + "_l"
 
                             # Dataframe of codes and descriptions
@@ -0,0 +1,117 @@
+"""
+Compression of the interactive session payloads stored in REDIS ("isession" and "rsession" keys of the Flask session)
+
+A compressed payload starts with BLOB_MAGIC followed by one byte identifying the codec, so payloads written with any
+codec (or not compressed, as before) can always be read.
+
+Codecs: "zlib" (default, at the fastest level), "lzma", "bz2", "none", and "lz4" or "zstd" if the corresponding
+packages are installed.
+"""
+import bz2
+import lzma
+import threading
+import time
+import zlib
+
+BLOB_MAGIC = b"NISZ"
+
+
+def _codecs():
+    codecs = {"none": (0, lambda b, level: b, lambda b: b, None),
+              "zlib": (1, lambda b, level: zlib.compress(b, level), zlib.decompress, 1),
+              "lzma": (2, lambda b, level: lzma.compress(b, preset=level), lzma.decompress, 0),
+              "bz2": (3, lambda b, level: bz2.compress(b, level), bz2.decompress, 1),
+              }
+    try:
+        import lz4.frame
+        codecs["lz4"] = (4, lambda b, level: lz4.frame.compress(b, compression_level=level), lz4.frame.decompress, 0)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        codecs["zstd"] = (5,
+                          lambda b, level: zstandard.ZstdCompressor(level=level).compress(b),
+                          lambda b: zstandard.ZstdDecompressor().decompress(b),
+                          1)
+    except ImportError:
+        pass
+    return codecs
+
+
+# Codec name -> (identifier, compress function, decompress function, default level)
+CODECS = _codecs()
+
+
+class SessionBlobCodec:
+    def __init__(self, codec: str="zlib", level: int=None):
+        """
+        :param codec: Name of the codec used to compress (any known codec can be decompressed)
+        :param level: Compression level. None for the default of the codec (a fast one)
+        """
+        if codec not in CODECS:
+            raise Exception(f"Session compression codec '{codec}' not available. Available: {', '.join(CODECS)}")
+        self._codec = codec
+        self._id, self._compress, _, default_level = CODECS[codec]
+        self._level = level if level is not None else default_level
+        self._decompressors = {c[0]: c[2] for c in CODECS.values()}
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    @property
+    def codec(self):
+        return self._codec
+
+    def _account(self, key, operation, raw, compressed, seconds):
+        with self._lock:
+            m = self._metrics.setdefault(key, dict(encoded=0, decoded=0, raw_bytes=0, compressed_bytes=0,
+                                                    encode_seconds=0.0, decode_seconds=0.0,
+                                                    last_raw_bytes=0, last_compressed_bytes=0))
+            m[operation] += 1
+            m[operation[:-1] + "_seconds"] += seconds
+            if operation == "encoded":
+                m["raw_bytes"] += raw
+                m["compressed_bytes"] += compressed
+                m["last_raw_bytes"] = raw
+                m["last_compressed_bytes"] = compressed
+
+    def encode(self, s: str, key: str="") -> bytes:
+        """
+        Compress a payload
+
+        :param s: The payload, a string (jsonpickle)
+        :param key: Name of the payload, for metrics
+        :return: Compressed payload
+        """
+        start = time.perf_counter()
+        raw = s.encode("utf-8")
+        b = BLOB_MAGIC + bytes((self._id, )) + self._compress(raw, self._level)
+        self._account(key, "encoded", len(raw), len(b), time.perf_counter() - start)
+        return b
+
+    def decode(self, b, key: str="") -> str:
+        """
+        Decompress a payload
+
+        :param b: Compressed payload, or a string (payload not compressed)
+        :param key: Name of the payload, for metrics
+        :return: The payload
+        """
+        if isinstance(b, str):
+            return b
+        start = time.perf_counter()
+        if b[:len(BLOB_MAGIC)] != BLOB_MAGIC:
+            raise Exception("Unknown format of session payload")
+        codec_id = b[len(BLOB_MAGIC)]
+        if codec_id not in self._decompressors:
+            raise Exception(f"Session payload compressed with a codec ({codec_id}) which is not available")
+        s = self._decompressors[codec_id](b[len(BLOB_MAGIC)+1:]).decode("utf-8")
+        self._account(key, "decoded", 0, 0, time.perf_counter() - start)
+        return s
+
+    def metrics(self) -> dict:
+        """
+        :return: Per payload name: number of encodings and decodings, accumulated raw and compressed sizes (bytes),
+                 accumulated time (seconds) and sizes of the last encoding
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self._metrics.items()}
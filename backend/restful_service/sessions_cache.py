@@ -0,0 +1,125 @@
+"""
+Cache of live InteractiveSession objects, local to the worker process
+
+REDIS (through Flask-Session) is the source of truth for interactive sessions. Each time an InteractiveSession is
+written there, a new "stamp" is written with it. The live object is kept in this cache, under the same stamp, so
+the next request of the same client arriving to the same worker can skip decoding the session, if the stamp stored in
+REDIS did not change in between (a request served by another worker writes a new stamp).
+
+An InteractiveSession is "checked out" (removed from the cache) while a request uses it, and it is "checked in"
+again when the request ends, if the request wrote it to REDIS. In this way two concurrent requests of the same client
+never share the live object, and a session modified by a request which did not write it is never reused.
+
+Requests which only read the session "share" it instead: any number of readers may use the cached object at the same
+time, and it stays in the cache. A checkout while there are readers does not obtain the shared object (the caller
+decodes its own copy from REDIS), so readers never see a session being modified.
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class InteractiveSessionsCache:
+    def __init__(self, max_size: int=16):
+        """
+        :param max_size: Maximum number of live sessions kept. Least recently used are evicted. 0 disables the cache
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()  # Flask session ID -> [stamp, InteractiveSession, number of readers]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    def checkout(self, sid: str, stamp: str) -> Optional["InteractiveSession"]:
+        """
+        Obtain the live InteractiveSession of a Flask session, if it is cached and its stamp matches
+
+        :param sid: Flask session ID
+        :param stamp: Stamp of the InteractiveSession currently stored in REDIS
+        :return: The InteractiveSession, or None if it has to be decoded from REDIS
+        """
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry and stamp and entry[0] == stamp:
+                if entry[2] == 0:
+                    del self._entries[sid]
+                    self.hits += 1
+                    return entry[1]
+            elif entry:
+                del self._entries[sid]
+            self.misses += 1
+            return None
+
+    def share(self, sid: str, stamp: str) -> Optional["InteractiveSession"]:
+        """
+        Obtain the live InteractiveSession of a Flask session, to be only read. It stays in the cache, and it has to be
+        released when the reader finishes
+
+        :param sid: Flask session ID
+        :param stamp: Stamp of the InteractiveSession currently stored in REDIS
+        :return: The InteractiveSession, or None if it has to be decoded from REDIS
+        """
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry and stamp and entry[0] == stamp:
+                entry[2] += 1
+                self._entries.move_to_end(sid)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def checkin(self, sid: str, stamp: str, isess: "InteractiveSession", shared: bool=False):
+        """
+        Keep the live InteractiveSession of a Flask session. "stamp" must correspond to the version stored in REDIS
+
+        :param sid: Flask session ID
+        :param stamp: Stamp of the InteractiveSession stored in REDIS
+        :param isess: The InteractiveSession
+        :param shared: True if the caller keeps reading the InteractiveSession (it has to call "release" later)
+        """
+        if not self.enabled or not stamp:
+            return
+        with self._lock:
+            self._entries[sid] = [stamp, isess, 1 if shared else 0]
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def end_checkout(self, sid: str, stamp: str, isess: "InteractiveSession", written: bool):
+        """
+        A request which checked out an InteractiveSession ends. It is kept only if the request wrote it to REDIS:
+        otherwise it may have been modified, and it would not correspond to the version in REDIS
+
+        :param sid: Flask session ID
+        :param stamp: Stamp of the InteractiveSession stored in REDIS
+        :param isess: The InteractiveSession
+        :param written: True if the request wrote the InteractiveSession to REDIS, under "stamp"
+        """
+        if written:
+            self.checkin(sid, stamp, isess)
+        else:
+            self.discard(sid)
+
+    def release(self, sid: str, isess: "InteractiveSession"):
+        """
+        A reader finished using a shared InteractiveSession
+
+        :param sid: Flask session ID
+        :param isess: The InteractiveSession obtained with "share" (or checked in as shared)
+        """
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry and entry[1] is isess and entry[2] > 0:
+                entry[2] -= 1
+
+    def discard(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def __len__(self):
+        return len(self._entries)
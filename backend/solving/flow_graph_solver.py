@@ -25,24 +25,36 @@ Before the elaboration of flow graphs, several preparatory steps:
 * Observers (different versions). Take average always
 
 """
+import concurrent.futures
 from collections import namedtuple
 
 #import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
 from typing import Dict, List, Set, Any, Tuple, Union, Optional, NamedTuple
 
 from backend import case_sensitive, ureg
-from backend.command_generators.parser_ast_evaluators import ast_evaluator
+from backend.command_generators.parser_ast_evaluators import compiled_expression, ast_variables, \
+    compile_ast_vectorized
 from backend.command_generators.parser_field_parsers import string_to_ast, expression_with_parameters, is_year, is_month
-from backend.common.helper import create_dictionary, PartialRetrievalDictionary, ifnull, Memoize
+from backend.common.helper import create_dictionary, PartialRetrievalDictionary, ifnull, Memoize, unit_to_base
 from backend.models.musiasem_concepts import ProblemStatement, Parameter, FactorsRelationDirectedFlowObservation, \
     FactorTypesRelationUnidirectionalLinearTransformObservation, FactorsRelationScaleObservation, Processor, \
-    FactorQuantitativeObservation, Factor, ProcessorsRelationPartOfObservation, ProcessorsRelationUpscaleObservation
+    FactorQuantitativeObservation, Factor, ProcessorsRelationPartOfObservation, ProcessorsRelationUpscaleObservation, \
+    ParameterDependencies
 from backend.model_services import get_case_study_registry_objects, State
 from backend.models.musiasem_concepts_helper import find_quantitative_observations
+from backend.solving.graph import EdgeType
 from backend.solving.graph.computation_graph import ComputationGraph
 from backend.solving.graph.flow_graph import FlowGraph
 
+# Number of processes solving independent components of the flow graphs (1: solve in the current process). The
+# "workers" solving parameter of the ProblemStatement, if present, has precedence
+solver_workers = 1
+# Maximum number of combinations of (non conflicting) observations solved for each flow graph (None: all). The
+# "max_combinations" solving parameter of the ProblemStatement, if present, has precedence
+max_param_combinations = 100
+
 
 @Memoize
 def get_processor_name(processor: Processor, registry: PartialRetrievalDictionary) -> str:
@@ -202,6 +214,234 @@ def create_scales_graph(scale_relations: List[FactorsRelationScaleObservation])
     return G
 
 
+_vectorized_expressions = {}  # Expression (string) -> (AST, function from "compile_ast_vectorized", variables)
+
+
+def _parse_parameter_expression(expression: str):
+    """ AST, vectorized function (may be None) and variables of the expression of a parameter """
+    if expression not in _vectorized_expressions:
+        if len(_vectorized_expressions) > 10000:
+            _vectorized_expressions.clear()
+        ast = compiled_expression(expression).ast
+        _vectorized_expressions[expression] = (ast, compile_ast_vectorized(ast), ast_variables(ast))
+    return _vectorized_expressions[expression]
+
+
+def evaluate_parameters_for_scenarios(base_params: List[Parameter], scenarios: Dict[str, Dict[str, str]]) \
+        -> Dict[str, np.ndarray]:
+    """
+    Evaluate the parameters for ALL the scenarios at once (see "evaluate_parameters_for_scenario", for one scenario)
+
+    The dependencies between parameters (all the expressions in all the scenarios) are ordered topologically once.
+    Then, each parameter is evaluated once for all the scenarios sharing its expression, as NumPy vectors (one element
+    per scenario). Expressions which cannot be vectorized (strings, categories, ...) are evaluated scenario by scenario
+
+    :param base_params: Parameters, with their default values
+    :param scenarios: Dictionary scenario name -> Dictionary parameter name -> expression (ProblemStatement.scenarios)
+    :return: Dictionary parameter name -> vector of values, one per scenario (in the order of "scenarios"). Parameters
+             not defined in a scenario have None in it
+    """
+    n = len(scenarios)
+
+    def norm(name):
+        return name if case_sensitive else name.lower()
+
+    # Expression of each parameter in each scenario (None if not defined)
+    expressions = create_dictionary()
+    for p in base_params:
+        if p.default_value:
+            expressions[p.name] = [p.default_value] * n
+    for i, scenario_params in enumerate(scenarios.values()):
+        for param, expression in scenario_params.items():
+            if param not in expressions:
+                expressions[param] = [None] * n
+            expressions[param][i] = expression
+
+    # Parse once each different expression, obtaining the dependencies
+    graph = nx.DiGraph()
+    asts = {}
+    for param, param_expressions in expressions.items():
+        graph.add_node(norm(param))
+        for expression in set(e for e in param_expressions if isinstance(e, str)):
+            try:
+                float(expression)
+                continue
+            except ValueError:
+                pass
+            _, _, variables = asts[expression] = _parse_parameter_expression(expression)
+            for param2 in variables:
+                graph.add_edge(norm(param2), norm(param))  # We need "param2" to obtain "param"
+
+    if not nx.is_directed_acyclic_graph(graph):
+        # Maybe a cycle combining different scenarios. Evaluate each scenario separately (it detects true cycles)
+        results = [evaluate_parameters_for_scenario(base_params, scenario_params)
+                   for scenario_params in scenarios.values()]
+        d = create_dictionary()
+        for param in expressions:
+            d[param] = np.array([r.get(param) for r in results], dtype=object)
+        return d
+
+    values = create_dictionary()  # Parameter name -> vector
+    lists = create_dictionary()  # Parameter name -> list of values (Python types)
+    not_evaluated = []
+    params = {norm(p): p for p in expressions}
+    for node in nx.topological_sort(graph):
+        param = params.get(node)
+        if param is None:  # Not a parameter
+            continue
+        res = np.empty(n, dtype=object)
+        # Group scenarios by expression
+        groups = {}
+        for i, expression in enumerate(expressions[param]):
+            groups.setdefault(expression if isinstance(expression, str) else ("", expression), []).append(i)
+        for expression, idx in groups.items():
+            if isinstance(expression, tuple):  # Literal (or None, if not defined)
+                res[idx] = expression[1]
+                continue
+            try:
+                res[idx] = float(expression)
+                continue
+            except ValueError:
+                pass
+            ast, vectorized, variables = asts[expression]
+            dependencies = [values.get(p) for p in variables]
+            if vectorized and all(v is not None and v.dtype != object for v in dependencies):
+                try:
+                    v = vectorized({p: values[p][idx] for p in variables}, len(idx))
+                    if v.dtype == bool or not np.isnan(v).any():
+                        res[idx] = v.tolist()
+                        continue
+                except FloatingPointError:
+                    pass
+            # Scenario by scenario (once if there are no variables)
+            evaluate = compiled_expression(expression)
+            for i in (idx if variables else idx[:1]):
+                state = State()
+                state.update({p: lists[p][i] for p in variables if p in lists and lists[p][i] is not None})
+                value, unresolved = evaluate(state)
+                if unresolved or value is None:
+                    not_evaluated.append(param)
+                res[i if variables else idx] = value
+        # Vectors of numbers or booleans if possible
+        if all(isinstance(v, bool) for v in res):
+            res = res.astype(bool)
+        elif all(isinstance(v, (int, float)) for v in res):
+            res = res.astype(float)
+        values[param] = res
+        lists[param] = res.tolist()
+
+    if len(not_evaluated) > 0:
+        raise Exception(f"Could not evaluate the following parameters: {', '.join(sorted(set(not_evaluated)))}")
+
+    return values
+
+
+def dependent_expression(obj) -> Any:
+    """ The expression of an object which may depend on parameters (observation, flow relation, scale relation) """
+    if isinstance(obj, FactorQuantitativeObservation):
+        return obj.value
+    elif isinstance(obj, FactorsRelationDirectedFlowObservation):
+        return obj.weight
+    elif isinstance(obj, FactorsRelationScaleObservation):
+        return obj.quantity
+
+
+def _expression_parameters(expression) -> Set[str]:
+    """ Names mentioned in an expression (string or AST), empty if it is a constant or it cannot be parsed """
+    if isinstance(expression, dict):
+        return ast_variables(expression)
+    elif isinstance(expression, str):
+        try:
+            float(expression)
+            return set()
+        except ValueError:
+            pass
+        try:
+            return ast_variables(compiled_expression(expression).ast)
+        except Exception:
+            return set()
+    return set()
+
+
+def get_parameter_dependencies(glb_idx: PartialRetrievalDictionary) -> ParameterDependencies:
+    """
+    Graph of dependencies on parameters of the registry. It is kept in the registry, and obtained again only if
+    the registry has been modified since (objects inserted, updated or deleted)
+
+    :param glb_idx: The registry
+    :return: ParameterDependencies
+    """
+    lst = glb_idx.get(ParameterDependencies.partial_key())
+    if lst and lst[0].registry_version == glb_idx.version:
+        return lst[0]
+
+    deps = ParameterDependencies()
+    for p in glb_idx.get(Parameter.partial_key()):
+        deps.add(p.name, _expression_parameters(p.default_value))
+    for partial_key in (FactorQuantitativeObservation.partial_key(),
+                        FactorsRelationDirectedFlowObservation.partial_key(),
+                        FactorsRelationScaleObservation.partial_key()):
+        for obj in glb_idx.get(partial_key):
+            parameters = _expression_parameters(dependent_expression(obj))
+            if parameters:
+                deps.add(obj, parameters)
+
+    if lst:
+        glb_idx.delete(ParameterDependencies.partial_key())
+    glb_idx.put(deps.key(), deps)
+    deps.registry_version = glb_idx.version
+    return deps
+
+
+def reevaluate_parameters(glb_idx: PartialRetrievalDictionary, params: Dict[str, Any], changes: Dict[str, Any],
+                          evaluated: bool = False) -> Tuple[Dict[str, Any], Dict[Any, Any]]:
+    """
+    After some parameters change, evaluate again only what depends on them
+
+    :param glb_idx: The registry, with the Parameters and the dependencies on them (see "get_parameter_dependencies")
+    :param params: Current values of all the parameters (parameter name -> value). It is updated
+    :param changes: Parameters changing (parameter name -> new value or expression)
+    :param evaluated: If True, "changes" are the values of ALL the parameters whose value changes. They are not
+                      evaluated, and neither are the parameters depending on them: only the objects are evaluated
+    :return: The parameters whose value changed (parameter name -> value), and the objects with expressions depending
+             on them (object -> value of its expression, None if it cannot be evaluated)
+    """
+    deps = get_parameter_dependencies(glb_idx)
+    parameter_names = {ParameterDependencies.normalize(p.name): p.name for p in glb_idx.get(Parameter.partial_key())}
+    expressions = create_dictionary()
+    expressions.update({p.name: p.default_value for p in glb_idx.get(Parameter.partial_key())})
+    expressions.update(changes)
+
+    state = State()
+    state.update(params)
+
+    def evaluate(expression):
+        value, _, _, issues = evaluate_numeric_expression_with_parameters(expression, state)
+        if value is None:
+            raise Exception(f"Could not evaluate expression '{expression}': {', '.join(issues)}")
+        return value
+
+    changed_params = create_dictionary()
+    for param, expression in changes.items():
+        changed_params[param] = expression if evaluated else evaluate(expression)
+        state.set(param, changed_params[param])
+    changed_objects = {}
+    changed_names = set(ParameterDependencies.normalize(p) for p in changes)
+    for node in deps.downstream(changes.keys()):
+        if isinstance(node, str):
+            if evaluated or node in changed_names:  # Its new value is known
+                continue
+            param = parameter_names.get(node, node)
+            changed_params[param] = evaluate(expressions[param])
+            state.set(param, changed_params[param])
+        else:  # None if it cannot be evaluated (the object may not be used)
+            changed_objects[node], _, _, _ = evaluate_numeric_expression_with_parameters(dependent_expression(node),
+                                                                                        state)
+
+    params.update(changed_params)
+    return changed_params, changed_objects
+
+
 def get_scale_beginning_interfaces(graph: nx.DiGraph):
     return set([node for node, data in graph.nodes(data=True) if data["beginning"]])
 
@@ -249,16 +489,21 @@ def set_update_scales_graph(graph: nx.DiGraph, params: Dict[str, Any],
     state = State()
     state.update(params)
 
-    # Evaluate (AST) all expressions from the INTERSECTION
+    # Evaluate (AST) all expressions from the INTERSECTION. Values are kept as floats, in base units; the units are
+    # attached at the end, converting back to the unit declared in the beginning of each chain
     defined_beginning_interfaces = beginning_interfaces.intersection(interfaces_with_value)
+    magnitudes = {}
+    units = {}  # Node -> (base units, declared units)
     for i in defined_beginning_interfaces:
         expression = beginning_values[i][0]
-        unit = ureg(beginning_values[i][1].attributes["unit"])
+        declared_unit = beginning_values[i][1].attributes["unit"] or "dimensionless"
+        factor, unit = unit_to_base(declared_unit)
         v, _, _, issues = evaluate_numeric_expression_with_parameters(expression, state)
         if not v:
             raise Exception(f"Could not evaluate expression '{expression}': {', '.join(issues)}")
         else:
-            graph.nodes[i]["value"] = v * unit
+            magnitudes[i] = v * factor
+            units[i] = (unit, ureg.Quantity(1, declared_unit).units)
 
     # Evaluate all edges
     for u, v, data in graph.edges(data=True):
@@ -273,16 +518,21 @@ def set_update_scales_graph(graph: nx.DiGraph, params: Dict[str, Any],
     # Now, compute values in nodes
     def compute_scaled_nodes(nodes):
         for i in nodes:
-            val = graph.nodes[i]["value"]
             tmp = []
             for suc in graph.successors(i):
                 # TODO Consider unit conversions, or the unit of the predecessor is inherited?
-                graph.nodes[suc]["value"] = graph.nodes[i]["value"] * graph.edges[i, suc]["value"]
+                magnitudes[suc] = magnitudes[i] * graph.edges[i, suc]["value"]
+                units[suc] = units[i]
                 tmp.append(suc)
             compute_scaled_nodes(tmp)
 
     compute_scaled_nodes(defined_beginning_interfaces)
 
+    # Attach units
+    for i, magnitude in magnitudes.items():
+        base_unit, declared_unit = units[i]
+        graph.nodes[i]["value"] = ureg.Quantity(magnitude, base_unit).to(declared_unit)
+
 
 def get_observations_OLD(prd: PartialRetrievalDictionary) \
         -> Tuple[PartialRetrievalDictionary, PartialRetrievalDictionary, Dict[str, int]]:
@@ -387,7 +637,7 @@ def evaluate_numeric_expression_with_parameters(expression: Union[float, str, di
 
     elif isinstance(expression, dict):
         ast = expression
-        value, params = ast_evaluator(ast, state, None, issues)
+        value, params = compiled_expression(ast)(state, issues)
         if value:
             ast = None
 
@@ -395,8 +645,9 @@ def evaluate_numeric_expression_with_parameters(expression: Union[float, str, di
         try:
             value = float(expression)
         except ValueError:
-            ast = string_to_ast(expression_with_parameters, expression)
-            value, params = ast_evaluator(ast, state, None, issues)
+            evaluate = compiled_expression(expression)
+            ast = evaluate.ast  # The same AST each time, it is compiled once
+            value, params = evaluate(state, issues)
             if value:
                 ast = None
 
@@ -485,6 +736,143 @@ def weakly_connected_subgraph(graph: nx.DiGraph, node: str) -> Optional[nx.graph
         return None
 
 
+def solve_flow_graph_component(edges: List[Tuple[str, str, Optional[float], Optional[float]]],
+                               splits: Dict[str, List[bool]], params: Dict[str, List[float]],
+                               max_combinations: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Solve a connected flow graph for several sets of values of the same interfaces (scenarios, time periods). Only
+    plain data in and out, so it can be executed in another process
+
+    :param edges: Edges of the computation graph (source interface, destination interface, weight, reverse weight)
+    :param splits: Interfaces -> 'split' attribute of the computation graph
+    :param params: Interfaces with value -> values (one per set)
+    :param max_combinations: Maximum number of combinations of parameters to solve (None: all)
+    :return: Computed interfaces -> values (NaN where there is no value). The first combination of parameters (the
+             ones with more parameters first) giving a value to an interface is kept
+    """
+    comp_graph = ComputationGraph()
+    for u, v, weight, reverse_weight in edges:
+        comp_graph.add_edge(u, v, weight, reverse_weight)
+    for n, split in splits.items():
+        comp_graph.mark_node_split(n, split[EdgeType.DIRECT.value], EdgeType.DIRECT)
+        comp_graph.mark_node_split(n, split[EdgeType.REVERSE.value], EdgeType.REVERSE)
+
+    print(f"****** NODES: {comp_graph.nodes}")
+
+    # Obtain nodes without a value
+    compute_nodes = [n for n in comp_graph.nodes if n not in params]
+
+    # Compute the missing information with the computation graph
+    if len(compute_nodes) == 0:
+        print("All nodes have a value. Nothing to solve.")
+        return {}
+
+    print(f"****** UNKNOWN NODES: {compute_nodes}")
+    print(f"****** PARAMS: {set(params)}")
+
+    conflicts = comp_graph.compute_param_conflicts(set(params))
+
+    for s, (param, conflicting) in enumerate(conflicts.items()):
+        print(f"Conflict {s + 1}: {param} -> {conflicting}")
+
+    combinations = ComputationGraph.select_param_combinations(conflicts, max_combinations)
+
+    values: Dict[str, np.ndarray] = {}
+    for s, combination in enumerate(combinations):
+        print(f"Combination {s}: {combination}")
+
+        filtered_params = {k: v for k, v in params.items() if k in combination}
+        results, _ = comp_graph.compute_values_batch(compute_nodes, filtered_params)
+
+        for n, result in results.items():
+            values[n] = np.where(np.isnan(values[n]), result, values[n]) if n in values else result
+
+        # TODO: work with "part_of_graph"
+        #  - Params: graph_params + results
+        #  - Compute conflicts, combinations
+        #  - For each combination "compute_values"
+
+    return values
+
+
+def solve_flow_graphs(cases: Dict[Tuple[int, int], Tuple[Dict[Tuple[str, str], Optional[float]], Dict[str, float]]],
+                      n_scenarios: int, n_periods: int, workers: int = 1, max_combinations: Optional[int] = None) \
+        -> Tuple[np.ndarray, List[str]]:
+    """
+    Solve the flow graph of each scenario and time period. Cases with the same graph (same edges and weights) and the
+    same interfaces with value are solved together: the computation graph is obtained and factorized once, and the
+    values of the interfaces are the columns of the right hand side
+
+    The weakly connected components of each graph are independent, they are solved separately, in parallel if
+    "workers" is greater than one
+
+    :param cases: (scenario index, time period index) -> (weights of the edges ((u, v) -> weight), interface values)
+    :param n_scenarios: Number of scenarios
+    :param n_periods: Number of time periods
+    :param workers: Number of processes solving components. 1 to solve in the current process
+    :param max_combinations: Maximum number of combinations of parameters solved for each component (None: all)
+    :return: Values cube (scenario x time period x interface, NaN where there is no value), and the interface names
+    """
+    groups: Dict[Tuple[frozenset, frozenset], List[Tuple[int, int]]] = {}
+    for case, (weights, graph_params) in cases.items():
+        groups.setdefault((frozenset(weights.items()), frozenset(graph_params)), []).append(case)
+
+    interfaces = sorted({n for weights, _ in cases.values() for edge in weights for n in edge})
+    interface_idx = {n: i for i, n in enumerate(interfaces)}
+    values = np.full((n_scenarios, n_periods, len(interfaces)), np.nan)
+
+    # Split into independent problems (group, component)
+    # A single flow graph is edited from one group to the next (usually only a few weights change between time
+    # periods), so its analysis is redone only around the changed edges
+    tasks = []
+    flow_graph = FlowGraph()
+    current_weights: Dict[Tuple[str, str], Optional[float]] = {}
+    for (weights, params), group in groups.items():
+        print(f"****** SOLVING {len(group)} scenario-time period combinations with the same graph")
+        for param in params:
+            values[[c[0] for c in group], [c[1] for c in group], interface_idx[param]] = \
+                [cases[c][1][param] for c in group]
+
+        new_weights = dict(weights)
+        for u, v in current_weights.keys() - new_weights.keys():
+            flow_graph.remove_edge(u, v)
+        for (u, v), weight in new_weights.items():
+            if (u, v) not in current_weights or current_weights[(u, v)] != weight:
+                flow_graph.add_edge(u, v, weight, None)
+        current_weights = new_weights
+
+        comp_graph, issues = flow_graph.get_computation_graph()
+        for issue in issues:
+            print(issue)
+        if comp_graph is None:
+            continue
+
+        graph = comp_graph.graph
+        for component in nx.weakly_connected_components(graph):
+            edges = [(u, v, w, graph[v][u]["weight"]) for u, v, w in graph.subgraph(component).edges(data="weight")
+                     if graph[u][v]["type"] == EdgeType.DIRECT]
+            splits = {n: list(graph.nodes[n]["split"]) for n in component}
+            tasks.append((group, edges, splits,
+                          {p: [cases[c][1][p] for c in group] for p in params if p in component}))
+
+    def merge(group, results: Dict[str, np.ndarray]):
+        for n, result in results.items():
+            values[[c[0] for c in group], [c[1] for c in group], interface_idx[n]] = result
+
+    if workers > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for (group, _, _, _), results in zip(tasks, executor.map(solve_flow_graph_component,
+                                                                     [t[1] for t in tasks], [t[2] for t in tasks],
+                                                                     [t[3] for t in tasks],
+                                                                     [max_combinations] * len(tasks))):
+                merge(group, results)
+    else:
+        for group, edges, splits, params in tasks:
+            merge(group, solve_flow_graph_component(edges, splits, params, max_combinations))
+
+    return values, interfaces
+
+
 def flow_graph_solver(global_parameters: List[Parameter], problem_statement: ProblemStatement,
                       input_systems: Dict[str, Set[Processor]], state: State):
     """
@@ -506,15 +894,24 @@ def flow_graph_solver(global_parameters: List[Parameter], problem_statement: Pro
         src: Factor
         dst: Factor
         weight: Optional[str]
+        relation: Any
 
     def add_edges(edges: List[Edge]):
-        for src, dst, weight in edges:
+        for src, dst, weight, relation in edges:
             src_name = get_interface_name(src, glb_idx)
             dst_name = get_interface_name(dst, glb_idx)
             if "Archetype" in [src.processor.instance_or_archetype, dst.processor.instance_or_archetype]:
                 print(f"WARNING: excluding relation from '{src_name}' to '{dst_name}' because of Archetype processor")
             else:
-                relations.add_edge(src_name, dst_name, weight=weight)
+                relations.add_edge(src_name, dst_name, weight=weight, relation=relation)
+
+    def expression_value(expression, obj) -> Tuple[Optional[float], List[str]]:
+        """ Value, in the current scenario, of the expression of an object (see "dependent_expression") """
+        if object_values.get(obj) is not None:
+            return object_values[obj], []
+        value, _, _, issues = evaluate_numeric_expression_with_parameters(expression, scenario_state)
+        object_values[obj] = value
+        return value, issues
 
     glb_idx, _, _, _, _ = get_case_study_registry_objects(state)
 
@@ -528,11 +925,11 @@ def flow_graph_solver(global_parameters: List[Parameter], problem_statement: Pro
     relations = nx.DiGraph()
 
     # Add Interfaces -Flow- relations (time independent)
-    add_edges([Edge(r.source_factor, r.target_factor, r.weight)
+    add_edges([Edge(r.source_factor, r.target_factor, r.weight, r)
                for r in glb_idx.get(FactorsRelationDirectedFlowObservation.partial_key())])
 
     # Add Processors -Scale- relations (time independent)
-    add_edges([Edge(r.origin, r.destination, r.quantity)
+    add_edges([Edge(r.origin, r.destination, r.quantity, r)
                for r in glb_idx.get(FactorsRelationScaleObservation.partial_key())])
 
     # TODO Expand flow graph with it2it transforms
@@ -545,15 +942,39 @@ def flow_graph_solver(global_parameters: List[Parameter], problem_statement: Pro
             value, ast, _, _ = evaluate_numeric_expression_with_parameters(expression, state)
             data["weight"] = ifnull(value, ast)
 
+    # Parameters of all scenarios, evaluated at once
+    scenarios_params = evaluate_parameters_for_scenarios(global_parameters, problem_statement.scenarios)
+    scenarios_params = {param: values.tolist() for param, values in scenarios_params.items()}
+
+    time_periods = list(time_observations_absolute.keys())
+
+    # Weights and values of the graph, for each scenario and time period. Solved later, all at once
+    cases: Dict[Tuple[int, int], Tuple[Dict[Tuple[str, str], float], Dict[str, float]]] = {}
+
+    # Values of the expressions of observations and relations (object -> value), for the current scenario. From one
+    # scenario to the next, only those depending on parameters with a different value are evaluated again
+    object_values = {}
+    previous_params = None
+
     for scenario_idx, (scenario_name, scenario_params) in enumerate(problem_statement.scenarios.items()):
 
         print(f"********************* SCENARIO: {scenario_name}")
 
         scenario_state = State()
-        scenario_combined_params = evaluate_parameters_for_scenario(global_parameters, scenario_params)
+        scenario_combined_params = create_dictionary()
+        scenario_combined_params.update({param: values[scenario_idx] for param, values in scenarios_params.items()
+                                         if values[scenario_idx] is not None})
         scenario_state.update(scenario_combined_params)
 
-        for time_period, observations in time_observations_absolute.items():
+        if previous_params is not None and all(p in scenario_combined_params for p in previous_params):
+            changes = {p: v for p, v in scenario_combined_params.items() if previous_params.get(p) != v}
+            _, changed_objects = reevaluate_parameters(glb_idx, scenario_combined_params, changes, evaluated=True)
+            object_values.update(changed_objects)
+        else:  # First scenario, or parameters not defined in this one: evaluate everything
+            object_values = {}
+        previous_params = scenario_combined_params
+
+        for period_idx, (time_period, observations) in enumerate(time_observations_absolute.items()):
 
             print(f"********************* TIME PERIOD: {time_period}")
 
@@ -566,7 +987,7 @@ def flow_graph_solver(global_parameters: List[Parameter], problem_statement: Pro
                 if interface_name not in relations.nodes:
                     print(f"WARNING: observation at interface '{interface_name}' is not taken into account.")
                 else:
-                    value, ast, _, issues = evaluate_numeric_expression_with_parameters(expression, scenario_state)
+                    value, issues = expression_value(expression, obs)
                     if not value:
                         raise Exception(f"Cannot evaluate expression '{expression}' for observation at "
                                         f"interface '{interface_name}'. Issues: {', '.join(issues)}")
@@ -575,73 +996,43 @@ def flow_graph_solver(global_parameters: List[Parameter], problem_statement: Pro
             assert(graph_params is not None)
 
             # Add Processors internal -RelativeTo- relations (time dependent)
-            # Transform relative observations into graph edges
-            for expression, obs in time_observations_relative[time_period]:
-                relations.add_edge(get_interface_name(obs.relative_factor, glb_idx),
-                                   get_interface_name(obs.factor, glb_idx),
-                                   weight=expression)
+            # Transform relative observations into graph edges (of the time period only)
+            expressions = {(u, v): (data["weight"], data["relation"]) for u, v, data in relations.edges(data=True)}
+            for expression, obs in time_observations_relative.get(time_period, []):
+                expressions[(get_interface_name(obs.relative_factor, glb_idx),
+                             get_interface_name(obs.factor, glb_idx))] = (expression, obs)
 
             # Second and last pass to resolve weight expressions: expressions with parameters can be solved
-            for u, v, data in relations.edges(data=True):
-                expression = data["weight"]
+            weights = {}
+            for (u, v), (expression, obj) in expressions.items():
                 if expression:
-                    value, ast, _, _ = evaluate_numeric_expression_with_parameters(expression, scenario_state)
+                    value, issues = expression_value(expression, obj)
                     if not value:
                         raise Exception(f"Cannot evaluate expression '{expression}' for weight "
                                         f"from interface '{u}' to interface '{v}'. Issues: {', '.join(issues)}")
-                    data["weight"] = value
-
-            # ----------------------------------------------------
-
-            if time_period == '2008':
-                for component in nx.weakly_connected_components(relations):
-                    nx.draw_kamada_kawai(relations.subgraph(component), with_labels=True)
-                    plt.show()
-
-            flow_graph = FlowGraph(relations)
-            comp_graph, issues = flow_graph.get_computation_graph()
-
-            for issue in issues:
-                print(issue)
-
-            print(f"****** NODES: {comp_graph.nodes}")
-
-            # ----------------------------------------------------
-
-            # Obtain nodes without a value
-            compute_nodes = [n for n in comp_graph.nodes if not graph_params.get(n)]
-
-            # Compute the missing information with the computation graph
-            if len(compute_nodes) == 0:
-                print("All nodes have a value. Nothing to solve.")
-                return []
-
-            print(f"****** UNKNOWN NODES: {compute_nodes}")
-            print(f"****** PARAMS: {graph_params}")
-
-            conflicts = comp_graph.compute_param_conflicts(set(graph_params.keys()))
-
-            for s, (param, values) in enumerate(conflicts.items()):
-                print(f"Conflict {s + 1}: {param} -> {values}")
-
-            combinations = ComputationGraph.compute_param_combinations(conflicts)
-
-            for s, combination in enumerate(combinations):
-                print(f"Combination {s}: {combination}")
-
-                filtered_params = {k: v for k, v in graph_params.items() if k in combination}
-                results, _ = comp_graph.compute_values(compute_nodes, filtered_params)
-
-                results_with_values = {k: v for k, v in results.items() if v}
-                print(f'  results_with_values={results_with_values}')
+                    weights[(u, v)] = value
+                else:
+                    weights[(u, v)] = None
 
-                # TODO: work with "part_of_graph"
-                #  - Params: graph_params + results
-                #  - Compute conflicts, combinations
-                #  - For each combination "compute_values"
+            cases[(scenario_idx, period_idx)] = (weights, graph_params)
 
+    # ----------------------------------------------------
 
-        # TODO INDICATORS
+    # if '2008' in time_periods:
+    #     for component in nx.weakly_connected_components(relations):
+    #         nx.draw_kamada_kawai(relations.subgraph(component), with_labels=True)
+    #         plt.show()
+
+    workers = int(problem_statement.solving_parameters.get("workers", solver_workers))
+    max_combinations = problem_statement.solving_parameters.get("max_combinations", max_param_combinations)
+    values, interfaces = solve_flow_graphs(cases, len(problem_statement.scenarios), len(time_periods), workers,
+                                           int(max_combinations) if max_combinations is not None else None)
+    state.set("_flow_graph_solver_results", dict(scenarios=list(problem_statement.scenarios.keys()),
+                                                 time_periods=time_periods,
+                                                 interfaces=interfaces,
+                                                 values=values))
+
+    # TODO INDICATORS
 
     # ----------------------------------------------------
     # ACCOUNTING PER SYSTEM
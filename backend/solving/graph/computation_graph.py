@@ -1,8 +1,13 @@
-from typing import Dict, List, Tuple, Set, Optional, NoReturn
+import itertools
+from typing import Dict, List, Tuple, Set, Optional, NoReturn, Sequence, Callable, Any, Iterator
 
 import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 
 from backend.solving.graph import Node, EdgeType, Weight, Value
+from backend.solving.graph.frozen_graph import FrozenGraph
 
 
 class ComputationGraph:
@@ -85,26 +90,60 @@ class ComputationGraph:
             :return: a dictionary with an entry for each parameter where the value is a set with the names of other
                      conflicting parameters
         """
-        def visit_forward(node: Node) -> Set[Node]:
-            visited_nodes.add(node)
-
+        frozen = self.freeze()
+
+        # Only edges with weight can be used to compute nodes
+        weighted = frozen.has_weight & (frozen.weight != 0)
+
+        # Condensation DAG: strongly connected components and the edges between them
+        n_components, component = frozen.strongly_connected_components(weighted)
+        src, dst = component[frozen.source[weighted]], component[frozen.target[weighted]]
+        between = src != dst
+        dag = scipy.sparse.csr_matrix((np.ones(np.count_nonzero(between), dtype=np.int8), (src[between], dst[between])),
+                                      shape=(n_components, n_components))
+        dag.sum_duplicates()
+        offsets, successors = dag.indptr.tolist(), dag.indices.tolist()
+
+        # Topological order (Kahn)
+        in_degree = np.bincount(dag.indices, minlength=n_components).tolist()
+        order = [c for c in range(n_components) if in_degree[c] == 0]
+        for c in order:  # "order" grows while it is traversed
+            for suc in successors[offsets[c]:offsets[c + 1]]:
+                in_degree[suc] -= 1
+                if in_degree[suc] == 0:
+                    order.append(suc)
+
+        # Reachable parameters from each component, as bitmasks, in reverse topological order: a component reaches
+        # its own parameters plus those reached by its successors
+        param_list = [p for p in params if p in frozen.index]
+        reachable = [0] * n_components
+        for i, p in enumerate(param_list):
+            reachable[component[frozen.index[p]]] |= 1 << i
+        for c in reversed(order):
+            mask = reachable[c]
+            for suc in successors[offsets[c]:offsets[c + 1]]:
+                mask |= reachable[suc]
+            reachable[c] = mask
+
+        def params_in(mask: int) -> Set[Node]:
             result = set()
-
-            if node in sub_params:
-                result.add(node)
-
-            for suc in self.weighted_successors(node):
-                if suc not in visited_nodes:
-                    result |= visit_forward(suc)
-
+            while mask:
+                low_bit = mask & -mask
+                result.add(param_list[low_bit.bit_length() - 1])
+                mask ^= low_bit
             return result
 
+        component_params: Dict[int, Set[Node]] = {}
         all_conflicts: Dict[Node, Set[Node]] = {}
         for param in params:
-            sub_params = params - {param}
-            visited_nodes: Set[Node] = set()
-            conflicts = visit_forward(param)
-            all_conflicts[param] = conflicts
+            i = frozen.index.get(param)
+            if i is None:
+                all_conflicts[param] = set()
+                continue
+            c = component[i]
+            if c not in component_params:
+                component_params[c] = params_in(reachable[c])
+            all_conflicts[param] = component_params[c] - {param}
 
         return all_conflicts
 
@@ -132,46 +171,122 @@ class ComputationGraph:
                               of other conflicting parameters
             :return: a set with different combinations (sets) of parameters that can be used
         """
-        def valid_combinations(param: Node, params: Set[Node]) -> Set[frozenset]:
-            result: Set[frozenset] = set()
-            other_params: Set[Node] = params - conflicts[param] - {param}
-            non_conflicting = set()
+        return set(ComputationGraph.iter_param_combinations(conflicts))
 
-            for other in other_params:
-                if param not in conflicts[other]:
-                    non_conflicting.add(other)
+    @staticmethod
+    def iter_param_combinations(conflicts: Dict[Node, Set[Node]], priority: Callable[[Node], Any] = None) \
+            -> Iterator[frozenset]:
+        """ Lazy version of "compute_param_combinations": each valid combination (a maximal set of parameters without
+            conflicts between them) is generated once, so the caller can stop at any moment.
 
-            for other in non_conflicting:
-                for comb in valid_combinations(other, non_conflicting):
-                    result |= {comb | frozenset({param})}
+            Bron-Kerbosch algorithm (with pivot, iterative) on the graph of non conflicting parameters. Parameters
+            without conflicts are in all the combinations.
 
-            if len(result) == 0:
-                result = {frozenset({param})}
+            :param conflicts: a dictionary with an entry for each parameter where the value is a set with the names
+                              of other conflicting parameters
+            :param priority: optional function giving a priority to a parameter. Combinations with the parameters
+                             of higher priority are generated first
+            :return: a generator of combinations (frozensets) of parameters
+        """
+        if not conflicts:
+            return
+
+        # Conflicts in both directions
+        conflicting: Dict[Node, Set[Node]] = {p: set(c) for p, c in conflicts.items()}
+        for p, c in conflicts.items():
+            for other in c:
+                conflicting[other].add(p)
+
+        always = frozenset(p for p, c in conflicting.items() if not c)
+        candidates = [p for p, c in conflicting.items() if c]
+        if priority:
+            candidates.sort(key=priority, reverse=True)
+        order = {p: i for i, p in enumerate(candidates)}
+
+        def non_conflicting(v: Node, nodes: Set[Node]) -> Set[Node]:
+            return nodes - conflicting[v] - {v}
+
+        stack: List[Tuple[frozenset, Set[Node], Set[Node]]] = [(always, set(candidates), set())]
+        while stack:
+            r, p, x = stack.pop()
+            if not p:
+                if not x:
+                    yield r
+                continue
+            # Pivot: the node with more non conflicting nodes in "p", its non conflicting nodes are not branched
+            pivot = min(p | x, key=lambda u: len(p & conflicting[u]) + (u in p))
+            branches = []
+            for v in sorted(p - non_conflicting(pivot, p), key=order.get):
+                branches.append((r | {v}, non_conflicting(v, p), non_conflicting(v, x)))
+                p = p - {v}
+                x = x | {v}
+            stack.extend(reversed(branches))
 
-            return result
+    @staticmethod
+    def select_param_combinations(conflicts: Dict[Node, Set[Node]], max_combinations: Optional[int] = None,
+                                  priority: Callable[[Node], Any] = None,
+                                  rank: Callable[[frozenset], Any] = len) -> List[frozenset]:
+        """ Obtain at most "max_combinations" valid combinations of parameters, the best ranked first.
 
-        combinations: Set[frozenset] = set()
-        param_names = set(conflicts.keys())
-        for p in param_names:
-            combinations |= valid_combinations(p, param_names)
+            NOTE: the ranking is applied to the combinations obtained. If "max_combinations" applies, these are the
+            first ones generated (see "iter_param_combinations"), not necessarily the best ranked of all. By default,
+            parameters with fewer conflicts are tried first, so larger combinations tend to be generated first.
 
+            :param conflicts: a dictionary with an entry for each parameter where the value is a set with the names
+                              of other conflicting parameters
+            :param max_combinations: maximum number of combinations to obtain (None: all)
+            :param priority: optional function giving a priority to a parameter (see "iter_param_combinations").
+                             By default, the number of conflicts of the parameter (negated)
+            :param rank: function ranking a combination, higher is better. By default, the number of parameters
+            :return: a list of combinations (frozensets) of parameters
+        """
+        if priority is None:
+            degree = {p: len(c) for p, c in conflicts.items()}
+            for c in conflicts.values():
+                for other in c:
+                    degree[other] = degree.get(other, 0) + 1
+            priority = (lambda p: -degree[p])
+        combinations = list(itertools.islice(ComputationGraph.iter_param_combinations(conflicts, priority),
+                                             max_combinations))
+        if rank:
+            combinations.sort(key=rank, reverse=True)
         return combinations
 
-    def compute_values(self, nodes: List[Node], params: Dict[Node, Value]) \
+    def freeze(self) -> FrozenGraph:
+        """ Return an array based copy of the computation graph, used in the computations """
+        return FrozenGraph(self.graph)
+
+    def compute_values(self, nodes: List[Node], params: Dict[Node, Value], solver: str = "backward") \
             -> Tuple[Dict[Node, Optional[Value]], Dict[Node, Optional[Value]]]:
         """ Given a computation graph and a set of nodes with values (the parameters) compute the values of
             a list of nodes.
 
+            "backward" solver: walk backwards from each node, computing its inputs first. It uses an explicit stack
+            (no recursion), so there is no limit in the length of the chains, and the values computed for a node are
+            reused for the next ones.
+
         :param nodes: the list of nodes whose value we are interested in
         :param params: a dictionary with an entry for each parameter and its value
+        :param solver: "backward" or "sparse" (see "compute_values_sparse")
         :return: a tuple with 1) the computed values for the desired nodes 2) computed values for other nodes during
                  the process.
         """
-        def solve_inputs(inputs: List[Tuple[Node, Weight]], split: bool) -> Optional[Value]:
+        if solver == "sparse":
+            return self.compute_values_sparse(nodes, params)
+        elif solver != "backward":
+            raise Exception(f"Unknown computation graph solver '{solver}'. Valid solvers: backward, sparse")
+
+        frozen = self.freeze()
+        inputs = frozen.inputs_function()
+        splits = frozen.split.tolist()
+        node_params = {frozen.index[n]: v for n, v in params.items() if n in frozen.index}
+
+        # Computations are generators: they yield the nodes whose values they need, and receive these values
+        def solve_inputs(lst: List[Tuple[int, Weight]], split: bool):
             result = None
 
-            for n, weight in inputs:
-                res_backward = solve_backward(n)
+            for n, weight in lst:
+                res_backward = yield n
 
                 # If node 'n' is a 'split' only one result is needed to compute the result
                 if split:
@@ -185,39 +300,186 @@ class ComputationGraph:
 
             return result
 
-        def solve_backward(node: Node) -> Optional[Value]:
-            # Is the node already computed?
-            if node in values:
-                return values[node]
-
-            # Does a parameter exist for this node?
-            param = params.get(node)
-            if param:
-
-                values[node] = param
-                return param
+        def compute(node: int):
+            split = splits[node]
 
-            if node in pending_nodes:
-                return None
-
-            pending_nodes.append(node)
-
-            split = self.graph.nodes[node]["split"]
-
-            result = solve_inputs(self.direct_inputs(node), split[EdgeType.REVERSE.value])
+            result = yield from solve_inputs(inputs(node, EdgeType.DIRECT.value),
+                                             split & (1 << EdgeType.REVERSE.value))
 
             if not result:
-                result = solve_inputs(self.reverse_inputs(node), split[EdgeType.DIRECT.value])
+                result = yield from solve_inputs(inputs(node, EdgeType.REVERSE.value),
+                                                 split & (1 << EdgeType.DIRECT.value))
 
             values[node] = result
             return result
 
+        def solve_backward(node: int) -> Optional[Value]:
+            stack = []  # Computations in progress
+            requested = node
+            value = None
+            while True:
+                if requested is not None:
+                    # Is the node already computed?
+                    if requested in values:
+                        value = values[requested]
+                    # Does a parameter exist for this node?
+                    elif node_params.get(requested):
+                        value = values[requested] = node_params[requested]
+                    elif requested in pending_nodes:
+                        value = None
+                    else:
+                        pending_nodes.add(requested)
+                        stack.append(compute(requested))
+                        value = None
+                    requested = None
+
+                if not stack:
+                    return value
+
+                try:
+                    requested = stack[-1].send(value)
+                except StopIteration as e:
+                    stack.pop()
+                    value = e.value
+
         results: Dict[Node, Optional[Value]] = {}
-        values: Dict[Node, Optional[Value]] = {}
+        values: Dict[int, Optional[Value]] = {}
 
         for n in nodes:
-            pending_nodes: List[Node] = []
-            value = solve_backward(n)
-            results[n] = value
+            pending_nodes: Set[int] = set()
+            if n in frozen.index:
+                results[n] = solve_backward(frozen.index[n])
+            else:
+                results[n] = params.get(n)
+
+        return results, {frozen.nodes[i]: v for i, v in values.items()}
+
+    def compute_values_sparse(self, nodes: List[Node], params: Dict[Node, Value]) \
+            -> Tuple[Dict[Node, Optional[Value]], Dict[Node, Optional[Value]]]:
+        """ Same as "compute_values", solving a sparse linear system instead of walking the graph backwards
+            (see "compute_values_batch").
+
+            Zero is a valid value, so results differ from the "backward" solver when a parameter (or a computed value)
+            is zero (see "compute_values_batch").
+
+        :param nodes: the list of nodes whose value we are interested in
+        :param params: a dictionary with an entry for each parameter and its value
+        :return: a tuple with 1) the computed values for the desired nodes (None if they cannot be computed)
+                 2) values for all the nodes of the graph (None if not computed)
+        """
+        params = {n: v for n, v in params.items() if v is not None}
+        results, values = self.compute_values_batch(nodes, {n: [v] for n, v in params.items()})
+
+        def scalar(a: np.ndarray) -> Optional[Value]:
+            return a[0].item() if np.isfinite(a[0]) else None
+
+        values = {n: scalar(v) for n, v in values.items()}
+        return {n: scalar(v) for n, v in results.items()}, values
+
+    def sparse_rules(self, known: Set[Node]) -> Dict[Node, List[Tuple[Node, Weight]]]:
+        """ Find the nodes that can be computed from the known nodes, and how.
+
+            Nodes are found in rounds, starting from the known nodes; a node depends only on nodes found in previous
+            rounds. A node is computed from its direct inputs or, if not possible, from its reverse inputs, using the
+            rule of the node: all the inputs (general rule) or the first one available (split rule). Inputs with no
+            weight are not available.
+
+        :param known: nodes with a value
+        :return: a dictionary with an entry for each node that can be computed, with the list of (input, weight)
+        """
+        frozen = self.freeze()
+        rules = self._sparse_rules(frozen, {frozen.index[n] for n in known if n in frozen.index})
+        return {frozen.nodes[i]: [(frozen.nodes[u], w) for u, w in lst] for i, lst in rules.items()}
+
+    @staticmethod
+    def _sparse_rules(frozen: FrozenGraph, known: Set[int]) -> Dict[int, List[Tuple[int, Weight]]]:
+        """ "sparse_rules" with the integer ids of the nodes of a FrozenGraph """
+        inputs = frozen.inputs_function()
+        splits = frozen.split.tolist()
+        targets, out_offsets = frozen.target.tolist(), frozen.out_offsets.tolist()
+
+        def rule(n: int) -> Optional[List[Tuple[int, Weight]]]:
+            split = splits[n]
+            # Direct inputs first (split in the reverse direction), then reverse inputs (split in the direct direction)
+            for edge_type, is_split in ((EdgeType.DIRECT, split & (1 << EdgeType.REVERSE.value)),
+                                        (EdgeType.REVERSE, split & (1 << EdgeType.DIRECT.value))):
+                lst = inputs(n, edge_type.value)
+                if is_split:
+                    for i in lst:
+                        if i[0] in resolved and i[1] is not None:
+                            return [i]
+                elif lst and all(i[0] in resolved and i[1] is not None for i in lst):
+                    return lst
+            return None
+
+        rules: Dict[int, List[Tuple[int, Weight]]] = {}
+        resolved: Set[int] = set(known)
+        frontier = set(resolved)
+        while frontier:
+            # Successors (the edges of a node are consecutive, see FrozenGraph)
+            candidates = {suc for n in frontier for suc in targets[out_offsets[n]:out_offsets[n + 1]]
+                          if suc not in resolved}
+            new_rules = {}
+            for n in candidates:
+                r = rule(n)
+                if r:
+                    new_rules[n] = r
+            rules.update(new_rules)
+            resolved.update(new_rules)
+            frontier = set(new_rules)
+
+        return rules
+
+    def compute_values_batch(self, nodes: List[Node], params: Dict[Node, Sequence[Value]]) \
+            -> Tuple[Dict[Node, np.ndarray], Dict[Node, np.ndarray]]:
+        """ Compute the values of a list of nodes for several sets of values of the same parameters (e.g. scenarios
+            and time periods), at once.
+
+            The equations "x_i - sum(weight_ij * x_j) = sum(weight_ik * param_k)" of the nodes that can be computed
+            (see "sparse_rules") form a sparse linear system. It is lower triangular, because a node depends only on
+            nodes found in previous rounds, so it is solved by forward substitution for all the sets of values at once
+            (the columns of the right hand side). No recursion, so deep chains are not a problem.
+
+            Zero is a valid value. The "backward" solver of "compute_values" takes a zero as "no value" instead: a
+            parameter equal to zero is ignored (the node is computed from its inputs, if possible), and an input equal
+            to zero makes the rule of a node fail (general rule) or skips that input (split rule).
+
+        :param nodes: the list of nodes whose value we are interested in
+        :param params: a dictionary with an entry for each parameter and its values (all of the same length)
+        :return: a tuple with 1) the computed values for the desired nodes 2) values for all the nodes of the graph.
+                 Values are arrays, with NaN where a value cannot be computed
+        """
+        frozen = self.freeze()
+        size = len(next(iter(params.values()))) if params else 1
+        x = np.full((frozen.number_of_nodes, size), np.nan)
+        known = [frozen.index[n] for n in params if n in frozen.index]
+        for i in known:
+            x[i] = params[frozen.nodes[i]]
+        rules = self._sparse_rules(frozen, set(known))
+
+        unknowns = list(rules)  # In the order they were found, so the system is triangular
+        index = {n: i for i, n in enumerate(unknowns)}
+        rows, cols, data = list(range(len(unknowns))), list(range(len(unknowns))), [1.0] * len(unknowns)
+        b = np.zeros((len(unknowns), size))
+        for n, lst in rules.items():
+            i = index[n]
+            for u, weight in lst:
+                if u in index:
+                    rows.append(i)
+                    cols.append(index[u])
+                    data.append(-weight)
+                else:
+                    b[i] += x[u] * weight
+
+        if unknowns:
+            a = scipy.sparse.csr_matrix((data, (rows, cols)), shape=(len(unknowns), len(unknowns)))
+            solution = scipy.sparse.linalg.spsolve_triangular(a, b, lower=True)
+            solution[~np.isfinite(solution)] = np.nan
+            x[unknowns] = solution
+
+        values: Dict[Node, np.ndarray] = {n: x[i] for i, n in enumerate(frozen.nodes)}
+        results: Dict[Node, np.ndarray] = {n: values[n] if n in values else
+                                           np.asarray(params.get(n, np.full(size, np.nan)), dtype=float)
+                                           for n in nodes}
 
         return results, values
@@ -2,7 +2,7 @@ import math
 from enum import Enum
 from functools import reduce
 from operator import add
-from typing import Dict, List, Tuple, Optional, NoReturn, Generator
+from typing import Dict, List, Tuple, Optional, NoReturn, Generator, Set
 import networkx as nx
 
 from backend.solving.graph import Node, Weight, EdgeType
@@ -32,19 +32,56 @@ class FlowGraph:
      - Each edge can have two attributes:
        * Direct weight: a weight affecting the amount of data flowing Top-Down
        * Reverse weight: a weight affecting the amount of data flowing Bottom-Up
+
+    The graph can be edited after an analysis ("add_edge", "remove_edge"). The next analysis only repeats the
+    inference for the nodes whose output edges changed.
     """
     def __init__(self, graph: Optional[nx.DiGraph] = None):
         self._direct_graph = nx.DiGraph()
         self._reverse_graph = nx.DiGraph()
 
+        # State of the analysis, to repeat only what is needed after edits
+        self._acyclic: Optional[bool] = True  # None: unknown
+        self._analyzed = False  # The issues of all the nodes are known
+        self._node_issues: Tuple[Dict[Node, List[Issue]], Dict[Node, List[Issue]]] = ({}, {})  # Direct, reverse
+        self._changed_nodes: Tuple[Set[Node], Set[Node]] = (set(), set())  # Nodes with changes in output edges
+
         if graph:
             for u, v, data in graph.edges(data=True):
                 self.add_edge(u, v, data["weight"], None)
 
     def add_edge(self, u: Node, v: Node, weight: Optional[Weight], reverse_weight: Optional[Weight]) -> NoReturn:
-        """ Add an edge with weight attributes to the flow graph """
-        self._direct_graph.add_edge(u, v, weight=weight)
-        self._reverse_graph.add_edge(v, u, weight=reverse_weight)
+        """ Add an edge with weight attributes to the flow graph (or change the weights, if the edge exists) """
+        if not self._direct_graph.has_edge(u, v) and self._acyclic:
+            # The new edge closes a cycle if "u" can be reached from "v"
+            if u == v or (v in self._direct_graph and u in self._direct_graph and
+                          nx.has_path(self._direct_graph, v, u)):
+                self._acyclic = False
+
+        # New nodes have to be analyzed in both graphs
+        for n in (u, v):
+            if n not in self._direct_graph:
+                for changed in self._changed_nodes:
+                    changed.add(n)
+
+        # "given" is the weight before the inference of missing weights
+        self._direct_graph.add_edge(u, v, weight=weight, given=weight)
+        self._reverse_graph.add_edge(v, u, weight=reverse_weight, given=reverse_weight)
+        self._changed_nodes[EdgeType.DIRECT.value].add(u)
+        self._changed_nodes[EdgeType.REVERSE.value].add(v)
+
+    def remove_edge(self, u: Node, v: Node) -> NoReturn:
+        """ Remove an edge from the flow graph. Nodes left without edges are removed too """
+        self._direct_graph.remove_edge(u, v)
+        self._reverse_graph.remove_edge(v, u)
+        if not self._acyclic:
+            self._acyclic = None
+        self._changed_nodes[EdgeType.DIRECT.value].add(u)
+        self._changed_nodes[EdgeType.REVERSE.value].add(v)
+        for n in (u, v):
+            if self._direct_graph.degree(n) == 0:
+                self._direct_graph.remove_node(n)
+                self._reverse_graph.remove_node(n)
 
     def edges(self) -> Generator[Tuple[Node, Node, Optional[Weight], Optional[Weight]], None, None]:
         """ Return the edges of the flow graph """
@@ -100,67 +137,115 @@ class FlowGraph:
                   * sum > 1: weight cannot be inferred (WARNING)
                   * sum <= 1: weight can be inferred as (1 - sum) (INFO)
 
+        After the first analysis, only the nodes whose output edges have changed (and, in the reverse graph, the
+        nodes whose opposite weights were inferred again) are analyzed.
+
         :return: a list of messages given by the analysis and completion of type INFO, WARNING or ERROR
         """
-        issues: List[Issue] = []
-
         # Checking if graph is acyclic. Just looking at the direct graph is OK.
-        if not nx.algorithms.dag.is_directed_acyclic_graph(self._direct_graph):
-            issues.append(Issue(IType.ERROR, 'The graph contains cycles'))
-            return issues
+        if self._acyclic is None:
+            self._acyclic = nx.algorithms.dag.is_directed_acyclic_graph(self._direct_graph)
+
+        if not self._acyclic:
+            self._analyzed = False
+            return [Issue(IType.ERROR, 'The graph contains cycles')]
+
+        direct, reverse = EdgeType.DIRECT.value, EdgeType.REVERSE.value
+        if not self._analyzed:
+            self._node_issues = ({}, {})
+            for n in nx.algorithms.dag.topological_sort(self._direct_graph):
+                self._node_issues[direct][n] = self._complete_node(self._direct_graph, self._reverse_graph, n, True)
+            for n in nx.algorithms.dag.topological_sort(self._reverse_graph):
+                self._node_issues[reverse][n] = self._complete_node(self._reverse_graph, self._direct_graph, n, False)
+            self._analyzed = True
+        else:
+            for n in self._changed_nodes[direct]:
+                if n not in self._direct_graph:
+                    self._node_issues[direct].pop(n, None)
+                    continue
+                weights = [w for _, _, w in self._direct_graph.out_edges(n, data='weight')]
+                self._node_issues[direct][n] = self._complete_node(self._direct_graph, self._reverse_graph, n, True)
+                if weights != [w for _, _, w in self._direct_graph.out_edges(n, data='weight')]:
+                    # The inferred weights are the opposite weights in the reverse graph
+                    self._changed_nodes[reverse].update(self._direct_graph.successors(n))
+            for n in self._changed_nodes[reverse]:
+                if n not in self._reverse_graph:
+                    self._node_issues[reverse].pop(n, None)
+                    continue
+                self._node_issues[reverse][n] = self._complete_node(self._reverse_graph, self._direct_graph, n, False)
 
-        for graph, opposite_graph in [(self._direct_graph, self._reverse_graph), (self._reverse_graph, self._direct_graph)]:
-            for n in nx.algorithms.dag.topological_sort(graph):
+        for changed in self._changed_nodes:
+            changed.clear()
 
-                graph.nodes[n]['split'] = False
+        return [issue for node_issues in self._node_issues for lst in node_issues.values() for issue in lst]
 
-                # Working on output edges only of node 'n'
-                all_edges = graph.out_edges(n, data=True)
+    @staticmethod
+    def _complete_node(graph: nx.DiGraph, opposite_graph: nx.DiGraph, n: Node, given_opposite: bool) -> List[Issue]:
+        """
+        Infer the missing weights of the output edges of a node, and whether it is a split node (see
+        "analyze_and_complete")
 
-                if len(all_edges) == 0:
-                    continue
+        :param graph: the graph (direct or reverse) being completed
+        :param opposite_graph: the other graph
+        :param n: the node
+        :param given_opposite: use the opposite weights as given (True), or as completed (False)
+        :return: a list of messages given by the analysis and completion of type INFO, WARNING or ERROR
+        """
+        issues: List[Issue] = []
+
+        graph.nodes[n]['split'] = False
 
-                # How many output edges without weight has the node?
-                edges_without_weight = [e for e in all_edges if not e[2]['weight']]
+        # Working on output edges only of node 'n'
+        all_edges = graph.out_edges(n, data=True)
+
+        if len(all_edges) == 0:
+            return issues
 
-                if len(edges_without_weight) > 1:
-                    str_edges = [f'({e[0]}, {e[1]})' for e in edges_without_weight]
+        # Weights inferred in a previous analysis are inferred again
+        for e in all_edges:
+            e[2]['weight'] = e[2]['given']
+
+        # How many output edges without weight has the node?
+        edges_without_weight = [e for e in all_edges if not e[2]['weight']]
+
+        if len(edges_without_weight) > 1:
+            str_edges = [f'({e[0]}, {e[1]})' for e in edges_without_weight]
+            issues.append(Issue(IType.WARNING,
+                                f'The following edges don\'t have a weight: {", ".join(str_edges)}'))
+
+        elif len(edges_without_weight) == 1:
+
+            if len(all_edges) == 1:
+                edge = list(all_edges)[0]
+                opposite_weight = opposite_graph[edge[1]][edge[0]]['given' if given_opposite else 'weight']
+                if opposite_weight:
+                    edge[2]['weight'] = 1.0 / opposite_weight
+                    issues.append(Issue(IType.INFO,
+                                        f'The weight of single output edge "{edge}" could be inferred from '
+                                        f'opposite weight "{opposite_weight}"'))
+                else:
+                    edge[2]['weight'] = 1.0
+                    issues.append(Issue(IType.INFO,
+                                        f'The weight of single output edge "{edge}" could be inferred '
+                                        f'without opposite weight'))
+            else:
+                sum_other_weights = reduce(add, [e[2]['weight'] for e in all_edges if e[2]['weight']])
+
+                if sum_other_weights > 1.0:
                     issues.append(Issue(IType.WARNING,
-                                        f'The following edges don\'t have a weight: {", ".join(str_edges)}'))
-
-                elif len(edges_without_weight) == 1:
-
-                    if len(all_edges) == 1:
-                        edge = list(all_edges)[0]
-                        opposite_weight = opposite_graph[edge[1]][edge[0]]['weight']
-                        if opposite_weight:
-                            edge[2]['weight'] = 1.0 / opposite_weight
-                            issues.append(Issue(IType.INFO,
-                                                f'The weight of single output edge "{edge}" could be inferred from '
-                                                f'opposite weight "{opposite_weight}"'))
-                        else:
-                            edge[2]['weight'] = 1.0
-                            issues.append(Issue(IType.INFO,
-                                                f'The weight of single output edge "{edge}" could be inferred '
-                                                f'without opposite weight'))
-                    else:
-                        sum_other_weights = reduce(add, [e[2]['weight'] for e in all_edges if e[2]['weight']])
-
-                        if sum_other_weights > 1.0:
-                            issues.append(Issue(IType.WARNING,
-                                                f'The weight of edge "{edges_without_weight[0]}" cannot be inferred, '
-                                                f'the sum of other weights is >= 1.0: {sum_other_weights}'))
-                        else:
-                            edges_without_weight[0][2]['weight'] = 1.0 - sum_other_weights
-                            graph.nodes[n]['split'] = True
-                            issues.append(Issue(IType.INFO,
-                                                f'The weight of edge "{edges_without_weight[0]}" could be inferred '
-                                                f'from the sum of other weights'))
-
-                elif len(all_edges) > 1:
-                    # All edges have a weight
-                    sum_all_weights = reduce(add, [e[2]['weight'] for e in all_edges])
-                    if math.isclose(sum_all_weights, 1.0):
-                        graph.nodes[n]['split'] = True
+                                        f'The weight of edge "{edges_without_weight[0]}" cannot be inferred, '
+                                        f'the sum of other weights is >= 1.0: {sum_other_weights}'))
+                else:
+                    edges_without_weight[0][2]['weight'] = 1.0 - sum_other_weights
+                    graph.nodes[n]['split'] = True
+                    issues.append(Issue(IType.INFO,
+                                        f'The weight of edge "{edges_without_weight[0]}" could be inferred '
+                                        f'from the sum of other weights'))
+
+        elif len(all_edges) > 1:
+            # All edges have a weight
+            sum_all_weights = reduce(add, [e[2]['weight'] for e in all_edges])
+            if math.isclose(sum_all_weights, 1.0):
+                graph.nodes[n]['split'] = True
 
         return issues
@@ -0,0 +1,112 @@
+from typing import Dict, List, Tuple, Callable, Optional
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from backend.solving.graph import Node
+
+
+class FrozenGraph:
+    """
+    An immutable, array based, copy of a directed graph, for the loops of the solvers. NetworkX graphs are used to
+    construct (and visualize) graphs, a FrozenGraph is obtained from them once they are complete:
+     - Nodes are integers, the position in 'nodes' ('index' gives the position of a node).
+     - Edges are integers too. Arrays 'source', 'target', 'weight', 'has_weight' and 'type' have the attributes of
+       each edge ('weight' is 0.0 if the edge has no weight).
+     - The output edges of node 'i' are 'out_edges[out_offsets[i]:out_offsets[i+1]]', and the input edges
+       'in_edges[in_offsets[i]:in_offsets[i+1]]' (CSR), in the same order as successors and predecessors in the
+       NetworkX graph.
+     - The 'split' attribute of the nodes is stored as bit flags, bit 'i' for the element 'i' of the attribute (if
+       it is a list) or bit 0 (if it is a boolean).
+    """
+    def __init__(self, graph: nx.DiGraph, weight: str = "weight", edge_type: str = "type", split: str = "split"):
+        self.nodes: List[Node] = list(graph.nodes)
+        self.index: Dict[Node, int] = {n: i for i, n in enumerate(self.nodes)}
+        n_nodes, n_edges = len(self.nodes), graph.number_of_edges()
+
+        self.source = np.empty(n_edges, dtype=np.int32)
+        self.target = np.empty(n_edges, dtype=np.int32)
+        self.weight = np.zeros(n_edges, dtype=np.float64)
+        self.has_weight = np.zeros(n_edges, dtype=np.bool_)
+        self.type = np.zeros(n_edges, dtype=np.int8)
+        self.out_offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        self.in_offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        self.split = np.zeros(n_nodes, dtype=np.uint8)
+
+        # Edges, numbered in the order of the successors of each node
+        edge_ids: Dict[Tuple[int, int], int] = {}
+        e = 0
+        for u, successors in graph.succ.items():
+            i = self.index[u]
+            for v, data in successors.items():
+                j = self.index[v]
+                self.source[e], self.target[e] = i, j
+                w = data.get(weight)
+                if w is not None:
+                    self.weight[e], self.has_weight[e] = w, True
+                t = data.get(edge_type)
+                if t is not None:
+                    self.type[e] = t.value
+                edge_ids[(i, j)] = e
+                e += 1
+            self.out_offsets[i + 1] = e
+        self.out_edges = np.arange(n_edges, dtype=np.int32)
+
+        # Input edges, in the order of the predecessors of each node
+        in_edges = []
+        for v, predecessors in graph.pred.items():
+            j = self.index[v]
+            in_edges.extend(edge_ids[(self.index[u], j)] for u in predecessors)
+            self.in_offsets[j + 1] = len(in_edges)
+        self.in_edges = np.array(in_edges, dtype=np.int32)
+
+        for n, s in graph.nodes(data=split):
+            if isinstance(s, (list, tuple)):
+                self.split[self.index[n]] = sum(1 << b for b, flag in enumerate(s) if flag)
+            elif s:
+                self.split[self.index[n]] = 1
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.source)
+
+    def successors(self, i: int) -> np.ndarray:
+        """ Return the successors of node 'i' """
+        return self.target[self.out_edges[self.out_offsets[i]:self.out_offsets[i + 1]]]
+
+    def predecessors(self, i: int) -> np.ndarray:
+        """ Return the predecessors of node 'i' """
+        return self.source[self.in_edges[self.in_offsets[i]:self.in_offsets[i + 1]]]
+
+    def inputs_function(self) -> Callable[[int, int], List[Tuple[int, Optional[float]]]]:
+        """ Return a function giving the inputs (predecessor, weight or None) of a node through edges of a type. The
+            arrays are converted to lists once, which are faster to access one element at a time """
+        source, types = self.source.tolist(), self.type.tolist()
+        weight = [w if h else None for w, h in zip(self.weight.tolist(), self.has_weight.tolist())]
+        in_edges, in_offsets = self.in_edges.tolist(), self.in_offsets.tolist()
+
+        def inputs(i: int, edge_type: int) -> List[Tuple[int, Optional[float]]]:
+            return [(source[e], weight[e]) for e in in_edges[in_offsets[i]:in_offsets[i + 1]] if types[e] == edge_type]
+
+        return inputs
+
+    def is_split(self, i: int, bit: int) -> bool:
+        return bool(self.split[i] & (1 << bit))
+
+    def adjacency_matrix(self, edge_mask: np.ndarray = None) -> scipy.sparse.csr_matrix:
+        """ Return the (sparse) adjacency matrix of the graph, considering only the edges in 'edge_mask' if given """
+        source, target = (self.source, self.target) if edge_mask is None else \
+                         (self.source[edge_mask], self.target[edge_mask])
+        return scipy.sparse.csr_matrix((np.ones(len(source), dtype=np.int8), (source, target)),
+                                       shape=(self.number_of_nodes, self.number_of_nodes))
+
+    def strongly_connected_components(self, edge_mask: np.ndarray = None) -> Tuple[int, np.ndarray]:
+        """ Return the number of strongly connected components and the component of each node """
+        return scipy.sparse.csgraph.connected_components(self.adjacency_matrix(edge_mask), directed=True,
+                                                         connection="strong")
@@ -65,7 +65,7 @@ class TestCommandFiles(unittest.TestCase):
         file_path = os.path.dirname(os.path.abspath(__file__)) + "/z_input_files/test_spreadsheet_upscale_reduced.xlsx"
         isess = execute_file(file_path, generator_type="spreadsheet")
         # # Save state
-        s = serialize_state(isess.state)
+        s = serialize_state(isess.state, as_text=True)
         with open("/home/rnebot/GoogleDrive/AA_MAGIC/MiniAlmeria.serialized", "wt") as f:
             f.write(s)
         local_state = deserialize_state(s)
@@ -124,7 +124,7 @@ class TestCommandFiles(unittest.TestCase):
         file_path = os.path.dirname(os.path.abspath(__file__)) + "/z_input_files/Soslaires.xlsx"
         isess = execute_file(file_path, generator_type="spreadsheet")
         # # Save state
-        s = serialize_state(isess.state)
+        s = serialize_state(isess.state, as_text=True)
         with open("/home/rnebot/GoogleDrive/AA_MAGIC/Soslaires.serialized", "wt") as f:
             f.write(s)
         local_state = deserialize_state(s)
@@ -2,7 +2,8 @@ import unittest
 import sqlalchemy
 
 # Memory
-from backend.model_services.workspace import InteractiveSession, CreateNew, prepare_and_reset_database_for_tests
+from backend.model_services.workspace import InteractiveSession, CreateNew, prepare_and_reset_database_for_tests, \
+    ReproducibleSession
 from backend.command_executors import create_command
 from backend.restful_service import tm_default_users, \
     tm_authenticators, \
@@ -338,6 +339,47 @@ class TestHighLevelUseCases(unittest.TestCase):
 
         isess.quit()
 
+    def test_006_checkpoint_and_journal(self):
+        prepare_and_reset_database_for_tests(True)
+        interval = ReproducibleSession.checkpoint_interval
+        ReproducibleSession.checkpoint_interval = 2
+        try:
+            # One command: only the journal is saved
+            uuid_, isess = new_case_study(with_metadata_command=3)
+            session = DBSession()
+            self.assertIsNone(session.query(CaseStudyVersion).first().state)
+            self.assertIsNone(session.query(CaseStudyVersionSession).first().state)
+            session.close()
+
+            # Reopen: State is recovered replaying the journal. Second command: a checkpoint is due
+            isess.reset_state()
+            isess.open_reproducible_session(case_study_version_uuid=uuid_,
+                                            recover_previous_state=True,
+                                            cr_new=CreateNew.NO,
+                                            allow_saving=True)
+            self.assertIsNotNone(isess._state.get("_metadata"))
+            d_cmd, _ = create_command("dummy", None, {"name": "var_a", "description": "Content"})
+            issues, output = isess.execute_executable_command(d_cmd)
+            isess.register_executable_command(d_cmd)
+            uuid2, _, _ = isess.close_reproducible_session(issues, output, save=True)
+            session = DBSession()
+            self.assertIsNotNone(session.query(CaseStudyVersion).first().state)
+            self.assertIsNotNone(session.query(CaseStudyVersionSession).first().state)
+            session.close()
+
+            # Reopen: State is restored from the checkpoint
+            isess.reset_state()
+            isess.open_reproducible_session(case_study_version_uuid=uuid2,
+                                            recover_previous_state=True,
+                                            cr_new=CreateNew.NO,
+                                            allow_saving=True)
+            self.assertIsNotNone(isess._state.get("_metadata"))
+            self.assertIsNotNone(isess._state.get("var_a"))
+            isess.close_reproducible_session()
+            isess.quit()
+        finally:
+            ReproducibleSession.checkpoint_interval = interval
+
     #
     # def test_submit_worksheet_new_case_study(self):
     #     """
@@ -0,0 +1,56 @@
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from backend.common.columnar import ColumnarWriter, ColumnarReader
+
+
+def write_and_read(dfs):
+    w = ColumnarWriter()
+    positions = [w.add_frame(df) for df in dfs]
+    buffer = io.BytesIO()
+    w.write(buffer)
+    r = ColumnarReader(memoryview(bytearray(buffer.getvalue())))
+    return r, positions
+
+
+class TestColumnarStorage(unittest.TestCase):
+    def test_dtypes_preserved(self):
+        n = 100
+        df = pd.DataFrame({"int": np.arange(n),
+                           "float": np.random.rand(n),
+                           "bool": np.arange(n) % 2 == 0,
+                           "category": pd.Categorical(np.random.choice(["x", "y", "z"], n), ordered=True),
+                           "codes": np.random.choice(["ES", "IT", None], n),
+                           "date": pd.date_range("2000-01-01", periods=n),
+                           "mixed": [1, "a"] * (n // 2),
+                           "tz": pd.date_range("2000-01-01", periods=n, tz="Europe/Madrid")})
+        r, positions = write_and_read([df])
+        df2 = r.frame(positions[0])
+        assert_frame_equal(df, df2)
+        self.assertEqual(list(df.dtypes), list(df2.dtypes))
+        self.assertEqual(r.shape(positions[0]), df.shape)
+        # Columns can be modified
+        df2.iloc[0, 0] = -1
+
+    def test_indices_and_nulls(self):
+        dfs = [pd.DataFrame({"v": np.random.rand(6)},
+                            index=pd.MultiIndex.from_product([["a", "b"], [2000, 2001, 2002]], names=["geo", "time"])),
+               pd.DataFrame(np.random.rand(3, 4), columns=pd.MultiIndex.from_product([["x", "y"], ["p", "q"]])),
+               pd.DataFrame({"a": [1, 2]}, index=pd.CategoricalIndex(["u", "v"], name="c")),
+               pd.DataFrame({"x": ["a", np.nan], "y": [None, None]}),
+               pd.DataFrame([[1, 2]], columns=["a", "a"]),
+               pd.DataFrame(columns=["a", "b"])]
+        r, positions = write_and_read(dfs)
+        for df, i in zip(dfs, positions):
+            df2 = r.frame(i)
+            assert_frame_equal(df, df2)
+            self.assertEqual(list(df.dtypes), list(df2.dtypes))
+        self.assertIsNone(r.frame(positions[3])["y"][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import random
 import unittest
 from typing import List, Set, Dict, Tuple, Optional, NoReturn, Callable
 
@@ -292,6 +293,77 @@ def create_test_data_star2() -> Tuple[FlowGraph, ComputationGraph, List[SubTestC
     return flow_graph, comp_graph, subtest_cases
 
 
+def param_conflicts_by_search(graph: ComputationGraph, params: Set[str]) -> Dict[str, Set[str]]:
+    """ Conflicts obtained with a forward search from each parameter, to compare """
+    conflicts = {}
+    for param in params:
+        visited = {param}
+        pending = [param]
+        while pending:
+            for suc in graph.weighted_successors(pending.pop()):
+                if suc not in visited:
+                    visited.add(suc)
+                    pending.append(suc)
+        conflicts[param] = (visited & params) - {param}
+    return conflicts
+
+
+def param_combinations_recursive(conflicts: Dict[str, Set[str]]) -> Set[frozenset]:
+    """ Valid combinations of parameters obtained recursively, to compare """
+    def valid_combinations(param: str, params: Set[str]) -> Set[frozenset]:
+        result: Set[frozenset] = set()
+        non_conflicting = {other for other in params - conflicts[param] - {param} if param not in conflicts[other]}
+        for other in non_conflicting:
+            for comb in valid_combinations(other, non_conflicting):
+                result |= {comb | frozenset({param})}
+        return result if result else {frozenset({param})}
+
+    combinations: Set[frozenset] = set()
+    for p in conflicts:
+        combinations |= valid_combinations(p, set(conflicts))
+    return combinations
+
+
+def values_recursive(graph: ComputationGraph, nodes: List[str], params: Dict[str, float]) \
+        -> Tuple[Dict[str, Optional[float]], Dict[str, Optional[float]]]:
+    """ Values computed walking backwards recursively, to compare """
+    def solve_inputs(inputs, split):
+        result = None
+        for n, weight in inputs:
+            res_backward = solve_backward(n)
+            if split:
+                if res_backward:
+                    return res_backward * weight
+            else:
+                if res_backward:
+                    result = (result if result else 0) + res_backward * weight
+                else:
+                    return None
+        return result
+
+    def solve_backward(node):
+        if node in values:
+            return values[node]
+        if params.get(node):
+            values[node] = params[node]
+            return params[node]
+        if node in pending_nodes:
+            return None
+        pending_nodes.append(node)
+        split = graph.graph.nodes[node]["split"]
+        result = solve_inputs(graph.direct_inputs(node), split[1])
+        if not result:
+            result = solve_inputs(graph.reverse_inputs(node), split[0])
+        values[node] = result
+        return result
+
+    results, values = {}, {}
+    for n in nodes:
+        pending_nodes = []
+        results[n] = solve_backward(n)
+    return results, values
+
+
 class TestComputationGraph(unittest.TestCase):
     computation_graphs: Dict[FlowGraph, ComputationGraph] = {}
     subtest_cases: Dict[ComputationGraph, List[SubTestCase]] = {}
@@ -363,3 +435,138 @@ class TestComputationGraph(unittest.TestCase):
 
                         for param, value in results.items():
                             self.assertAlmostEqual(value, case.results[(param, combination)])
+
+    def test_compute_values_sparse(self):
+        for g, graph in enumerate(self.subtest_cases):
+            for c, case in enumerate(self.subtest_cases[graph]):
+                with self.subTest(graph=g, case=c):
+                    nodes = list({k[0] for k in case.results})
+                    for combination in case.combinations:
+                        filtered_params = {k: case.params[k] for k in combination}
+                        results, _ = graph.compute_values(nodes, filtered_params)
+                        sparse_results, _ = graph.compute_values(nodes, filtered_params, solver="sparse")
+
+                        for param, value in results.items():
+                            if value is None:
+                                self.assertIsNone(sparse_results[param])
+                            else:
+                                self.assertAlmostEqual(sparse_results[param], value)
+
+    def test_compute_values_sparse_long_chain(self):
+        comp_graph = ComputationGraph()
+        n = 5000  # Deeper than the recursion limit
+        for i in range(n):
+            comp_graph.add_edge(i, i + 1, 1.001, None)
+        comp_graph.add_edge("x", n, None, None)
+        results, values = comp_graph.compute_values([n - 1, n, "x"], {0: 2.0}, solver="sparse")
+        self.assertAlmostEqual(results[n - 1], 2.0 * 1.001 ** (n - 1))
+        self.assertIsNone(results[n])  # An input without weight
+        self.assertIsNone(results["x"])
+        self.assertEqual(len(values), n + 2)
+        with self.assertRaises(Exception):
+            comp_graph.compute_values([n], {0: 2.0}, solver="other")
+
+    def test_compute_values_zero_parameter(self):
+        comp_graph = ComputationGraph()
+        comp_graph.add_edge("a", "c", 2.0, None)
+        comp_graph.add_edge("b", "c", 1.0, None)
+        params = {"a": 0.0, "b": 3.0}
+        # "backward": zero is "no value", so "c" (needing both inputs) cannot be computed
+        results, _ = comp_graph.compute_values(["a", "c"], params)
+        self.assertIsNone(results["a"])
+        self.assertIsNone(results["c"])
+        # "sparse": zero is a value
+        results, _ = comp_graph.compute_values(["a", "c"], params, solver="sparse")
+        self.assertEqual(results["a"], 0.0)
+        self.assertAlmostEqual(results["c"], 3.0)
+
+    def test_parameters_conflicts_random_graphs(self):
+        rnd = random.Random(7)
+        for g in range(30):
+            comp_graph = ComputationGraph()
+            nodes = [f"n{i}" for i in range(rnd.randint(2, 40))]
+            for _ in range(rnd.randint(1, 60)):
+                u, v = rnd.sample(nodes, 2)
+                comp_graph.add_edge(u, v, rnd.choice([None, 0.0, 0.5, 2.0]), rnd.choice([None, 1.0]))
+            params = set(rnd.sample(list(comp_graph.nodes), rnd.randint(1, len(comp_graph.nodes))))
+            with self.subTest(graph=g):
+                self.assertDictEqual(param_conflicts_by_search(comp_graph, params),
+                                     comp_graph.compute_param_conflicts(params))
+
+    def test_parameters_conflicts_many_parameters(self):
+        comp_graph = ComputationGraph()
+        for i in range(10000):  # 10000 independent chains "p_i -> q_i -> r_i", with "p_i" and "r_i" observed
+            comp_graph.add_edge(f"p{i}", f"q{i}", 1.0, None)
+            comp_graph.add_edge(f"q{i}", f"r{i}", 1.0, None)
+        params = {f"p{i}" for i in range(10000)} | {f"r{i}" for i in range(10000)}
+        conflicts = comp_graph.compute_param_conflicts(params)
+        self.assertEqual(conflicts["p5"], {"r5"})
+        self.assertEqual(conflicts["r5"], set())
+
+    def test_parameters_combinations_random_conflicts(self):
+        rnd = random.Random(11)
+        for c in range(40):
+            params = [f"p{i}" for i in range(rnd.randint(1, 9))]
+            conflicts = {p: {o for o in params if o != p and rnd.random() < 0.3} for p in params}
+            with self.subTest(case=c):
+                self.assertSetEqual(param_combinations_recursive(conflicts),
+                                    ComputationGraph.compute_param_combinations(conflicts))
+        self.assertSetEqual(ComputationGraph.compute_param_combinations({}), set())
+
+    def test_parameters_combinations_bounded(self):
+        # 30 pairs of conflicting parameters, plus one without conflicts: 2^30 combinations
+        conflicts = {f"a{i}": {f"b{i}"} for i in range(30)}
+        conflicts.update({f"b{i}": set() for i in range(30)})
+        conflicts["c"] = set()
+        combinations = ComputationGraph.select_param_combinations(conflicts, max_combinations=5)
+        self.assertEqual(len(combinations), 5)
+        self.assertEqual(len(set(combinations)), 5)
+        for combination in combinations:
+            self.assertEqual(len(combination), 31)
+            self.assertIn("c", combination)
+        # Priority: combinations with "b" parameters first
+        first = next(ComputationGraph.iter_param_combinations(conflicts, priority=lambda p: p.startswith("b")))
+        self.assertEqual(first, frozenset({f"b{i}" for i in range(30)} | {"c"}))
+        # Ranking
+        conflicts = {"a": {"b", "c"}, "b": set(), "c": set()}
+        self.assertEqual(ComputationGraph.select_param_combinations(conflicts), [frozenset({"b", "c"}), frozenset({"a"})])
+        self.assertEqual(ComputationGraph.select_param_combinations(conflicts, rank=lambda c: "a" in c)[0],
+                         frozenset({"a"}))
+        # By default, parameters with fewer conflicts first: the largest combination, even if it is not the first one
+        # in the order of the parameters
+        self.assertEqual(ComputationGraph.select_param_combinations(conflicts, 1), [frozenset({"b", "c"})])
+        # The ranking only applies to the combinations obtained
+        self.assertEqual(ComputationGraph.select_param_combinations(conflicts, 1, priority=lambda p: p == "a"),
+                         [frozenset({"a"})])
+
+    def test_compute_values_random_graphs(self):
+        rnd = random.Random(3)
+        for g in range(60):
+            comp_graph = ComputationGraph()
+            nodes = [f"n{i}" for i in range(rnd.randint(2, 25))]
+            for _ in range(rnd.randint(1, 40)):
+                u, v = rnd.sample(nodes, 2)
+                comp_graph.add_edge(u, v, rnd.choice([0.5, 2.0, 1.5]), rnd.choice([None, 1.0, 0.25]))
+            for n in comp_graph.nodes:
+                comp_graph.graph.nodes[n]["split"] = [rnd.random() < 0.3, rnd.random() < 0.3]
+            params = {n: rnd.choice([1.0, 3.0, 0]) for n in rnd.sample(list(comp_graph.nodes), 2)}
+            nodes = list(comp_graph.nodes)
+            rnd.shuffle(nodes)
+            with self.subTest(graph=g):
+                try:
+                    expected = values_recursive(comp_graph, nodes, params)
+                except TypeError:  # Input without weight
+                    with self.assertRaises(TypeError):
+                        comp_graph.compute_values(nodes, params)
+                    continue
+                self.assertEqual(expected, comp_graph.compute_values(nodes, params))
+
+    def test_compute_values_long_chain(self):
+        comp_graph = ComputationGraph()
+        n = 20000  # Deeper than the recursion limit
+        for i in range(n):
+            comp_graph.add_edge(i, i + 1, 1.0001, 1 / 1.0001)
+            comp_graph.init_node_split(i)
+        results, values = comp_graph.compute_values([n, n // 2], {0: 2.0})
+        self.assertAlmostEqual(results[n], 2.0 * 1.0001 ** n)
+        self.assertEqual(len(values), n + 1)
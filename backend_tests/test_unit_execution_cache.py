@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import openpyxl
+
+import backend
+from backend.model_services import State, get_case_study_registry_objects
+from backend.models.musiasem_concepts import Processor
+from backend.model_services.execution_cache import ExecutionCache, state_key, command_key
+from backend.model_services.workspace import execute_command_container_file
+from backend.command_executors import create_command
+
+
+def dummy_commands(*values):
+    return json.dumps([{"command": "dummy", "content": {"name": f"var_{i}", "description": v}}
+                       for i, v in enumerate(values)]).encode("utf-8")
+
+
+class TestExecutionCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        backend.execution_cache = None
+        self.directory.cleanup()
+
+    def test_command_key(self):
+        cmd1, _ = create_command("dummy", None, {"name": "a", "description": "x"})
+        cmd2, _ = create_command("dummy", None, {"name": "a", "description": "y"})
+        k0 = state_key(b"initial")
+        self.assertEqual(command_key(k0, cmd1), command_key(k0, cmd1))
+        self.assertNotEqual(command_key(k0, cmd1), command_key(k0, cmd2))
+        self.assertNotEqual(command_key(k0, cmd1), command_key(state_key(b"other"), cmd1))
+        # Not a registered command: no key
+        self.assertIsNone(command_key(k0, object()))
+
+    def test_least_recently_used_evicted(self):
+        cache = ExecutionCache(self.directory.name, 2500)
+        cache.put("a", b"a" * 1000, [], None)
+        cache.put("b", b"b" * 1000, [], None)
+        # "a" used after "b" was written
+        self.assertEqual(cache.get("a")[0], b"a" * 1000)
+        cache.put("c", b"c" * 1000, [], None)
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "b.nisx")))
+        self.assertEqual(cache.get("a")[0], b"a" * 1000)
+        self.assertEqual(cache.get("c")[0], b"c" * 1000)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        # Larger than the budget: not stored
+        cache.put("d", b"d" * 3000, [], None)
+        self.assertIsNone(cache.get("d"))
+
+    def test_entries_found_on_startup(self):
+        cache = ExecutionCache(self.directory.name, 2500)
+        cache.put("a", b"a" * 1000, [], None)
+        cache.put("b", b"b" * 1000, [], None)
+        # "a" used after "b" was written (order kept in the modification times)
+        t = time.time()
+        os.utime(os.path.join(self.directory.name, "b.nisx"), (t - 10, t - 10))
+        os.utime(os.path.join(self.directory.name, "a.nisx"), (t - 5, t - 5))
+        cache = ExecutionCache(self.directory.name, 2500)
+        cache.put("c", b"c" * 1000, [], None)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a")[0], b"a" * 1000)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions")
+    def test_shared_directory_rejected(self):
+        os.chmod(self.directory.name, 0o777)
+        with self.assertRaises(Exception):
+            ExecutionCache(self.directory.name, 2500)
+
+    def test_execution_restored(self):
+        backend.execution_cache = cache = ExecutionCache(self.directory.name, 2**30)
+        state = State()
+        execute_command_container_file(state, "native", "application/json", dummy_commands("one", "two"))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        # Same commands on the same State: the whole file is restored
+        state2 = State()
+        execute_command_container_file(state2, "native", "application/json", dummy_commands("one", "two"))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(state2.get("var_0"), "one")
+        self.assertEqual(state2.get("var_1"), "two")
+
+        # The second command changes: the first is restored, the second is executed
+        state3 = State()
+        execute_command_container_file(state3, "native", "application/json", dummy_commands("one", "three"))
+        self.assertEqual((cache.hits, cache.misses), (2, 5))
+        self.assertEqual(state3.get("var_0"), "one")
+        self.assertEqual(state3.get("var_1"), "three")
+
+        # A different initial State does not reuse anything
+        state4 = State()
+        state4.set("var_2", "other")
+        execute_command_container_file(state4, "native", "application/json", dummy_commands("one", "two"))
+        self.assertEqual((cache.hits, cache.misses), (2, 8))
+        self.assertEqual(state4.get("var_2"), "other")
+
+    def test_workbook_reexecuted_from_first_changed_worksheet(self):
+        file_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        with open(os.path.join(os.path.dirname(__file__), "z_input_files/v2/14_processor_scalings_example.xlsx"),
+                  "rb") as f:
+            original = f.read()
+        # Change the last worksheet, "ProcessorScalings"
+        wb = openpyxl.load_workbook(io.BytesIO(original))
+        wb.worksheets[-1].cell(row=2, column=6).value = 0.3
+        b = io.BytesIO()
+        wb.save(b)
+        changed = b.getvalue()
+
+        # Reference, without cache
+        reference = State()
+        reference_issues, _ = execute_command_container_file(reference, "spreadsheet", file_type, changed)
+
+        backend.execution_cache = cache = ExecutionCache(self.directory.name, 2**30)
+        execute_command_container_file(State(), "spreadsheet", file_type, original)
+        hits, misses = cache.hits, cache.misses
+        state = State()
+        issues, _ = execute_command_container_file(state, "spreadsheet", file_type, changed)
+        # Three worksheets restored, the fourth executed (the file itself is a miss)
+        self.assertEqual((cache.hits - hits, cache.misses - misses), (3, 2))
+        self.assertEqual([str(i) for i in issues], [str(i) for i in reference_issues])
+        glb_idx = get_case_study_registry_objects(state)[0]
+        reference_glb_idx = get_case_study_registry_objects(reference)[0]
+        self.assertEqual(sorted(p.full_hierarchy_names(glb_idx)[0] for p in glb_idx.get(Processor.partial_key())),
+                         sorted(p.full_hierarchy_names(reference_glb_idx)[0]
+                                for p in reference_glb_idx.get(Processor.partial_key())))
+
+
+if __name__ == '__main__':
+    unittest.main()
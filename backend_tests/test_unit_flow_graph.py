@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from backend.solving.graph.flow_graph import FlowGraph, IType
+
+
+def state(flow_graph: FlowGraph):
+    """ Weights and "split" attributes, to compare flow graphs """
+    edges = {(u, v): (w, rw) for u, v, w, rw in flow_graph.edges()}
+    splits = {n: (flow_graph._direct_graph.nodes[n].get("split"), flow_graph._reverse_graph.nodes[n].get("split"))
+              for n in flow_graph.nodes}
+    return edges, splits
+
+
+class TestIncrementalFlowGraph(unittest.TestCase):
+    def test_same_as_new_graph(self):
+        rnd = random.Random(5)
+        nodes = [f"n{i}" for i in range(12)]
+        for g in range(20):
+            flow_graph = FlowGraph()
+            edges = {}
+            for step in range(25):
+                u, v = rnd.sample(nodes, 2)
+                if (u, v) in edges and rnd.random() < 0.4:
+                    flow_graph.remove_edge(u, v)
+                    del edges[(u, v)]
+                else:
+                    edges[(u, v)] = (rnd.choice([None, None, 0.3, 0.5, 0.7, 2.0]), rnd.choice([None, None, 0.5]))
+                    flow_graph.add_edge(u, v, *edges[(u, v)])
+                if rnd.random() < 0.5:
+                    continue
+                issues = flow_graph.analyze_and_complete()
+                new_flow_graph = FlowGraph()
+                for (a, b), (w, rw) in edges.items():
+                    new_flow_graph.add_edge(a, b, w, rw)
+                new_issues = new_flow_graph.analyze_and_complete()
+                with self.subTest(graph=g, step=step):
+                    self.assertEqual(sorted(str(i) for i in issues), sorted(str(i) for i in new_issues))
+                    if not any(i.itype == IType.ERROR for i in issues):
+                        self.assertEqual(state(flow_graph), state(new_flow_graph))
+
+    def test_only_changed_nodes(self):
+        flow_graph = FlowGraph()
+        for i in range(100):
+            flow_graph.add_edge(f"a{i}", f"b{i}", None, None)
+        flow_graph.add_edge("b0", "c", 0.4, None)
+        flow_graph.add_edge("b0", "d", None, None)
+        self.assertEqual(len(flow_graph.analyze_and_complete()), 203)
+        self.assertAlmostEqual(flow_graph._direct_graph["b0"]["d"]["weight"], 0.6)
+
+        analyzed = []
+        complete_node = FlowGraph._complete_node
+        flow_graph._complete_node = lambda g, o, n, given: analyzed.append(n) or complete_node(g, o, n, given)
+        flow_graph.add_edge("b0", "c", 0.1, None)
+        flow_graph.analyze_and_complete()
+        self.assertEqual(set(analyzed), {"b0", "c", "d"})
+        self.assertAlmostEqual(flow_graph._direct_graph["b0"]["d"]["weight"], 0.9)
+
+        # A cycle, then removed
+        flow_graph.add_edge("d", "a0", 1.0, None)
+        self.assertEqual(flow_graph.analyze_and_complete()[0].itype, IType.ERROR)
+        flow_graph.remove_edge("d", "a0")
+        self.assertEqual(len(flow_graph.analyze_and_complete()), 203)
+        self.assertIsNotNone(flow_graph.get_computation_graph()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import math
+import unittest
+from collections import namedtuple
+
+from backend import ureg
+
+from backend.common.helper import PartialRetrievalDictionary
+from backend.models.musiasem_concepts import Parameter, ParameterDependencies
+from backend.solving.flow_graph_solver import evaluate_parameters_for_scenarios, evaluate_parameters_for_scenario, \
+    get_parameter_dependencies, reevaluate_parameters, create_scales_graph, set_update_scales_graph, \
+    solve_flow_graphs
+
+
+def parameter(name, default_value):
+    p = Parameter(name)
+    p._default_value = default_value
+    return p
+
+
+class TestEvaluateParametersForScenarios(unittest.TestCase):
+    def test_same_as_one_scenario_at_a_time(self):
+        base = [parameter("p1", "2"),
+                parameter("p2", "p1 * 3 + 1"),
+                parameter("p3", "?p1 > 3 -> p1 / 2, p1 <= 3 -> cos(p1)?"),
+                parameter("p4", "p1 > 0.5 AND p1 < 500"),
+                parameter("P5", "-P1 + 200"),
+                parameter("p6", "'abc'")]
+        scenarios = {f"s{i}": {"p1": str(1 + i * 0.5)} for i in range(50)}
+        scenarios["s7"] = {"p2": "p1 - 10 + 20"}
+        res = evaluate_parameters_for_scenarios(base, scenarios)
+        for i, scenario_params in enumerate(scenarios.values()):
+            for param, value in evaluate_parameters_for_scenario(base, scenario_params).items():
+                msg = f"Scenario {i}, parameter {param}"
+                # NumPy and "math" functions may differ in the last digit
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.assertAlmostEqual(res[param].tolist()[i], value, msg=msg)
+                else:
+                    self.assertEqual(res[param].tolist()[i], value, msg)
+        self.assertEqual(res["p2"].dtype, float)
+        self.assertEqual(res["p4"].dtype, bool)
+
+    def test_dependencies_in_order(self):
+        base = [parameter("c", "b * 2"), parameter("b", "a + 1"), parameter("a", "1")]
+        res = evaluate_parameters_for_scenarios(base, {"s1": {}, "s2": {"a": "10"}, "s3": {"b": "'x'", "c": "5"}})
+        self.assertEqual(res["b"].tolist(), [2, 11, "x"])
+        self.assertEqual(res["c"].tolist(), [4, 22, 5])
+        # A parameter missing in one of the scenarios
+        with self.assertRaises(Exception):
+            evaluate_parameters_for_scenarios(base, {"s1": {}, "s2": {"a": "z + 1"}})
+        # Circular dependencies
+        with self.assertRaises(Exception):
+            evaluate_parameters_for_scenarios(base, {"s1": {"a": "c + 1"}})
+
+
+class TestParameterDependencies(unittest.TestCase):
+    def test_downstream(self):
+        deps = ParameterDependencies()
+        deps.add("b", {"A"})
+        deps.add("c", {"b", "a"})
+        deps.add("d", {"x"})
+        self.assertEqual(deps.dependencies("c"), {"a", "b"})
+        self.assertEqual(deps.downstream(["a"]), ["b", "c"])
+        self.assertEqual(deps.downstream(["b"]), ["c"])
+        self.assertEqual(deps.downstream(["c"]), [])
+        deps.add("a", {"c"})
+        with self.assertRaises(Exception):
+            deps.downstream(["a"])
+
+    def test_reevaluate_only_downstream(self):
+        glb_idx = PartialRetrievalDictionary()
+        for p in [parameter("p1", "2"), parameter("p2", "p1 * 3"), parameter("p3", "5"), parameter("p4", "p2 + p3")]:
+            glb_idx.put(p.key(), p)
+        deps = get_parameter_dependencies(glb_idx)
+        self.assertIs(get_parameter_dependencies(glb_idx), deps)
+        params = dict(p1=2, p2=6, p3=5, p4=11)
+        changed, objects = reevaluate_parameters(glb_idx, params, {"p1": "4"})
+        self.assertEqual(dict(changed), dict(p1=4, p2=12, p4=17))
+        self.assertEqual(objects, {})
+        self.assertEqual(params, dict(p1=4, p2=12, p3=5, p4=17))
+        changed, _ = reevaluate_parameters(glb_idx, params, {"p3": "1"})
+        self.assertEqual(dict(changed), dict(p3=1, p4=13))
+        # A new object in the registry: the dependencies are obtained again
+        p = parameter("p5", "p4 * 2")
+        glb_idx.put(p.key(), p)
+        self.assertIsNot(get_parameter_dependencies(glb_idx), deps)
+        params["p5"] = 26
+        changed, _ = reevaluate_parameters(glb_idx, params, {"p2": "0.5"})
+        self.assertEqual(dict(changed), dict(p2=0.5, p4=1.5, p5=3))
+
+    def test_dependencies_obtained_again_after_modifications(self):
+        glb_idx = PartialRetrievalDictionary()
+        p1, p2, p3 = parameter("p1", "2"), parameter("p2", "p1 * 3"), parameter("p3", "p1 + 1")
+        for p in [p1, p2, p3]:
+            glb_idx.put(p.key(), p)
+        deps = get_parameter_dependencies(glb_idx)
+        # Deleted
+        glb_idx.delete(p3.key())
+        deps2 = get_parameter_dependencies(glb_idx)
+        self.assertIsNot(deps2, deps)
+        self.assertEqual(deps2.downstream(["p1"]), ["p2"])
+        # Changed in place and stored again (same object, no new object in the registry)
+        glb_idx.delete(p2.key())
+        p2._default_value = "5"
+        glb_idx.put(p2.key(), p2)
+        self.assertEqual(get_parameter_dependencies(glb_idx).downstream(["p1"]), [])
+
+    def test_reevaluate_evaluated_changes(self):
+        glb_idx = PartialRetrievalDictionary()
+        for p in [parameter("p1", "2"), parameter("p2", "p1 * 3")]:
+            glb_idx.put(p.key(), p)
+        # All the changed values are known: "p2" is not evaluated again from its expression
+        params = dict(p1=2, p2=6)
+        changed, _ = reevaluate_parameters(glb_idx, params, {"p1": 4, "p2": 7}, evaluated=True)
+        self.assertEqual(dict(changed), dict(p1=4, p2=7))
+        self.assertEqual(params, dict(p1=4, p2=7))
+
+
+Relation = namedtuple("Relation", "origin destination quantity")
+Observation = namedtuple("Observation", "attributes")
+
+
+class TestScalesGraph(unittest.TestCase):
+    def test_scale_chain_units(self):
+        graph = create_scales_graph([Relation("a", "b", "2"), Relation("b", "c", "30"), Relation("x", "y", "0.5")])
+        set_update_scales_graph(graph, {"k": 10},
+                                {"a": ("5", Observation({"unit": "tonne"})),
+                                 "x": ("k * 4", Observation({"unit": "m^3"}))})
+        self.assertEqual(graph.nodes["a"]["value"], 5 * ureg("tonne"))
+        self.assertEqual(graph.nodes["b"]["value"], 10 * ureg("tonne"))
+        self.assertAlmostEqual(graph.nodes["c"]["value"].magnitude, 300)
+        self.assertAlmostEqual(graph.nodes["y"]["value"].magnitude, 20)
+        # In the unit of the beginning of the chain, not in base units
+        for n in ["a", "b", "c"]:
+            self.assertEqual(graph.nodes[n]["value"].units, ureg("tonne").units)
+        self.assertEqual(graph.nodes["y"]["value"].units, ureg("m^3").units)
+
+
+class TestSolveFlowGraphs(unittest.TestCase):
+    def test_cube(self):
+        cases = {}
+        for scenario in range(2):
+            for period in range(3):
+                weights = {("A", "B"): 2.0, ("B", "C"): 0.5 if period < 2 else 0.25, ("D", "C"): 1.0}
+                cases[(scenario, period)] = (weights, {"A": 10.0 * (scenario + 1) + period, "D": 1.0})
+        values, interfaces = solve_flow_graphs(cases, 2, 3)
+        self.assertEqual(interfaces, ["A", "B", "C", "D"])
+        self.assertEqual(values.shape, (2, 3, 4))
+        for (scenario, period), (weights, params) in cases.items():
+            a = params["A"]
+            self.assertEqual(values[scenario, period].tolist(),
+                             [a, a * 2, a * 2 * weights[("B", "C")] + 1, 1.0])
+        # Interface without value
+        del cases[(1, 2)][1]["D"]
+        values, _ = solve_flow_graphs(cases, 2, 3)
+        self.assertTrue(math.isnan(values[1, 2, 3]))
+        self.assertTrue(math.isnan(values[1, 2, 2]))
+        self.assertEqual(values[1, 2, 1], 44.0)
+
+    def test_components_in_parallel(self):
+        cases = {}
+        for period in range(4):
+            weights = {}
+            params = {}
+            for region in range(6):  # Independent components
+                weights.update({(f"R{region}:A", f"R{region}:B"): 1.5 + region, (f"R{region}:B", f"R{region}:C"): 0.5})
+                params[f"R{region}:A"] = 10.0 + period
+            cases[(0, period)] = (weights, params)
+        values, interfaces = solve_flow_graphs(cases, 1, 4)
+        parallel_values, parallel_interfaces = solve_flow_graphs(cases, 1, 4, workers=3)
+        self.assertEqual(interfaces, parallel_interfaces)
+        self.assertEqual(values.tolist(), parallel_values.tolist())
+        self.assertEqual(values[0, 3, interfaces.index("R2:C")], 13.0 * 3.5 * 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
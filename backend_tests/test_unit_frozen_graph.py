@@ -0,0 +1,45 @@
+import unittest
+
+import networkx as nx
+
+from backend.solving.graph import EdgeType
+from backend.solving.graph.computation_graph import ComputationGraph
+from backend.solving.graph.frozen_graph import FrozenGraph
+
+
+class TestFrozenGraph(unittest.TestCase):
+    def test_arrays(self):
+        comp_graph = ComputationGraph()
+        comp_graph.add_edge("C", "B", 0.5, None)
+        comp_graph.add_edge("A", "B", 2.0, 0.25)
+        comp_graph.mark_node_split("B", True, EdgeType.REVERSE)
+        frozen = comp_graph.freeze()
+        self.assertEqual(frozen.number_of_nodes, 3)
+        self.assertEqual(frozen.number_of_edges, 4)
+        b = frozen.index["B"]
+        # Same order as the NetworkX graph
+        self.assertEqual([frozen.nodes[i] for i in frozen.predecessors(b)], list(comp_graph.graph.predecessors("B")))
+        self.assertEqual([frozen.nodes[i] for i in frozen.successors(b)], list(comp_graph.graph.successors("B")))
+        inputs = frozen.inputs_function()
+        self.assertEqual([(frozen.nodes[u], w) for u, w in inputs(b, EdgeType.DIRECT.value)],
+                         comp_graph.direct_inputs("B"))
+        self.assertEqual([(frozen.nodes[u], w) for u, w in inputs(frozen.index["C"], EdgeType.REVERSE.value)],
+                         [("B", None)])
+        self.assertTrue(frozen.is_split(b, EdgeType.REVERSE.value))
+        self.assertFalse(frozen.is_split(b, EdgeType.DIRECT.value))
+
+    def test_strongly_connected_components(self):
+        g = nx.DiGraph()
+        g.add_edge(1, 2, weight=1.0)
+        g.add_edge(2, 1, weight=None)
+        g.add_edge(2, 3, weight=1.0)
+        frozen = FrozenGraph(g)
+        n, components = frozen.strongly_connected_components()
+        self.assertEqual(n, 2)
+        self.assertEqual(components[0], components[1])
+        n, components = frozen.strongly_connected_components(frozen.has_weight)
+        self.assertEqual(n, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ pyximport.install(reload_support=True)
 
 from backend.common.helper_accel import augment_dataframe_with_mapped_columns2
 import backend.common.helper
-from backend.common.helper import PartialRetrievalDictionary, augment_dataframe_with_mapped_columns, create_dictionary
+from backend.common.helper import PartialRetrievalDictionary, augment_dataframe_with_mapped_columns, create_dictionary, \
+    unit_to_base
 from backend.models.musiasem_concepts import Processor, ProcessorsRelationPartOfObservation, Observer
 from backend.models.musiasem_methodology_support import (
                                                       serialize_from_object,
@@ -266,5 +267,16 @@ class TestPartialKeyDictionary(unittest.TestCase):
         self.assertEqual(len(res), 0)
 
 
+class TestUnitToBase(unittest.TestCase):
+    def test_unit_to_base(self):
+        factor, unit = unit_to_base("tonne")
+        self.assertEqual(factor, 1000.0)
+        self.assertEqual(unit, backend.ureg("kg").units)
+        self.assertAlmostEqual(unit_to_base("km/hour")[0], 1 / 3.6)
+        self.assertEqual(unit_to_base("EUR")[0], 1.0)
+        self.assertEqual(unit_to_base("")[0], 1.0)
+        self.assertIs(unit_to_base("tonne")[1], unit)  # Cached
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -166,6 +166,55 @@ class ModelBuildingHierarchies(unittest.TestCase):
 
         # TODO Register Aliases for the Processor (in "obtain_relation")
 
+    def test_state_snapshot_with_datasets(self):
+        import pandas as pd
+        from backend.models.statistical_datasets import Dataset, Dimension
+        from backend.restful_service.serialization import is_state_snapshot, list_datasets, DatasetHandle
+
+        state = prepare_simple_processors_hierarchy()
+        _, _, _, datasets, _ = get_case_study_registry_objects(state)
+        ds = Dataset()
+        ds.code = "ds1"
+        dim = Dimension()
+        dim.code = "geo"
+        dim.dataset = ds
+        ds.data = pd.DataFrame({"geo": ["ES", "IT"], "value": [1.5, 2.0]})
+        datasets["ds1"] = ds
+
+        for as_text in (False, True):
+            s = serialize_state(state, as_text=as_text)
+            self.assertTrue(is_state_snapshot(s))
+            # The serialized State is not modified
+            self.assertIs(datasets["ds1"], ds)
+            state2 = deserialize_state(s)
+            glb_idx, _, _, datasets2, _ = get_case_study_registry_objects(state2)
+            self.assertEqual(len(glb_idx.get(Processor.partial_key("P1.P2"))), 1)
+            # Datasets are loaded on first use
+            self.assertIsInstance(datasets2["ds1"], DatasetHandle)
+            self.assertFalse(datasets2["ds1"].materialized)
+            self.assertEqual(list_datasets(state2), [("ds1", 2, 2, int(ds.data.memory_usage(True).sum()))])
+            self.assertFalse(datasets2["ds1"].materialized)
+            # Serializing again does not need to load them
+            state3 = deserialize_state(serialize_state(state2))
+            self.assertFalse(datasets2["ds1"].materialized)
+            for datasets3 in (datasets2, get_case_study_registry_objects(state3)[3]):
+                self.assertEqual([d.code for d in datasets3["ds1"].dimensions], ["geo"])
+                self.assertTrue(datasets3["ds1"].data.equals(ds.data))
+                self.assertTrue(datasets3["ds1"].materialized)
+
+    def test_state_snapshot_shared_datasets(self):
+        from backend.models.statistical_datasets import Dataset
+
+        state = prepare_simple_processors_hierarchy()
+        _, _, _, datasets, _ = get_case_study_registry_objects(state)
+        ds = Dataset()
+        ds.code = "ds1"  # No data
+        datasets["ds1"] = ds
+        state.set("last_dataset", ds)
+        state2 = deserialize_state(serialize_state(state))
+        # Referenced twice, deserialized once
+        self.assertIs(get_case_study_registry_objects(state2)[3]["ds1"], state2.get("last_dataset"))
+
 
 class ModelBuildingQuantativeObservations(unittest.TestCase):
     @classmethod
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from backend.command_generators.parser_ast_evaluators import ast_evaluator, compile_ast, compiled_expression, \
+    compile_ast_vectorized, ast_variables
+from backend.command_generators.parser_field_parsers import string_to_ast, expression_with_parameters
+from backend.model_services import State
+
+
+class TestCompileAST(unittest.TestCase):
+    def setUp(self):
+        self.state = State()
+        self.state.set("p1", 3)
+        self.state.set("p2", 0.5)
+        self.state.set("name", "abc")
+
+    def test_same_result_as_evaluator(self):
+        for e in ["5", "1.5", "1e-3", "'Hola'", "True", "p1", "p1 * 2 + p2", "p1 / 2", "p1 // 2", "p1 % 2",
+                  "(p1 + 1) * (p2 - 1)", "p1 - 1 - 1", "1 + 2 * 3", "p1 > 2", "p1 <= 2", "p1 == 3", "p1 <> 3",
+                  "p1 > 2 AND p2 < 1", "p1 < 2 OR p2 > 1", "?p1 > 2 -> 1, p1 <= 2 -> 2?", "?p1 > 5 -> 1?",
+                  "?p3 > 2 -> 1, p1 > 2 -> p2?", "cos(0)", "sin(p2 * 2)", "unknown(p1)", "cos(p3)", "p3 + 1",
+                  "p3 * p1", "p1 + p3 + p4", "[Ref2019]", "name + 'd'", "{p1} * 3", "p1 + True"]:
+            ast = string_to_ast(expression_with_parameters, e)
+            issues = []
+            expected = ast_evaluator(ast, self.state, None, issues)
+            compiled_issues = []
+            self.assertEqual(compile_ast(ast)(self.state, compiled_issues), expected, e)
+            self.assertEqual(compiled_issues, issues, e)
+        # Evaluated many times, with different values
+        f = compile_ast(string_to_ast(expression_with_parameters, "p1 * 2 + p2"))
+        for v in range(1, 5):
+            self.state.set("p1", v)
+            self.assertEqual(f(self.state), (v * 2 + 0.5, set()))
+
+    def test_unary_operators(self):
+        # "ast_evaluator" fails with unary operators
+        self.assertEqual(compiled_expression("-5")(self.state), (-5, set()))
+        self.assertEqual(compiled_expression("2 * -p1")(self.state), (-6, set()))
+        self.assertEqual(compiled_expression("NOT p1 > 2")(self.state), (False, set()))
+
+    def test_compiled_once(self):
+        f = compiled_expression("p1 + 1")
+        self.assertIs(compiled_expression("p1 + 1"), f)
+        self.assertIs(compiled_expression(f.ast), compiled_expression(f.ast))
+        self.assertEqual(compiled_expression(f.ast)(self.state), (4, set()))
+
+
+    def test_vectorized(self):
+        p1 = [1, 2.5, 3, -4]
+        p2 = [0.5, 2, 0.25, 1]
+        for e in ["p1 * 2 + p2", "p1 / p2 - 1", "p1 > 2 AND p2 < 1", "p1 > 2 OR p2", "-p1 + 1", "NOT p1 > 2",
+                  "cos(p1) * sin(p2)", "?p1 > 2 -> p2 + 10, p1 <= 2 -> 3?", "5", "(p1 > 2) + (p2 > 1)", "p1 // 2 % 2"]:
+            ast = string_to_ast(expression_with_parameters, e)
+            f = compile_ast_vectorized(ast)
+            res = f({"p1": np.array(p1), "p2": np.array(p2)}, 4).tolist()
+            for i in range(4):
+                self.state.set("p1", p1[i])
+                self.state.set("p2", p2[i])
+                self.assertAlmostEqual(res[i], compile_ast(ast)(self.state)[0], msg=e)
+        self.assertIsNone(compile_ast_vectorized(string_to_ast(expression_with_parameters, "name + 'd'")))
+        with self.assertRaises(FloatingPointError):
+            compile_ast_vectorized(string_to_ast(expression_with_parameters, "1 / p2"))({"p2": np.array([1., 0.])}, 2)
+        self.assertEqual(ast_variables(string_to_ast(expression_with_parameters, "?p3 > 2 -> cos(p4)? + p1")),
+                         {"p1", "p3", "p4"})
+
+
+if __name__ == '__main__':
+    unittest.main()
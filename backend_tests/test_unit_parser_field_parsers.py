@@ -0,0 +1,122 @@
+import json
+import unittest
+
+import pyparsing
+
+from backend.command_generators.parser_field_parsers import string_to_ast, ast_cache, ASTCache, \
+    expression_with_parameters, simple_ident, processor_names, ast_to_json, ast_from_json, fast_paths
+from backend.command_executors.execution_helpers import parse_line
+
+
+class TestASTCache(unittest.TestCase):
+    def setUp(self):
+        self.max_size = ast_cache.max_size
+        ast_cache.clear()
+
+    def tearDown(self):
+        ast_cache.max_size = self.max_size
+        ast_cache.clear()
+
+    def test_hit_returns_copy(self):
+        hits, misses = ast_cache.hits, ast_cache.misses
+        ast = string_to_ast(expression_with_parameters, "p1 * 2 + p2")
+        self.assertEqual((ast_cache.hits - hits, ast_cache.misses - misses), (0, 1))
+        # Modify the returned AST, it must not affect the cached one
+        ast["terms"].append("x")
+        ast2 = string_to_ast(expression_with_parameters, "p1 * 2 + p2")
+        self.assertEqual((ast_cache.hits - hits, ast_cache.misses - misses), (1, 1))
+        self.assertNotIn("x", ast2["terms"])
+        ast_cache.max_size = 0
+        ast3 = string_to_ast(expression_with_parameters, "p1 * 2 + p2")
+        self.assertEqual(ast3, ast2)
+        # Same input, different rule: a different entry
+        ast_cache.max_size = self.max_size
+        self.assertEqual(string_to_ast(simple_ident, "p1"), "p1")
+        self.assertNotEqual(string_to_ast(expression_with_parameters, "p1"), "p1")
+
+    def test_syntax_error_cached(self):
+        hits, misses = ast_cache.hits, ast_cache.misses
+        for _ in range(2):
+            with self.assertRaises(pyparsing.ParseException):
+                string_to_ast(expression_with_parameters, "2 +* 3")
+        self.assertEqual((ast_cache.hits - hits, ast_cache.misses - misses), (1, 1))
+
+    def test_least_recently_used_evicted(self):
+        cache = ASTCache(2)
+        cache.put(simple_ident, "a", "a")
+        cache.put(simple_ident, "b", "b")
+        self.assertEqual(cache.get(simple_ident, "a"), "a")
+        cache.put(simple_ident, "c", "c")
+        self.assertIsNone(cache.get(simple_ident, "b"))
+        self.assertEqual(cache.get(simple_ident, "a"), "a")
+        self.assertEqual(len(cache), 2)
+        # Disabled
+        cache = ASTCache(0)
+        cache.put(simple_ident, "a", "a")
+        self.assertIsNone(cache.get(simple_ident, "a"))
+
+
+class TestASTToJSON(unittest.TestCase):
+    def test_round_trip(self):
+        for rule, value in [(processor_names, "{a}.h{c}ola{b}.sdf{c}"),
+                            (processor_names, "Farm..Crop"),
+                            (expression_with_parameters, "p1 * 2 + p2")]:
+            ast = string_to_ast(rule, value)
+            self.assertEqual(ast_from_json(json.loads(json.dumps(ast_to_json(ast)))), ast)
+        self.assertIsInstance(ast_from_json(ast_to_json(string_to_ast(processor_names, "{a}b")))["variables"], set)
+        with self.assertRaises(TypeError):
+            ast_to_json({"value": object()})
+
+    def test_parse_line_reuses_asts(self):
+        class Field:
+            parser = processor_names
+        item = {"processor": "a{b}", "_row": 2, "_asts": {"processor": ast_to_json({"type": "pre-parsed"})}}
+        self.assertEqual(parse_line(item, {"processor": Field}), {"processor": {"type": "pre-parsed"}})
+        del item["_asts"]
+        self.assertEqual(parse_line(item, {"processor": Field})["processor"]["variables"], {"b"})
+
+
+# Values for the differential test of the fast paths: common shapes and corner cases
+fast_path_corpus = ["Wheat", "p1", "OF_MCR1", "Agrochemicals_cost", "b_a", "A_A_", "a_b_c", "X1_y.Z_w", "a.b", "A.B2.c",
+                    "nama_10_a64", "9ab", "5_", "_a", "a..b", "a.", ".a", "Farm..", "..Crop", "{a}b", "a{b}",
+                    "Beans:Beans", "Farm:Fuel", "a.b:c.d", ":x", "a:", "a::b", "a:b:c",
+                    "0", "05", "14562", "0.7", "118.733333333333", "1.", ".5", "1e5", "1E-3", "2.5e+10", "1.5.3",
+                    "-5", "+5", "1 + 2", "p1 * 2", "p1*2", "True", "False", "true", "AND", "OR", "NOT", "and",
+                    "x AND y", "C10-C12", "O-Q", "R-U", "-", "'a'", '"a"', "#a#", "[prov1]", "f(x)", "a b",
+                    " a", "a ", " 5", "5 ", "\ta", "a\tb", "a\t", "a\n", "", "   ", "Tomato – pumpkin",
+                    "Inventario Regadíos 2008", "40% capacity factor", "Desalination: 623 kW; Pumping: 912 kW",
+                    "a\nb", "ñ", "a.ñ", "١٢"]
+
+
+def ast_without_fast_path(rule, value):
+    res = rule.parseString(value, parseAll=True).asList()[0]
+    while isinstance(res, list):
+        res = res[0]
+    return res
+
+
+class TestFastPaths(unittest.TestCase):
+    def test_same_ast_as_rule(self):
+        recognized = 0
+        for rule, fast_path in fast_paths.items():
+            for value in fast_path_corpus:
+                ast = fast_path(value)
+                if ast is None:
+                    continue
+                recognized += 1
+                try:
+                    expected = ast_without_fast_path(rule, value)
+                except Exception as e:
+                    self.fail(f"'{value}' recognized by the fast path of {rule}, but not by the rule: {e}")
+                self.assertEqual(ast, expected, f"'{value}', {rule}")
+                self.assertEqual(repr(ast), repr(expected))  # Same types (e.g. int and float), same order
+        self.assertGreater(recognized, 100)
+
+    def test_fallback(self):
+        self.assertIsNone(fast_paths[expression_with_parameters]("True"))
+        self.assertEqual(string_to_ast(expression_with_parameters, "True"), {'type': 'boolean', 'value': True})
+        self.assertEqual(string_to_ast(processor_names, "Farm..")["expandable"], True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import datetime
+import io
+import os
+import unittest
+
+import numpy as np
+import openpyxl
+
+from backend.command_generators.parser_spreadsheet_utils import WorksheetArray, worksheet_to_array, \
+    binary_mask_from_worksheet, obtain_rectangular_submatrices
+
+
+def sample_workbook() -> bytes:
+    wb = openpyxl.Workbook()
+    sh = wb.active
+    sh.title = "Sample"
+    sh.append(["Processor", "Value", "Flag", "Date"])
+    sh.append(["P1", 1, True, datetime.datetime(2018, 1, 2)])
+    sh.append(["P2", 2.5, False, None])
+    sh.cell(row=5, column=6).value = "far"  # Gap of one row and one column
+    sh.merge_cells("A7:C8")
+    sh.cell(row=7, column=1).value = "merged"
+    b = io.BytesIO()
+    wb.save(b)
+    return b.getvalue()
+
+
+class TestWorksheetArray(unittest.TestCase):
+    def test_read_only_equals_full_mode(self):
+        data = sample_workbook()
+        full = worksheet_to_array(openpyxl.load_workbook(io.BytesIO(data), data_only=True)["Sample"])
+        wb = openpyxl.load_workbook(io.BytesIO(data), data_only=True, read_only=True)
+        streamed = worksheet_to_array(wb["Sample"])
+        wb.close()
+        self.assertIsInstance(streamed, WorksheetArray)
+        self.assertEqual(streamed.values.shape, (8, 6))
+        self.assertEqual(streamed.values.tolist(), full.values.tolist())
+        self.assertEqual(streamed.merged_cell_ranges, ["A7:C8"])
+        self.assertEqual(streamed.cell(row=2, column=2).value, 1)
+        self.assertIs(streamed.cell(row=2, column=3).value, True)
+        self.assertEqual(streamed.cell(row=2, column=4).value, datetime.datetime(2018, 1, 2))
+        self.assertEqual(streamed.cell(row=3, column=2).value, 2.5)
+        # Outside the array: empty
+        self.assertIsNone(streamed.cell(row=100, column=100).value)
+
+    def test_mask_and_area(self):
+        data = sample_workbook()
+        wb = openpyxl.load_workbook(io.BytesIO(data), data_only=True, read_only=True)
+        sh = worksheet_to_array(wb["Sample"])
+        m = binary_mask_from_worksheet(sh, False)
+        self.assertEqual(m.shape, (8, 6))
+        self.assertTrue(m[6:8, 0:3].all())  # Merged
+        self.assertFalse(m[3].any())
+        self.assertEqual(obtain_rectangular_submatrices(m, only_remove_empty_bottom=True), [(0, 8, 0, 6)])
+        # Numbers only (booleans are ints, as before)
+        m = binary_mask_from_worksheet(sh, True)
+        self.assertEqual(np.argwhere(m).tolist(), [[1, 1], [1, 2], [2, 1]])
+
+    def test_declared_dimension_not_used(self):
+        # The worksheet declares 1048576 rows, only a few have values
+        path = os.path.join(os.path.dirname(__file__), "z_input_files/reproduce_million_rows.xlsx")
+        wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
+        sh = wb.worksheets[0]
+        self.assertEqual(sh.max_row, 1048576)
+        a = worksheet_to_array(sh)
+        wb.close()
+        self.assertLess(a.max_row, 100)
+        full = worksheet_to_array(openpyxl.load_workbook(path, data_only=True).worksheets[0])
+        self.assertEqual(a.values.tolist(), full.values[:a.max_row, :a.max_column].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
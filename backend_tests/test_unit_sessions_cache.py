@@ -0,0 +1,86 @@
+import unittest
+
+from backend.restful_service.session_codec import SessionBlobCodec, CODECS
+from backend.restful_service.sessions_cache import InteractiveSessionsCache
+
+
+class TestInteractiveSessionsCache(unittest.TestCase):
+    def test_checkout_requires_same_stamp(self):
+        c = InteractiveSessionsCache(4)
+        o = object()
+        c.checkin("sid", "s1", o)
+        self.assertIsNone(c.checkout("sid", "s2"))
+        # A failed checkout drops the stale entry
+        self.assertEqual(len(c), 0)
+        c.checkin("sid", "s1", o)
+        self.assertIs(c.checkout("sid", "s1"), o)
+        # Checked out objects are not shared
+        self.assertIsNone(c.checkout("sid", "s1"))
+        self.assertEqual((c.hits, c.misses), (1, 2))
+
+    def test_not_written_discarded(self):
+        c = InteractiveSessionsCache(4)
+        o = object()
+        c.checkin("sid", "s1", o)
+        # A request checks it out, maybe modifies it, and ends without writing it to REDIS (e.g. an error response)
+        self.assertIs(c.checkout("sid", "s1"), o)
+        c.end_checkout("sid", "s1", o, written=False)
+        self.assertEqual(len(c), 0)
+        self.assertIsNone(c.checkout("sid", "s1"))
+        # Written under a new stamp: kept
+        c.end_checkout("sid", "s2", o, written=True)
+        self.assertIs(c.checkout("sid", "s2"), o)
+
+    def test_lru_eviction(self):
+        c = InteractiveSessionsCache(2)
+        c.checkin("a", "1", "A")
+        c.checkin("b", "1", "B")
+        c.checkin("a", "1", "A")
+        c.checkin("c", "1", "C")
+        self.assertEqual(len(c), 2)
+        self.assertIsNone(c.checkout("b", "1"))
+        self.assertEqual(c.checkout("a", "1"), "A")
+
+    def test_shared_readers(self):
+        c = InteractiveSessionsCache(4)
+        o = object()
+        c.checkin("sid", "s1", o, shared=True)
+        # Concurrent readers obtain the same object, it stays in the cache
+        self.assertIs(c.share("sid", "s1"), o)
+        self.assertEqual(len(c), 1)
+        # A writer cannot take it while it is being read
+        self.assertIsNone(c.checkout("sid", "s1"))
+        c.release("sid", o)
+        c.release("sid", o)
+        self.assertIs(c.checkout("sid", "s1"), o)
+
+    def test_disabled(self):
+        c = InteractiveSessionsCache(0)
+        c.checkin("a", "1", "A")
+        self.assertIsNone(c.checkout("a", "1"))
+
+
+class TestSessionBlobCodec(unittest.TestCase):
+    def test_round_trip_and_metrics(self):
+        payload = '{"py/object": "backend.model_services.workspace.InteractiveSession", "\u00e1": 1}' * 100
+        for codec in CODECS:
+            c = SessionBlobCodec(codec)
+            b = c.encode(payload, "isession")
+            self.assertEqual(c.decode(b, "isession"), payload)
+            m = c.metrics()["isession"]
+            self.assertEqual((m["encoded"], m["decoded"]), (1, 1))
+            self.assertEqual(m["raw_bytes"], len(payload.encode("utf-8")))
+            self.assertEqual(m["compressed_bytes"], len(b))
+            if codec != "none":
+                self.assertLess(len(b), len(payload))
+            # Any codec can read the others, and uncompressed payloads
+            self.assertEqual(SessionBlobCodec("zlib").decode(b), payload)
+        self.assertEqual(SessionBlobCodec().decode(payload), payload)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(Exception):
+            SessionBlobCodec("unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()